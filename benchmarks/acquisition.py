@@ -0,0 +1,369 @@
+"""Measure the throughput of the acquisition pipeline with a simulated camera and DAQ
+
+Frames triggered by the simulated DAQ go through Camera.loop, are saved to disk by
+Camera.live_save and shown by a stand-in of the live preview, exactly as during an
+experiment. Each configuration runs in its own process so the peak memory is its own.
+
+Usage:
+    python benchmarks/acquisition.py --sizes 1024 512 256 --lights 1 2 4 --framerates 57 100
+    python benchmarks/acquisition.py --output results.json
+"""
+
+import argparse
+import ctypes
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import numpy as np
+from src import controls
+from src.controls import Camera, DAQ, Instrument
+from src.recording import RECORDING_FILE
+
+try:
+    import resource
+except ModuleNotFoundError:
+    resource = None
+
+LIGHTS = ["infrared", "red", "green", "blue"]
+
+
+class BenchmarkCamera(Camera):
+    def __init__(self, port, name):
+        """A camera recording when each frame is triggered and saved
+
+        Args:
+            port (str): The name of the camera physical trigger port
+            name (str): The name of the camera
+        """
+        super().__init__(port, name)
+        self.triggers = []
+        self.saved = []
+        trigger = self.cam.trigger
+
+        def record_trigger(frame_times):
+            if len(frame_times) > 0:
+                self.triggers.append((self.cam.acquired_count(), frame_times))
+            trigger(frame_times)
+
+        self.cam.trigger = record_trigger
+
+    def open_writer(self, path, append=False, binning=1):
+        """Open the recording writer and record the time at which frames are on disk"""
+        writer = super().open_writer(path, append, binning)
+        if os.path.basename(path) != RECORDING_FILE:
+            return writer
+        recording_append = writer.recording.append
+
+        def record_append(frames):
+            recording_append(frames)
+            self.saved.append((writer.recording.frame_count, time.perf_counter()))
+
+        writer.recording.append = record_append
+        return writer
+
+    def trigger_times(self, frame_indices):
+        """Return the time at which frames were triggered by the DAQ
+
+        Args:
+            frame_indices (array): The framegrabber index of the frames
+
+        Returns:
+            array: The trigger time of each frame (from time.perf_counter)
+        """
+        first_index, frame_times = self.triggers[0]
+        return np.asarray(frame_times)[np.asarray(frame_indices) - first_index]
+
+    def save_times(self, count):
+        """Return the time at which the first frames read were saved
+
+        Args:
+            count (int): The number of frames
+
+        Returns:
+            array: The save time of each frame (from time.perf_counter)
+        """
+        released, times = np.array(self.saved).T
+        return times[np.searchsorted(released, np.arange(count), side="right")]
+
+
+def peak_rss():
+    """Return the peak resident memory of the process in MB, None if unavailable"""
+    if resource is not None:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    try:
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", ctypes.c_ulong),
+                ("PageFaultCount", ctypes.c_ulong),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters),
+            counters.cb,
+        )
+        return counters.PeakWorkingSetSize / 1e6
+    except Exception:
+        return None
+
+
+def preview(camera, light_count, running, updates):
+    """Show the last frame of the first light like the live preview does
+
+    Args:
+        camera (Camera): The camera acquiring the frames
+        light_count (int): The number of lights used
+        running (Event): Cleared to stop the preview
+        updates (list): The time of each preview update is appended to this list
+    """
+    queue = camera.queue
+    queue.wait(lambda: camera.video_running or not running.is_set())
+    while camera.video_running and running.is_set():
+        frames_shown = queue.buffer.frames_written
+        frame = queue.latest(0, light_count)
+        if frame is not None:
+            np.clip(frame / 4095 * 255, 0, 255).astype(np.uint8)
+            updates.append(time.perf_counter())
+        time.sleep(0.4 if queue.spilling() else 0.04)
+        queue.wait(
+            lambda: queue.buffer.frames_written > frames_shown
+            or not camera.video_running
+            or not running.is_set()
+        )
+
+
+def run_benchmark(
+    size,
+    lights,
+    framerate,
+    duration,
+    chunk_size=None,
+    directory=None,
+    ram_budget=None,
+    packed=False,
+    compression="None",
+):
+    """Acquire, save and preview simulated frames and measure the pipeline performance
+
+    Args:
+        size (int): The width and height of the frames (1024 divided by the binning)
+        lights (int): The number of lights used (the DAQ drives up to four)
+        framerate (float): The acquisition framerate
+        duration (float): The duration of the acquisition in seconds
+        chunk_size (int): The number of frames per saved file. Defaults to the camera's.
+        directory (str): The folder in which frames are saved. Defaults to a temporary one.
+        ram_budget (float): The memory for the frames in MB. Defaults to the configured one.
+        packed (bool): If True, frames are saved packed in 12 bits. Defaults to False.
+        compression (str): "Zlib", "LZMA" or "None". Defaults to "None".
+
+    Returns:
+        dict: The measured performance
+    """
+    controls.config["Widefield Computer"] = False
+    controls.config["Camera Backend"] = "Simulated"
+    controls.config["Binning"] = 1024 // size
+    if ram_budget is not None:
+        controls.config["RAM Budget (MB)"] = ram_budget
+    controls.config["Pack 12-bit Frames"] = packed
+    controls.config["Compression"] = compression
+    camera = BenchmarkCamera(controls.config["Ports"]["camera"], "benchmark")
+    if chunk_size is not None:
+        camera.chunk_size = chunk_size
+    # Like the real camera, only acquire frames triggered by the DAQ
+    camera.cam.trigger([])
+    daq = DAQ(
+        "dev1",
+        [
+            Instrument(controls.config["Ports"][light], light)
+            for light in LIGHTS[:lights]
+        ],
+        [
+            Instrument("ao0", "air-pump"),
+            Instrument("ao1", "air-pump2"),
+            Instrument(controls.config["Ports"]["co2"], "air-pump3"),
+        ],
+        camera,
+        framerate,
+        min(0.01, 0.5 / framerate),
+    )
+    time_values = np.linspace(0, duration, int(round(duration * daq.sample_rate)))
+    daq.launch(
+        "benchmark",
+        time_values,
+        [
+            np.zeros(len(time_values)),
+            np.zeros(len(time_values)),
+            np.full(len(time_values), False),
+        ],
+    )
+    camera.allocate_buffer()
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = directory or temporary_directory
+        saver = threading.Thread(target=camera.live_save, args=(directory,))
+        preview_running = threading.Event()
+        preview_running.set()
+        preview_updates = []
+        previewer = threading.Thread(
+            target=preview, args=(camera, lights, preview_running, preview_updates)
+        )
+        saver.start()
+        previewer.start()
+        daq.run()
+        saver.join()
+        preview_running.clear()
+        camera.queue.notify()
+        previewer.join()
+        camera.queue.remove_scratch_file()
+        saved_bytes = os.path.getsize(os.path.join(directory, RECORDING_FILE))
+
+    records = camera.frame_log.get()
+    expected_frames = int(camera.expected_frames[-1])
+    results = {
+        "Size": size,
+        "Lights": lights,
+        "Framerate": framerate,
+        "Duration (s)": duration,
+        "Packed 12-bit": camera.packs_frames(),
+        "Expected Frames": expected_frames,
+        "Acquired Frames": int(camera.frames_read),
+        "Dropped Frames": int(camera.frame_log.dropped_frames)
+        + max(expected_frames - int(camera.frames_read), 0),
+        "Lost Frames": camera.frames_lost,
+        "Peak RSS (MB)": peak_rss(),
+        "Saving Stalls": camera.queue.stalls,
+        "Spilled Frames": camera.queue.frames_spilled,
+        "Queue High-Water Mark": camera.queue.high_water_mark,
+        **camera.recording_statistics,
+    }
+    if len(records) > 1 and camera.triggers and camera.saved:
+        trigger_times = camera.trigger_times(records["frame_index"])
+        save_times = camera.save_times(len(records))
+        latency = (save_times - trigger_times) * 1000
+        results["Sustained Framerate"] = (len(records) - 1) / (
+            trigger_times[-1] - trigger_times[0]
+        )
+        results["Saved Framerate"] = len(records) / (save_times[-1] - trigger_times[0])
+        results["Latency (ms)"] = {
+            "Median": float(np.median(latency)),
+            "95th Percentile": float(np.percentile(latency, 95)),
+            "99th Percentile": float(np.percentile(latency, 99)),
+            "Max": float(np.max(latency)),
+        }
+        results["Disk Throughput (MB/s)"] = (
+            saved_bytes / 1e6 / (save_times[-1] - trigger_times[0])
+        )
+    if len(preview_updates) > 1:
+        results["Preview Framerate"] = (len(preview_updates) - 1) / (
+            preview_updates[-1] - preview_updates[0]
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 512, 256])
+    # The DAQ drives one line per light, so at most the four lights of the rig
+    parser.add_argument(
+        "--lights",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        choices=range(1, len(LIGHTS) + 1),
+        metavar="{1-%d}" % len(LIGHTS),
+    )
+    parser.add_argument("--framerates", type=float, nargs="+", default=[57, 100])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--directory", default=None)
+    parser.add_argument("--ram-budget", type=float, default=None)
+    parser.add_argument("--packed", action="store_true")
+    parser.add_argument(
+        "--compression", choices=["None", "Zlib", "LZMA"], default="None"
+    )
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        results = run_benchmark(
+            args.sizes[0],
+            args.lights[0],
+            args.framerates[0],
+            args.duration,
+            args.chunk_size,
+            args.directory,
+            args.ram_budget,
+            args.packed,
+            args.compression,
+        )
+        print(json.dumps(results))
+        return
+
+    all_results = []
+    for size, lights, framerate in itertools.product(
+        args.sizes, args.lights, args.framerates
+    ):
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--single",
+            "--sizes",
+            str(size),
+            "--lights",
+            str(lights),
+            "--framerates",
+            str(framerate),
+            "--duration",
+            str(args.duration),
+        ]
+        if args.chunk_size is not None:
+            command += ["--chunk-size", str(args.chunk_size)]
+        if args.directory is not None:
+            command += ["--directory", args.directory]
+        if args.ram_budget is not None:
+            command += ["--ram-budget", str(args.ram_budget)]
+        if args.packed:
+            command += ["--packed"]
+        command += ["--compression", args.compression]
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode == 0:
+            results = json.loads(process.stdout.strip().splitlines()[-1])
+        else:
+            results = {
+                "Size": size,
+                "Lights": lights,
+                "Framerate": framerate,
+                "Error": process.stderr.strip().splitlines()[-1],
+            }
+        print(json.dumps(results), file=sys.stderr)
+        all_results.append(results)
+
+    output = json.dumps({"Python": sys.version, "Results": all_results}, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import sys
 import time
 import os
+import random
+import logging
 import matplotlib.pyplot as plt
 from PyQt5.QtCore import QModelIndex, Qt, QLocale, qInstallMessageHandler
 import numpy as np
@@ -42,10 +44,8 @@ from src.tree import Tree
 from src.plot import PlotWindow
 from src.calculations import (
     get_dictionary,
-    shrink_array,
     frames_acquired_from_camera_signal,
     get_baseline_frame_indices,
-    average_baseline,
 )
 import warnings
 
@@ -142,6 +142,7 @@ class App(QWidget):
             self.camera.video_running = False
             self.daq.stop_signal = True
             self.daq.camera.cam.stop_acquisition()
+            self.camera.queue.remove_scratch_file()
             print("Program Closed")
         except Exception as err:
             pass
@@ -984,6 +985,7 @@ class App(QWidget):
             self.deactivate_buttons(buttons=self.enabled_buttons)
             self.master_block = self.tree.create_blocks()
             #self.tree.baseline_values = []
+            self.tree.seed = random.SystemRandom().getrandbits(32)
             self.tree.graph(item=self.tree.invisibleRootItem())
             self.root_time, self.root_signal = (
                 self.tree.x_values,
@@ -994,6 +996,9 @@ class App(QWidget):
                 ],
             )
             self.draw(root=True)
+            if not self.check_preflight():
+                self.activate_buttons(buttons=self.enabled_buttons)
+                return
             if self.acquisition_mode:
                 self.actualize_daq()
                 self.open_live_saving_thread()
@@ -1027,6 +1032,49 @@ class App(QWidget):
         else:
             return True
 
+    def check_preflight(self):
+        """Check that the recordings fit on disk and can be written in time"""
+        if not (
+            self.acquisition_mode and self.directory_save_files_checkbox.isChecked()
+        ):
+            return True
+        # The disk bandwidth probe writes to the disk for a moment
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            report = self.camera.preflight(
+                os.path.join(
+                    self.directory_cell.text(), self.experiment_name_cell.text()
+                ),
+                self.root_time[-1],
+                int(self.framerate_cell.text()),
+                self.roi_extent,
+            )
+        except Exception as err:
+            QApplication.restoreOverrideCursor()
+            logging.error(f"The saving could not be checked: {err}")
+            button = QMessageBox.question(
+                self,
+                "Saving could not be checked",
+                f"The saving could not be checked: {err}"
+                + "\n Do you want to start the experiment anyway?",
+            )
+            return button == QMessageBox.Yes
+        QApplication.restoreOverrideCursor()
+        if report["Errors"]:
+            QMessageBox.critical(
+                self, "Files cannot be saved", "\n".join(report["Errors"])
+            )
+            return False
+        if report["Warnings"]:
+            button = QMessageBox.question(
+                self,
+                "Saving may fall behind",
+                "\n".join(report["Warnings"])
+                + "\n Do you want to start the experiment anyway?",
+            )
+            return button == QMessageBox.Yes
+        return True
+
     def open_baseline_check_thread(self):
         """Open the thread for the baseline check"""
         self.baseline_check_thread = Thread(target=self.check_baseline)
@@ -1035,42 +1083,41 @@ class App(QWidget):
     def check_baseline(self):
         """Monitor the incoming frames and check if the baseline is reached"""
         if len(self.daq.lights) > 0:
-            self.camera.baseline_data = []
-            self.camera.adding_frames = False
             self.camera.completed_baseline = False
-            while self.daq.camera_signal is None:
-                pass
+            # Give up if the experiment is stopped or failed before its signals were made
+            while not self.daq.signals_ready.wait(timeout=0.5):
+                if self.daq.stop_signal or not self.start_experiment_thread.is_alive():
+                    return
+            queue = self.camera.queue
+            # Each window is freed once read, so that only the windows in progress
+            # hold memory
+            for accumulator in self.camera.baseline_accumulators:
+                try:
+                    queue.wait(
+                        lambda: queue.buffer.frames_written >= accumulator.stop_index
+                        or queue.closed
+                    )
+                    if queue.closed:
+                        break
+                    self.camera.average_baseline = accumulator.mean()
+                    self.camera.baseline_completed = True
+                except Exception as err:
+                    pass
+                finally:
+                    accumulator.release()
+            for accumulator in self.camera.baseline_accumulators:
+                accumulator.release()
+
+    def start_baselines(self):
+        """Start accumulating every baseline window before the acquisition starts"""
+        baseline_indices = []
+        if self.acquisition_mode and len(self.daq.lights) > 0:
             frames_acquired = frames_acquired_from_camera_signal(self.daq.camera_signal)
-            baseline_indices = get_baseline_frame_indices(
-                self.tree.baseline_values, frames_acquired
+            baseline_indices = (
+                get_baseline_frame_indices(self.tree.baseline_values, frames_acquired)
+                or []
             )
-            for baseline_pair in baseline_indices:
-                while not self.daq.stop_signal:
-                    try:
-                        if (
-                            not self.camera.adding_frames
-                            and self.camera.frames_read >= baseline_pair[0]
-                        ):
-                            self.camera.adding_frames = True
-                        elif (
-                            self.camera.adding_frames
-                            and self.camera.frames_read >= baseline_pair[1]
-                        ):
-                            self.camera.baseline_read_list = []
-                            self.camera.average_baseline = average_baseline(
-                                self.camera.baseline_data,
-                                len(self.daq.lights),
-                                self.camera.frames_read_list[0] % len(self.daq.lights),
-                            )
-                            self.camera.adding_frames = False
-                            self.camera.baseline_frames = []
-                            self.camera.baseline_completed = True
-                            self.camera.frames_read_list = []
-                            self.camera.baseline_data = []
-                            break
-                    except Exception as err:
-                        pass
-                    time.sleep(0.01)
+        self.camera.start_baselines(baseline_indices, len(self.daq.lights))
 
     def open_start_experiment_thread(self):
         """Open the thread for the start of the experiment"""
@@ -1108,9 +1155,11 @@ class App(QWidget):
             self.daq,
             name=self.experiment_name_cell.text(),
             config=self.config,
+            seed=self.tree.seed,
         )
         self.save_files_after_stop = True
         self.daq.launch(self.experiment.name, self.root_time, self.root_signal)
+        self.start_baselines()
         if self.acquisition_mode:
             self.open_baseline_check_thread()
         self.daq.run()
@@ -1135,51 +1184,15 @@ class App(QWidget):
         self.live_save_thread.start()
 
     def live_save(self):
-        """Save NPY chunked files when the number of frames is over 1200"""
-        self.camera.file_index = 0
-        self.camera.is_saving = False
+        """Save NPY chunked files of 1200 frames while the camera is running"""
         if self.directory_save_files_checkbox.isChecked():
-            try:
-                os.mkdir(
-                    os.path.join(
-                        self.directory_cell.text(), self.experiment_name_cell.text()
-                    )
-                )
-                os.mkdir(
-                    os.path.join(
-                        self.directory_cell.text(),
-                        self.experiment_name_cell.text(),
-                        "data",
-                    )
-                )
-            except Exception as err:
-                pass
-            while self.camera.video_running is False and not self.camera.stop_signal:
-                time.sleep(0.01)
-                pass
-            while self.camera.video_running is True:
-                if len(self.camera.frames) > 1200:
-                    self.memory = self.camera.frames[:1200]
-                    self.camera.frames = self.camera.frames[1200:]
-                    if self.directory_save_files_checkbox.isChecked():
-                        try:
-                            self.memory = shrink_array(self.memory, self.roi_extent)
-                        except Exception:
-                            pass
-                        self.camera.is_saving = True
-                        np.save(
-                            os.path.join(
-                                self.directory_cell.text(),
-                                self.experiment_name_cell.text(),
-                                "data",
-                                f"{self.camera.file_index}.npy",
-                            ),
-                            self.memory,
-                        )
-                        self.memory = None
-                        self.camera.file_index += 1
-                        self.camera.is_saving = False
-                time.sleep(0.01)
+            directory = os.path.join(
+                self.directory_cell.text(), self.experiment_name_cell.text(), "data"
+            )
+            os.makedirs(directory, exist_ok=True)
+            self.camera.live_save(directory, self.roi_extent)
+        else:
+            self.camera.live_save()
 
     def open_live_preview_thread(self):
         """Open the thread for the live preview"""
@@ -1190,36 +1203,33 @@ class App(QWidget):
         """Start the live preview"""
         plt.ion()
         self.memory = []
+        self.live_preview_running = True
         self.camera.baseline_completed = False
         if len(self.daq.lights) > 0:
             try:
-                while self.camera.video_running is False:
-                    time.sleep(0.01)
-                    pass
-                while self.camera.video_running is True:
+                queue = self.camera.queue
+                queue.wait(
+                    lambda: self.camera.video_running or not self.live_preview_running
+                )
+                while self.camera.video_running is True and self.live_preview_running:
+                    frames_shown = queue.buffer.frames_written
                     try:
                         if (
                             not self.camera.baseline_completed
                             or self.activation_map_combo.currentIndex() == 0
                         ):
                             self.plot_image.set(
-                                array=self.camera.frames[
-                                    self.live_preview_light_index :: len(
-                                        self.daq.lights
-                                    )
-                                ][-1],
+                                array=queue.latest(
+                                    self.live_preview_light_index, len(self.daq.lights)
+                                ),
                                 clim=(0, self.max_exposure),
                                 cmap="binary_r",
                             )
                         elif self.activation_map_combo.currentIndex() == 1:
-                            start_index = (
-                                self.camera.baseline_read_list[0]
-                                + self.live_preview_light_index
-                            ) % len(self.daq.lights)
                             activation_map = (
-                                self.camera.baseline_frames[
-                                    start_index :: len(self.daq.lights)
-                                ][-1]
+                                self.camera.latest_frames.get(
+                                    self.live_preview_light_index
+                                )
                                 - self.camera.average_baseline[
                                     self.live_preview_light_index
                                 ]
@@ -1235,16 +1245,10 @@ class App(QWidget):
                                 cmap="seismic",
                             )
                         else:
-                            start_index = (
-                                self.camera.baseline_read_list[0]
-                                + self.live_preview_light_index
-                            ) % len(self.daq.lights)
                             activation_map = np.log(
                                 (
-                                    (
-                                        self.camera.baseline_frames[
-                                            start_index :: len(self.daq.lights)
-                                        ][-1]
+                                    self.camera.latest_frames.get(
+                                        self.live_preview_light_index
                                     )
                                     / self.camera.average_baseline[
                                         self.live_preview_light_index
@@ -1262,13 +1266,23 @@ class App(QWidget):
 
                     except Exception as err:
                         pass
-                    time.sleep(0.04)
+                    # Refresh less often while saving catches up with the spilled frames
+                    time.sleep(0.4 if queue.spilling() else 0.04)
+                    queue.wait(
+                        lambda: queue.buffer.frames_written > frames_shown
+                        or not self.camera.video_running
+                        or not self.live_preview_running
+                    )
             except Exception as err:
                 pass
 
     def stop_live(self):
         """Stop the live preview"""
-        self.camera.video_running = False
+        self.live_preview_running = False
+        try:
+            self.camera.queue.notify()
+        except Exception:
+            pass
 
     def open_signal_preview_thread(self):
         """Open the thread for the signal preview"""
@@ -1285,10 +1299,9 @@ class App(QWidget):
             try:
                 position = time.time() - self.daq.start_time
                 self.plot_window.actualize(position)
-                time.sleep(1)
             except Exception as err:
-                time.sleep(1)
                 pass
+            self.daq.stop_event.wait(timeout=1)
 
     def change_preview_light_channel(self):
         """Change the light channel for the live preview"""
@@ -1330,6 +1343,8 @@ class App(QWidget):
             int(self.exposure_cell.text()) / 1000,
         )
         self.daq.close_all_lights(self.ports)
+        # The tree compiles the signals at the rate the DAQ sends them
+        self.tree.sample_rate = self.daq.sample_rate
         self.daq_generated = True
         self.enable_run(self.tree.check_global_validity())
 
@@ -1349,7 +1364,7 @@ class App(QWidget):
                 self.daq.lights.append(Instrument(self.ports["purple"], "purple"))
             self.daq.framerate = int(self.framerate_cell.text())
             self.daq.exposure = int(self.exposure_cell.text()) / 1000
-            self.camera.frames = []
+            self.camera.allocate_buffer()
             self.daq.stop_signal = False
         except Exception:
             pass
@@ -1780,6 +1795,7 @@ class App(QWidget):
         plt.xlim(0, int(1024 / self.config["Binning"]))
         plt.ylim(0, int(1024 / self.config["Binning"]))
         self.roi_extent = None
+        self.set_acquisition_window()
         self.reset_roi_button.setEnabled(False)
 
     def cancel_roi(self):
@@ -1799,8 +1815,21 @@ class App(QWidget):
         plt.ylim(self.roi_extent[2], self.roi_extent[3])
         self.rect_selector.clear()
         self.rect_selector = None
+        self.set_acquisition_window()
         self.reset_roi_button.setEnabled(True)
 
+    def set_acquisition_window(self):
+        """Only acquire the region of the ROI and place the preview image accordingly"""
+        try:
+            self.camera.set_roi(self.roi_extent)
+            size = int(1024 / self.config["Binning"])
+            top, left, height, width = self.camera.window or (0, 0, size, size)
+            self.plot_image.set_extent(
+                (left - 0.5, left + width - 0.5, top - 0.5, top + height - 0.5)
+            )
+        except Exception as err:
+            pass
+
     def verify_exposure(self):
         """Verify if the exposure/framerate combination is valid"""
         try:
@@ -29,9 +29,10 @@ from src.controls import DAQ, Instrument, Camera
 from src.blocks import Experiment
 from src.tree import Tree
 from src.plot import PlotWindow
+from src.recording import open_recording
 from src.calculations import (
     get_dictionary,
-    shrink_array,
+    crop_frames,
     frames_acquired_from_camera_signal,
     get_baseline_frame_indices,
     average_baseline,
@@ -286,10 +287,7 @@ class App(QWidget):
         try:
             self.frames = []
             self.time_slider.setEnabled(False)
-            potential_data = os.listdir(os.path.join(self.directory, "data"))
-            for file in potential_data:
-                if ".npy" in file:
-                    self.concatenate_frames(file)
+            self.frames = open_recording(os.path.join(self.directory, "data"))
             self.frame_number = self.frames.shape[0]
             self.split_frames = separate_images(self.dictionary["Lights"], self.frames)
             self.end_index.setText(f"{self.frame_number-1}")
@@ -299,15 +297,6 @@ class App(QWidget):
         except Exception as err:
             pass
 
-    def concatenate_frames(self, file):
-        """Concatenate the frames in the directory"""
-        if len(self.frames) == 0:
-            self.frames = np.load(os.path.join(self.directory, "data", file))
-        else:
-            self.frames = np.concatenate(
-                (self.frames, np.load(os.path.join(self.directory, "data", file)))
-            )
-
     def set_roi(self):
         """Set the ROI"""
         self.roi_buttons.setCurrentIndex(1)
@@ -392,21 +381,14 @@ class App(QWidget):
 
     def make_time_course(self):
         try:
-            if self.roi_extent:
-                y_values = get_timecourse(
-                    shrink_array(
-                        self.split_frames[self.live_preview_light_index],
-                        self.roi_extent,
-                    ),
-                    int(self.start_index.text()) // len(self.dictionary["Lights"]),
-                    int(self.end_index.text()) // len(self.dictionary["Lights"]),
-                )
-            else:
-                y_values = get_timecourse(
+            y_values = get_timecourse(
+                crop_frames(
                     self.split_frames[self.live_preview_light_index],
-                    int(self.start_index.text()) // len(self.dictionary["Lights"]),
-                    int(self.end_index.text()) // len(self.dictionary["Lights"]),
-                )
+                    self.roi_extent or None,
+                ),
+                int(self.start_index.text()) // len(self.dictionary["Lights"]),
+                int(self.end_index.text()) // len(self.dictionary["Lights"]),
+            )
             plt.figure(self.time_course.figure.number)
             plt.ion()
             plt.clf()
@@ -133,6 +133,7 @@ class Experiment:
         daq,
         name="No Name",
         config=None,
+        seed=None,
     ):
         """Initialize the experiment object
 
@@ -144,6 +145,8 @@ class Experiment:
             directory (str): Directory of the experiment
             daq (str): DAQ used for the experiment
             name (str): Name of the experiment
+            config (dict): Configuration used for the experiment
+            seed (int): Seed of the random delays and pulses of the experiment
         """
         try:
             self.name = name
@@ -154,6 +157,7 @@ class Experiment:
             self.directory = directory + f"/{name}"
             self.daq = daq
             self.config = config
+            self.seed = seed
         except Exception as err:
             pass
 
@@ -177,8 +181,13 @@ class Experiment:
                 int(1024 / self.config["Binning"]),
                 int(1024 / self.config["Binning"]),
             ]
+        config = self.config or {}
+        binning = config.get("Software Binning", 1)
+        if not config.get("Keep Full Resolution", False):
+            dimensions = [dimension // binning for dimension in dimensions]
         self.save_config(dimensions)
         self.daq.camera.save(self.directory, extents)
+        self.daq.camera.save_timing(self.directory)
         self.daq.save(self.directory)
 
     def save_config(self, dimensions):
@@ -198,6 +207,17 @@ class Experiment:
             "Exposition": self.exposition,
             "Mouse ID": self.mouse_id,
             "Dimensions": dimensions,
+            "Software Binning": (self.config or {}).get("Software Binning", 1),
+            "Seed": self.seed,
         }
+        try:
+            dictionary["Sample Rate"] = self.daq.sample_rate
+        except Exception:
+            pass
+        try:
+            if self.daq.camera.window is not None:
+                dictionary["Acquisition Window"] = list(self.daq.camera.window)
+        except Exception:
+            pass
         with open(f"{self.directory}/metadata.json", "w") as file:
             json.dump(dictionary, file)
@@ -0,0 +1,569 @@
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+
+class FrameBuffer:
+    def __init__(self, capacity, height, width, dtype=np.uint16):
+        """A preallocated ring buffer holding the most recent camera frames
+
+        Args:
+            capacity (int): The maximum number of frames kept in memory
+            height (int): The height of each frame in pixels
+            width (int): The width of each frame in pixels
+            dtype (type): The data type of the frames. Defaults to uint16.
+        """
+        self.capacity = capacity
+        self.shape = (height, width)
+        self.frames = np.empty((capacity, height, width), dtype=dtype)
+        self.indices = np.full(capacity, -1, dtype=np.int64)
+        self.frames_written = 0
+
+    def reset(self):
+        """Forget every frame written without releasing the memory"""
+        self.indices[:] = -1
+        self.frames_written = 0
+
+    def write(self, frames):
+        """Copy a batch of frames at the end of the buffer, wrapping around when full
+
+        Args:
+            frames (list of array): The frames to copy, as returned by the framegrabber
+
+        Returns:
+            int: The global index of the first copied frame
+        """
+        first_index = self.frames_written
+        for frame in frames:
+            self.frames[self.frames_written % self.capacity] = frame
+            self.indices[self.frames_written % self.capacity] = self.frames_written
+            self.frames_written += 1
+        return first_index
+
+    def skip(self, count):
+        """Advance the global index of the frames without writing them (frames stored elsewhere)
+
+        Args:
+            count (int): The number of frames skipped
+
+        Returns:
+            int: The global index of the first skipped frame
+        """
+        first_index = self.frames_written
+        self.frames_written += count
+        return first_index
+
+    def get(self, start, stop):
+        """Return the frames between two global indices
+
+        Args:
+            start (int): The global index of the first frame
+            stop (int): The global index following the last frame
+
+        Returns:
+            array: A view on the buffer, or a copy if the range wraps around its end
+        """
+        first, last = start % self.capacity, (stop - 1) % self.capacity + 1
+        if stop == start:
+            return self.frames[first:first]
+        if (
+            stop - start > self.capacity
+            or self.indices[first] != start
+            or self.indices[last - 1] != stop - 1
+        ):
+            raise IndexError("Frames are not in the buffer")
+        if first < last:
+            return self.frames[first:last]
+        return np.concatenate((self.frames[first:], self.frames[:last]))
+
+    def latest(self, light_index=0, light_count=1):
+        """Return the last frame acquired for a light channel
+
+        Args:
+            light_index (int): The index of the light channel. Defaults to 0.
+            light_count (int): The number of lights used. Defaults to 1.
+
+        Returns:
+            array: A view on the last frame of the channel, None if it is not in the buffer
+        """
+        last_index = self.frames_written - 1
+        index = last_index - (last_index - light_index) % light_count
+        if index < 0 or self.indices[index % self.capacity] != index:
+            return None
+        return self.frames[index % self.capacity]
+
+
+class FrameQueue:
+    def __init__(self, buffer, spill=False, scratch_directory=None):
+        """A bounded single-producer/single-consumer queue of frames stored in a ring buffer
+
+        Frames are never overwritten before being released by the consumer. When the
+        buffer is full, the producer either waits, and the time spent waiting is
+        accounted for, or spills the frames to a scratch file on disk. Once frames are
+        spilled, every following frame is spilled until the consumer catches up, so the
+        frames are always received in order.
+
+        Args:
+            buffer (FrameBuffer): The ring buffer in which the frames are stored
+            spill (bool): If True, spill frames to disk instead of waiting. Defaults to False.
+            scratch_directory (str): The folder of the scratch file. Defaults to the temp folder.
+        """
+        self.buffer = buffer
+        self.spill = spill
+        self.scratch_directory = scratch_directory
+        self.scratch_path, self.scratch_writer, self.scratch_reader = None, None, None
+        self.condition = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        """Empty and reopen the queue and reset its statistics"""
+        with self.condition:
+            self.buffer.reset()
+            self.closed = False
+            self.frames_released = 0
+            self.spill_start, self.spill_end = 0, 0
+            self.high_water_mark = 0
+            self.stalls = 0
+            self.stall_time = 0
+            self.frames_spilled = 0
+            self.spill_high_water_mark = 0
+
+    def remove_scratch_file(self):
+        """Close and delete the scratch file of the spilled frames"""
+        with self.condition:
+            if self.scratch_path is not None:
+                self.scratch_writer.close()
+                self.scratch_reader.close()
+                os.remove(self.scratch_path)
+                self.scratch_path = None
+
+    def spilling(self):
+        """Return True if frames spilled to disk are waiting to be released"""
+        return self.frames_released < self.spill_end
+
+    def pending(self, start=None):
+        """Return the number of frames written but not yet released
+
+        Args:
+            start (int): Only count the frames from this global index.
+                         Defaults to the oldest frame not released.
+        """
+        start = self.frames_released if start is None else start
+        return self.buffer.frames_written - start
+
+    def put(self, frames, timeout=None):
+        """Copy a batch of frames in the queue, waiting for enough free space
+
+        Args:
+            frames (list of array): The frames to add to the queue
+            timeout (float): The maximum waiting time in seconds. Defaults to None.
+
+        Returns:
+            bool: True if the frames were added, False if the queue stayed full
+        """
+        with self.condition:
+            spill = self.spill and (
+                self.spilling() or self.pending() + len(frames) > self.buffer.capacity
+            )
+            if not spill and self.pending() + len(frames) > self.buffer.capacity:
+                self.stalls += 1
+                start_time = time.perf_counter()
+                space_available = self.condition.wait_for(
+                    lambda: self.pending() + len(frames) <= self.buffer.capacity,
+                    timeout,
+                )
+                self.stall_time += time.perf_counter() - start_time
+                if not space_available:
+                    return False
+        if spill:
+            self.spill_frames(frames)
+            return True
+        self.buffer.write(frames)
+        with self.condition:
+            self.high_water_mark = max(self.high_water_mark, self.pending())
+            self.condition.notify_all()
+        return True
+
+    def spill_frames(self, frames):
+        """Append frames to the scratch file
+
+        The frames are written without holding the condition lock, so the consumer
+        keeps reading and releasing frames meanwhile. They only become part of the
+        queue once they are on disk.
+
+        Args:
+            frames (list of array): The frames to spill
+        """
+        with self.condition:
+            if self.scratch_path is None:
+                file, self.scratch_path = tempfile.mkstemp(
+                    suffix=".raw", dir=self.scratch_directory
+                )
+                self.scratch_writer = os.fdopen(file, "wb")
+                self.scratch_reader = open(self.scratch_path, "rb")
+            if not self.spilling():
+                # The previous spilled frames were all released, the file is reused
+                self.spill_start = self.buffer.frames_written
+                self.spill_end = self.spill_start
+            frame_size = self.buffer.shape[0] * self.buffer.shape[1]
+            offset = (
+                (self.spill_end - self.spill_start)
+                * frame_size
+                * self.buffer.frames.itemsize
+            )
+        # Only the producer writes to the scratch file, and the consumer only reads
+        # the frames before spill_end
+        self.scratch_writer.seek(offset)
+        for frame in frames:
+            self.scratch_writer.write(
+                np.ascontiguousarray(frame, dtype=self.buffer.frames.dtype).tobytes()
+            )
+        self.scratch_writer.flush()
+        with self.condition:
+            self.buffer.skip(len(frames))
+            self.spill_end += len(frames)
+            self.frames_spilled += len(frames)
+            self.spill_high_water_mark = max(
+                self.spill_high_water_mark, self.spill_end - self.frames_released
+            )
+            self.condition.notify_all()
+
+    def read_spilled(self, start, stop, file=None):
+        """Read spilled frames from the scratch file
+
+        Args:
+            start (int): The global index of the first frame
+            stop (int): The global index following the last frame
+            file (str): The path of the scratch file if it is not read by the consumer
+
+        Returns:
+            array: A copy of the frames
+        """
+        frame_size = self.buffer.shape[0] * self.buffer.shape[1]
+        if file is None:
+            file = self.scratch_reader
+            file.seek(0)
+        frames = np.fromfile(
+            file,
+            self.buffer.frames.dtype,
+            (stop - start) * frame_size,
+            offset=(start - self.spill_start)
+            * frame_size
+            * self.buffer.frames.itemsize,
+        )
+        return frames.reshape(stop - start, *self.buffer.shape)
+
+    def latest(self, light_index=0, light_count=1):
+        """Return the last frame acquired for a light channel, in memory or spilled
+
+        Args:
+            light_index (int): The index of the light channel. Defaults to 0.
+            light_count (int): The number of lights used. Defaults to 1.
+
+        Returns:
+            array: The last frame of the channel, None if there is none
+        """
+        with self.condition:
+            last_index = self.buffer.frames_written - 1
+            index = last_index - (last_index - light_index) % light_count
+            if self.spilling() and self.spill_start <= index < self.spill_end:
+                return self.read_spilled(index, index + 1, self.scratch_path)[0]
+            return self.buffer.latest(light_index, light_count)
+
+    def close(self):
+        """Signal that no more frames will be added to the queue"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def notify(self):
+        """Wake up the threads waiting on the queue so they check their condition"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait(self, predicate, timeout=None):
+        """Wait until a condition is met, checking it each time frames are added,
+        released or when the queue is closed
+
+        Args:
+            predicate (function): A function returning True when waiting is over
+            timeout (float): The maximum waiting time in seconds. Defaults to None.
+
+        Returns:
+            bool: The last value returned by the predicate
+        """
+        with self.condition:
+            return self.condition.wait_for(predicate, timeout)
+
+    def get(self, count, start=None):
+        """Return the oldest frames of the queue without releasing them
+
+        Args:
+            count (int): The maximum number of frames to return
+            start (int): The global index of the first frame, not released yet.
+                         Defaults to the oldest frame not released.
+
+        Returns:
+            array: A view on at most count contiguous frames of the ring buffer, or a
+                   copy of the frames read from the scratch file if they were spilled
+        """
+        with self.condition:
+            start = max(self.frames_released if start is None else start, 0)
+            if start < self.frames_released:
+                raise ValueError("The frames were already released")
+            if self.spilling() and start >= self.spill_start:
+                stop = min(start + count, self.spill_end)
+            else:
+                stop = start + min(
+                    count,
+                    self.pending(start),
+                    self.buffer.capacity - start % self.buffer.capacity,
+                )
+                if self.spilling():
+                    stop = min(stop, self.spill_start)
+                return self.buffer.get(start, stop)
+        # The spilled frames can only be overwritten once released
+        return self.read_spilled(start, stop)
+
+    def release(self, count):
+        """Free the space used by the oldest frames of the queue
+
+        Args:
+            count (int): The number of frames to release
+        """
+        with self.condition:
+            self.frames_released += count
+            self.condition.notify_all()
+
+
+class FrameLog:
+    def __init__(self, capacity=4096):
+        """A growing record of the framegrabber index and arrival time of each frame
+
+        Args:
+            capacity (int): The number of records initially allocated. Defaults to 4096.
+        """
+        self.records = np.zeros(
+            capacity, dtype=[("frame_index", np.int64), ("timestamp", np.float64)]
+        )
+        self.reset()
+
+    def reset(self):
+        """Forget every record and reset the dropped/duplicated frames counters"""
+        self.count = 0
+        self.dropped_frames = 0
+        self.duplicated_frames = 0
+
+    def append(self, frame_indices, timestamp):
+        """Record a batch of frames read at the same time
+
+        Args:
+            frame_indices (list of int): The framegrabber index of each frame
+            timestamp (float): The host time at which the frames were read
+        """
+        frame_indices = np.asarray(frame_indices, dtype=np.int64)
+        if self.count + len(frame_indices) > len(self.records):
+            extra = max(len(self.records), len(frame_indices))
+            self.records = np.concatenate(
+                (self.records, np.zeros(extra, dtype=self.records.dtype))
+            )
+        if self.count > 0 and len(frame_indices) > 0:
+            steps = np.diff(
+                np.concatenate(
+                    ([self.records["frame_index"][self.count - 1]], frame_indices)
+                )
+            )
+            self.dropped_frames += int(np.sum(steps[steps > 1] - 1))
+            self.duplicated_frames += int(np.sum(steps < 1))
+        new_records = self.records[self.count : self.count + len(frame_indices)]
+        new_records["frame_index"] = frame_indices
+        new_records["timestamp"] = timestamp
+        self.count += len(frame_indices)
+
+    def get(self):
+        """Return the records of every frame logged
+
+        Returns:
+            array: A structured array with the frame_index and timestamp fields
+        """
+        return self.records[: self.count]
+
+
+class BaselineAccumulator:
+    def __init__(self):
+        """A running sum of the frames of each light channel during a baseline window
+
+        Frames are accumulated as they arrive, so the memory used does not depend on the
+        duration of the baseline and the statistics are available as soon as it ends.
+        The light channel of a frame is its global index modulo the number of lights.
+        """
+        self.lock = threading.Lock()
+        self.sum, self.sum_of_squares, self.minimum, self.maximum = (
+            None,
+            None,
+            None,
+            None,
+        )
+        self.shape = (0, 0, 0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.start_index, self.stop_index = 0, 0
+
+    def start(self, light_count, shape, start_index, stop_index):
+        """Forget the accumulated frames and start a new baseline window
+
+        The memory of the statistics is only allocated once the first frame of the
+        window arrives, so every window of an acquisition can be started beforehand.
+
+        Args:
+            light_count (int): The number of lights used
+            shape (tuple): The (height, width) of the frames
+            start_index (int): The global index of the first frame of the baseline
+            stop_index (int): The global index following the last frame of the baseline
+        """
+        with self.lock:
+            self.shape = (light_count, *shape)
+            self.sum, self.sum_of_squares, self.minimum, self.maximum = (
+                None,
+                None,
+                None,
+                None,
+            )
+            self.counts = np.zeros(light_count, dtype=np.int64)
+            self.start_index, self.stop_index = start_index, stop_index
+
+    def allocate(self):
+        """Allocate the statistics of the window (the lock must be held)"""
+        if self.sum is None:
+            self.sum = np.zeros(self.shape)
+            self.sum_of_squares = np.zeros(self.shape)
+            self.minimum = np.full(self.shape, np.iinfo(np.uint16).max, dtype=np.uint16)
+            self.maximum = np.zeros(self.shape, dtype=np.uint16)
+
+    def add(self, frames, first_index):
+        """Add the frames which are inside the baseline window
+
+        Args:
+            frames (list of array): The frames read
+            first_index (int): The global index of the first frame
+        """
+        with self.lock:
+            start = max(self.start_index - first_index, 0)
+            stop = min(self.stop_index - first_index, len(frames))
+            if len(self.counts) == 0 or start >= stop:
+                return
+            self.allocate()
+            light_count = len(self.counts)
+            frames = np.asarray(frames[start:stop])
+            for light_index in range(light_count):
+                light_frames = frames[
+                    (light_index - first_index - start) % light_count :: light_count
+                ]
+                if len(light_frames) == 0:
+                    continue
+                self.sum[light_index] += np.sum(light_frames, axis=0, dtype=np.float64)
+                self.sum_of_squares[light_index] += np.sum(
+                    np.square(light_frames, dtype=np.float64), axis=0
+                )
+                np.minimum(
+                    self.minimum[light_index],
+                    np.min(light_frames, axis=0),
+                    out=self.minimum[light_index],
+                )
+                np.maximum(
+                    self.maximum[light_index],
+                    np.max(light_frames, axis=0),
+                    out=self.maximum[light_index],
+                )
+                self.counts[light_index] += len(light_frames)
+
+    def release(self):
+        """Free the statistics of the window once they have been read
+
+        The frames added afterwards are ignored, so the window is not allocated again.
+        """
+        with self.lock:
+            self.sum, self.sum_of_squares, self.minimum, self.maximum = (
+                None,
+                None,
+                None,
+                None,
+            )
+            self.counts = np.zeros(0, dtype=np.int64)
+
+    def mean(self):
+        """Return the average frame of each light channel
+
+        Returns:
+            array: The (light, height, width) averages
+        """
+        with self.lock:
+            self.allocate()
+            return self.sum / self.counts[:, None, None]
+
+    def variance(self):
+        """Return the variance of each pixel for each light channel
+
+        Returns:
+            array: The (light, height, width) variances
+        """
+        with self.lock:
+            self.allocate()
+            mean = self.sum / self.counts[:, None, None]
+            return np.maximum(
+                self.sum_of_squares / self.counts[:, None, None] - mean**2, 0
+            )
+
+
+class LatestFrames:
+    def __init__(self):
+        """A copy of the last frame acquired for each light channel
+
+        The light channel of a frame is its global index modulo the number of lights.
+        """
+        self.lock = threading.Lock()
+        self.frames = np.zeros((0, 0, 0), dtype=np.uint16)
+        self.indices = np.zeros(0, dtype=np.int64)
+
+    def reset(self, light_count, shape):
+        """Forget the frames and set the number of light channels
+
+        Args:
+            light_count (int): The number of lights used
+            shape (tuple): The (height, width) of the frames
+        """
+        with self.lock:
+            if self.frames.shape != (light_count, *shape):
+                self.frames = np.zeros((light_count, *shape), dtype=np.uint16)
+            self.indices = np.full(light_count, -1, dtype=np.int64)
+
+    def update(self, frames, first_index):
+        """Keep the last frame of each light channel in a batch
+
+        Args:
+            frames (list of array): The frames read
+            first_index (int): The global index of the first frame
+        """
+        light_count = len(self.indices)
+        with self.lock:
+            for index in range(
+                max(first_index, first_index + len(frames) - light_count),
+                first_index + len(frames),
+            ):
+                self.frames[index % light_count] = frames[index - first_index]
+                self.indices[index % light_count] = index
+
+    def get(self, light_index):
+        """Return the last frame of a light channel
+
+        Args:
+            light_index (int): The index of the light channel
+
+        Returns:
+            array: A copy of the frame, None if no frame was acquired for the channel
+        """
+        with self.lock:
+            if self.indices[light_index] < 0:
+                return None
+            return self.frames[light_index].copy()
@@ -2,10 +2,12 @@ import numpy as np
 import os
 import json
 import time
+from src.recording import open_recording, RECORDING_FILE
+from src.waveforms import compile_protocol
 
 
 def shrink_array(array, extents):
-    """Reduce the dimensions of frames to match ROI and return a list of frames
+    """Reduce the dimensions of frames to match ROI and return a copy of the frames
 
     Args:
         array (array): Array of frames
@@ -15,13 +17,137 @@ def shrink_array(array, extents):
         array: Reduced array of frames
     """
 
-    return np.array(array)[
-        :, round(extents[2]) : round(extents[3]), round(extents[0]) : round(extents[1])
-    ]
+    return np.array(crop_frames(array, extents))
+
+
+def roi_slices(extents):
+    """Return the row and column slices of a ROI
+
+    Args:
+        extents (list): Positions of the ROI corners (left, right, bottom, top)
+
+    Returns:
+        tuple: The (rows, columns) slices
+    """
+    return (
+        slice(round(extents[2]), round(extents[3])),
+        slice(round(extents[0]), round(extents[1])),
+    )
+
+
+class CroppedFrames:
+    def __init__(self, frames, extents):
+        """Frames cropped to a ROI only when they are accessed
+
+        Args:
+            frames (list): The frames to crop (a list of frames or a lazy recording)
+            extents (list): Positions of the ROI corners (left, right, bottom, top)
+        """
+        self.frames = frames
+        self.rows, self.columns = roi_slices(extents)
+        if hasattr(frames, "shape"):
+            height, width = frames.shape[1:]
+        else:
+            height, width = np.shape(frames[0]) if len(frames) > 0 else (0, 0)
+        self.shape = (
+            len(frames),
+            len(range(height)[self.rows]),
+            len(range(width)[self.columns]),
+        )
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        selected = self.frames[key[0]]
+        if np.ndim(key[0]) == 0 and not isinstance(key[0], slice):
+            return np.asarray(selected)[self.rows, self.columns][key[1:]]
+        if isinstance(selected, list):
+            # Only the ROI of each frame is copied
+            selected = np.array([frame[self.rows, self.columns] for frame in selected])
+        else:
+            selected = np.asarray(selected)[:, self.rows, self.columns]
+        return selected[(slice(None), *key[1:])]
+
+    def __array__(self, dtype=None, copy=None):
+        frames = self[:]
+        return frames if dtype is None else frames.astype(dtype)
+
+
+def crop_frames(frames, extents):
+    """Crop frames to a ROI without copying them
+
+    Args:
+        frames (array): The frames (array, memmap, ring buffer view, list of frames
+                        or lazy recording)
+        extents (list): Positions of the ROI corners (left, right, bottom, top)
+                        Equal to None if original size is kept
+
+    Returns:
+        array: A view on the ROI of the frames, or CroppedFrames cropping them when
+               they are accessed
+    """
+    if extents is None:
+        return frames
+    if isinstance(frames, np.ndarray):
+        rows, columns = roi_slices(extents)
+        return frames[:, rows, columns]
+    return CroppedFrames(frames, extents)
+
+
+def bin_frames(frames, factor):
+    """Sum the pixels of square blocks of the frames (software binning)
+
+    Args:
+        frames (array): The (frame, height, width) frames, whose size is reduced to a
+                        multiple of the factor
+        factor (int): The width and height of the blocks of pixels
+
+    Returns:
+        array: The binned frames, summed in 32 bits
+    """
+    frames = np.asarray(frames)
+    if factor == 1:
+        return frames
+    count, height, width = frames.shape
+    height, width = height // factor, width // factor
+    columns = (
+        frames[:, : height * factor, : width * factor]
+        .reshape(count, height * factor, width, factor)
+        .sum(axis=3, dtype=np.uint32)
+    )
+    return columns.reshape(count, height, factor, width).sum(axis=2, dtype=np.uint32)
+
+
+def acquisition_window(extents, size, alignment=8):
+    """Return the framegrabber acquisition window enclosing the ROI
+
+    The left edge and the width of the window are aligned on the framegrabber's
+    pixel alignment, so the window can be slightly larger than the ROI.
+
+    Args:
+        extents (list): Positions of the ROI corners (left, right, bottom, top)
+        size (int): The width and height of the full frames
+        alignment (int): The horizontal alignment of the window. Defaults to 8.
+
+    Returns:
+        tuple: The (top, left, height, width) of the window
+    """
+    top = min(max(round(extents[2]), 0), size - 1)
+    bottom = min(max(round(extents[3]), top + 1), size)
+    left = min(max(round(extents[0]), 0), size - 1) // alignment * alignment
+    right = min(max(round(extents[1]), left + 1), size)
+    width = min(-(-(right - left) // alignment) * alignment, size - left)
+    return (top, left, bottom - top, width)
 
 
 def get_array(directory):
-    """Get array from NPY file"""
+    """Get array from NPY file, or from a recording file or data folder"""
+    if os.path.isdir(directory) or directory.endswith(RECORDING_FILE):
+        return np.asarray(open_recording(directory))
     return np.array(np.load(directory))
 
 
@@ -32,6 +158,31 @@ def get_dictionary(directory):
     return dictionary
 
 
+def regenerate_stimulation(directory):
+    """Compile again the stimulation signals of an experiment from its metadata
+
+    The random block delays and pulses are drawn from the seed saved in the metadata,
+    so the signals are those sent by the DAQ during the experiment. Random parts of
+    experiments saved without a seed are drawn again and differ.
+
+    Args:
+        directory (str): The folder of the experiment, holding metadata.json
+
+    Returns:
+        tuple: The time values, the analog signals (as in stim_signal.npy) and the
+               digital signal
+    """
+    metadata = get_dictionary(os.path.join(directory, "metadata.json"))
+    time_values, (stim1, stim2, stim3) = compile_protocol(
+        metadata["Blocks"], metadata.get("Sample Rate", 3000), metadata.get("Seed")
+    )
+    stim_signal = np.stack((stim1, stim2))
+    d_stim_signal = np.array(stim3)
+    stim_signal[:, -1] = 0
+    d_stim_signal[-1] = False
+    return time_values, stim_signal, d_stim_signal
+
+
 def find_rising_indices(array):
     """Find indices of rising edges in an array"""
     dy = np.diff(array)
@@ -129,16 +280,123 @@ def extend_light_signal(lights, camera):
 
 
 def frames_acquired_from_camera_signal(camera_signal):
-    """Generate an array of frames acquired from the camera signal at each timepoint"""
-    dy = np.diff(camera_signal)
-    indices = np.where(abs(dy) > 0)[0][1::2]
-    y_values = np.zeros(len(camera_signal))
+    """Generate an array of frames acquired from the camera signal at each timepoint
+
+    The camera line idles low, so a signal high on the first sample is an exposure.
+    Each exposure is counted from the sample at which the signal falls.
+    """
+    camera_signal = (np.asarray(camera_signal) > 0).astype(np.int8)
+    falls = np.diff(camera_signal, prepend=0) < 0
+    return np.cumsum(falls)
+
+
+def frame_metadata(
+    light_signals,
+    camera_signal,
+    stim_signals,
+    frame_indices,
+    timestamps,
+    first_frame_index=0,
+):
+    """Describe each acquired frame with its light, DAQ sample, time and stimuli
+
+    Args:
+        light_signals (array): The digital signal of each light
+        camera_signal (array): The digital camera signal, high during each exposure
+        stim_signals (array): The three stimulation signals
+        frame_indices (array): The framegrabber index of each frame acquired, which
+                               counts the exposures
+        timestamps (array): The host time at which each frame was read
+        first_frame_index (int): The framegrabber index of the first exposure of the
+                                 acquisition. Defaults to 0.
+
+    Returns:
+        array: One record per frame (frame, frame_index, light, sample, timestamp,
+               stim1, stim2, stim3), where light is -1 and sample is -1 for frames
+               without a matching exposure, and the stimuli are averaged over the
+               exposure of the frame
+    """
+    # Like frames_acquired_from_camera_signal, the camera line idles low, so a
+    # signal high on the first sample is an exposure
+    camera_signal = (np.asarray(camera_signal) > 0).astype(np.int8)
+    steps = np.diff(camera_signal, prepend=0)
+    rises = np.where(steps > 0)[0]
+    falls = np.where(steps < 0)[0]
+    exposure_count = min(len(rises), len(falls))
+    rises, falls = rises[:exposure_count], falls[:exposure_count]
+
+    frame_indices = np.asarray(frame_indices, dtype=np.int64)
+    records = np.zeros(
+        len(frame_indices),
+        dtype=[
+            ("frame", np.int64),
+            ("frame_index", np.int64),
+            ("light", np.int8),
+            ("sample", np.int64),
+            ("timestamp", np.float64),
+            ("stim1", np.float32),
+            ("stim2", np.float32),
+            ("stim3", np.float32),
+        ],
+    )
+    records["frame"] = np.arange(len(frame_indices))
+    records["frame_index"] = frame_indices
+    records["timestamp"] = timestamps
+    records["light"], records["sample"] = -1, -1
+    if len(frame_indices) == 0:
+        return records
+    # The framegrabber counts the exposures, so dropped frames keep their place
+    exposures = frame_indices - first_frame_index
+    matched = (exposures >= 0) & (exposures < exposure_count)
+    starts, stops = rises[exposures[matched]], falls[exposures[matched]]
+    records["sample"][matched] = starts
+    if len(light_signals) > 0:
+        lights = np.asarray(light_signals)[:, starts]
+        records["light"][matched] = np.where(
+            lights.any(axis=0), lights.argmax(axis=0), -1
+        )
+    for name, signal in zip(["stim1", "stim2", "stim3"], stim_signals):
+        sums = np.concatenate(([0], np.cumsum(np.asarray(signal, dtype=np.float64))))
+        records[name][matched] = (sums[stops] - sums[starts]) / (stops - starts)
+    return records
+
+
+def frame_timing_report(frame_indices, timestamps, expected_frames, framerate):
+    """Summarize the timing of an acquisition and the frames lost or duplicated
+
+    Args:
+        frame_indices (array): The framegrabber index of each frame read
+        timestamps (array): The host time at which each frame was read
+        expected_frames (int): The number of frames triggered by the camera signal
+        framerate (float): The acquisition framerate
+
+    Returns:
+        dict: The timing report
+    """
+    steps = np.diff(frame_indices)
+    read_times = np.unique(timestamps)
+    intervals = np.diff(read_times) * 1000
     try:
-        for index in indices:
-            y_values[index:] += 1
+        measured_framerate = (len(timestamps) - 1) / (read_times[-1] - read_times[0])
     except Exception:
-        pass
-    return y_values
+        measured_framerate = 0
+    if len(intervals) == 0:
+        intervals = np.zeros(1)
+    return {
+        "Expected Frames": int(expected_frames),
+        "Acquired Frames": len(frame_indices),
+        "Missing Frames": int(expected_frames) - len(frame_indices),
+        "Dropped Frames": int(np.sum(steps[steps > 1] - 1)),
+        "Duplicated Frames": int(np.sum(steps < 1)),
+        "Framerate": framerate,
+        "Measured Framerate": float(measured_framerate),
+        "Read Interval (ms)": {
+            "Median": float(np.percentile(intervals, 50)),
+            "95th Percentile": float(np.percentile(intervals, 95)),
+            "99th Percentile": float(np.percentile(intervals, 99)),
+            "Max": float(np.max(intervals)),
+        },
+    }
 
 
 def average_baseline(frame_list, light_count=1, start_index=0):
@@ -178,7 +436,8 @@ def get_baseline_frame_indices(baseline_indices, frames_acquired):
         frames_acquired (list): List of frames acquired
 
     Returns:
-        list of tuples: List of start/end baseline indices in terms of frames acquired"""
+        list of tuples: List of start/end baseline indices in terms of frames acquired
+    """
     try:
         list_of_indices = []
         for index in baseline_indices:
@@ -1,22 +1,47 @@
 import time
 import sys
 import os
+import threading
+import json
 
 try:
     import nidaqmx
     from nidaqmx.constants import AcquisitionType
     from pylablib.devices import IMAQ
 except ModuleNotFoundError:
-    pass
+    from src.simulation import AcquisitionType
 import numpy as np
+from src.recording import (
+    combine_statistics,
+    max_compressed_frames,
+    RecordingWriter,
+    FrameWriter,
+    RECORDING_FILE,
+    BINNED_RECORDING_FILE,
+)
+from src.manifest import RecordingManifest, MANIFEST_FILE
+from src.preflight import estimate_recording, preflight
 from src.calculations import (
     extend_light_signal,
-    shrink_array,
+    crop_frames,
+    bin_frames,
+    acquisition_window,
     find_rising_indices,
     reduce_stack,
     get_dictionary,
+    frames_acquired_from_camera_signal,
+    frame_timing_report,
+    frame_metadata,
 )
 from src.waveforms import digital_square
+from src.buffers import (
+    FrameBuffer,
+    FrameQueue,
+    FrameLog,
+    BaselineAccumulator,
+    LatestFrames,
+)
+from src.simulation import SimulatedCamera, SimulatedTask, connect_camera
 import warnings
 import logging
 
@@ -30,6 +55,9 @@ warnings.filterwarnings("ignore")
 config = get_dictionary(
     os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.json")
 )
+if not config["Widefield Computer"]:
+    # Off-rig, the simulated DAQ can only trigger a simulated camera
+    config["Camera Backend"] = "Simulated"
 
 
 class Instrument:
@@ -53,14 +81,34 @@ class Camera(Instrument):
             name (str): The name of the camera (can be found using NI-MAX)
         """
         super().__init__(port, name)
-        self.frames = []
-        self.baseline_frames = []
+        self.buffer = None
+        self.queue = None
+        self.chunk_size = 1200
+        self.write_batch_size = 120
+        self.saving_finished = threading.Event()
+        self.recording_statistics = {}
+        self.writer_statistics = []
+        self.saving_error = None
+        self.manifest = None
+        self.saving_finished.set()
+        self.frame_log = FrameLog()
+        self.frames_behind = 0
+        self.latest_frames = LatestFrames()
+        self.baseline_accumulators = []
+        self.baseline_completed = False
+        self.frames_handed, self.writers_start = 0, 0
+        self.first_frame_index = 0
+        self.window = None
         self.stop_signal = False
         self.frames_read = 0
+        self.frames_lost = 0
         self.video_running = False
         try:
-            self.set_binning(config["Binning"])
-            self.cam = IMAQ.IMAQCamera("img0")
+            if config.get("Camera Backend") == "Simulated":
+                self.cam = SimulatedCamera("img0")
+            else:
+                self.set_binning(config["Binning"])
+                self.cam = IMAQ.IMAQCamera("img0")
             self.set_window(config["Binning"])
             self.cam.setup_acquisition()
             self.cam.start_acquisition()
@@ -75,10 +123,102 @@ class Camera(Instrument):
         """
         self.daq = daq
         self.daq.stop_signal = False
-        self.frames = []
-        self.frames_read_list = []
-        self.baseline_read_list = []
+        if config.get("Camera Backend") == "Simulated":
+            self.cam.set_framerate(daq.framerate)
+        self.allocate_buffer()
+        self.latest_frames.reset(max(len(daq.lights), 1), self.buffer.shape)
         self.frames_read = 0
+        self.frames_lost = 0
+        self.frame_log.reset()
+        self.frames_behind, self.max_frames_behind = 0, 0
+
+    def frame_shape(self):
+        """Return the (height, width) of the frames delivered by the camera"""
+        try:
+            return tuple(self.cam.get_data_dimensions())
+        except Exception:
+            return (int(1024 / config["Binning"]), int(1024 / config["Binning"]))
+
+    def buffer_capacity(self):
+        """Return the number of frames kept in memory within the RAM budget
+
+        Returns:
+            int: The capacity of the ring buffer, at most two chunks
+        """
+        height, width = self.frame_shape()
+        budget = config.get("RAM Budget (MB)", 4096) * 1e6
+        # The batches of the recording writer are part of the budget
+        writer_frames = self.write_batch_size * config.get("Write Queue Depth", 2)
+        frames = int(budget // (2 * height * width)) - writer_frames
+        return max(min(frames, 2 * self.chunk_size), 100)
+
+    def preflight(self, directory, duration, framerate, extents=None):
+        """Check that the recordings of an experiment fit on disk and can be written in time
+
+        Args:
+            directory (str): The folder in which the recordings are saved
+            duration (float): The duration of the protocol in seconds
+            framerate (float): The acquisition framerate
+            extents (tuple): The positions of the corners used to resize the frames
+                             Equal to None if original size is kept
+
+        Returns:
+            dict: The needs, the free space and bandwidth of the disk, the errors
+                  preventing the experiment and the warnings
+        """
+        height, width = self.frame_shape()
+        if extents:
+            width = round(extents[1]) - round(extents[0])
+            height = round(extents[3]) - round(extents[2])
+        estimate = estimate_recording(
+            duration,
+            framerate,
+            (height, width),
+            config.get("Software Binning", 1),
+            config.get("Keep Full Resolution", False),
+            self.packs_frames() and config.get("Compression", "None") == "None",
+        )
+        report = preflight(
+            directory,
+            estimate,
+            buffer_frames=self.buffer_capacity(),
+            batch_frames=self.write_batch_size,
+            max_frames=(
+                max_compressed_frames(self.write_batch_size)
+                if config.get("Compression", "None") != "None"
+                else None
+            ),
+        )
+        if config.get("Pack 12-bit Frames", False) and not self.packs_frames():
+            report["Warnings"].append(
+                "The frames are saved unpacked because the Binning is above 1: "
+                "binned pixels do not fit in 12 bits"
+            )
+        for error in report["Errors"]:
+            logging.error(error)
+        for warning in report["Warnings"]:
+            logging.warning(warning)
+        return report
+
+    def allocate_buffer(self):
+        """Create the frame queue, or empty it if its buffer already has the right size"""
+        shape, capacity = self.frame_shape(), self.buffer_capacity()
+        if (
+            self.buffer is None
+            or self.buffer.shape != shape
+            or self.buffer.capacity != capacity
+        ):
+            if self.queue is not None:
+                self.queue.remove_scratch_file()
+            self.buffer, self.queue = None, None
+            self.buffer = FrameBuffer(capacity, *shape)
+            self.queue = FrameQueue(
+                self.buffer,
+                spill=True,
+                scratch_directory=config.get("Scratch Directory") or None,
+            )
+        else:
+            self.queue.reset()
 
     def set_binning(self, binning):
         """Set the binning of the camera
@@ -108,18 +248,109 @@ class Camera(Instrument):
             ) as write_file:
                 write_file.write("\n".join(lines))
 
-    def set_window(self, binning):
-        """Set the window of the camera to the correct size for the binning factor"""
-        self.cam.set_grabber_attribute_value(
-            "IMG_ATTR_ACQWINDOW_HEIGHT", int(1024 / binning), kind="auto"
-        )
-        self.cam.set_grabber_attribute_value(
-            "IMG_ATTR_ACQWINDOW_WIDTH", int(1024 / binning), kind="auto"
+    def set_window(self, binning, extents=None):
+        """Set the window of the camera to the correct size for the binning factor
+
+        Args:
+            binning (int): The binning factor
+            extents (tuple): The positions of the ROI corners to acquire
+                             Equal to None if the whole frame is acquired
+        """
+        size = int(1024 / binning)
+        if extents is None:
+            top, left, height, width = 0, 0, size, size
+        else:
+            top, left, height, width = acquisition_window(extents, size)
+        # Move the window to the corner first so that every intermediate window is valid
+        for name, value in [
+            ("IMG_ATTR_ACQWINDOW_LEFT", 0),
+            ("IMG_ATTR_ACQWINDOW_TOP", 0),
+            ("IMG_ATTR_ACQWINDOW_HEIGHT", height),
+            ("IMG_ATTR_ACQWINDOW_WIDTH", width),
+            ("IMG_ATTR_ACQWINDOW_LEFT", left),
+            ("IMG_ATTR_ACQWINDOW_TOP", top),
+        ]:
+            self.cam.set_grabber_attribute_value(name, value, kind="auto")
+        self.window = None if extents is None else (top, left, height, width)
+
+    def set_roi(self, extents):
+        """Only acquire the frame region enclosing the ROI (or the whole frame)
+
+        Args:
+            extents (tuple): The positions of the ROI corners
+                             Equal to None to acquire the whole frame
+        """
+        try:
+            self.cam.stop_acquisition()
+            self.set_window(config["Binning"], extents)
+            self.cam.setup_acquisition()
+            self.cam.start_acquisition()
+        except Exception as err:
+            logging.warning(f"The acquisition window could not be set: {err}")
+
+    def window_extents(self, extents):
+        """Return the ROI corners relative to the acquisition window
+
+        Args:
+            extents (tuple): The positions of the ROI corners in the whole frame
+                             Equal to None if original size is kept
+
+        Returns:
+            tuple: The positions of the ROI corners in the acquired frames
+        """
+        if extents is None or self.window is None:
+            return extents
+        top, left = self.window[:2]
+        return (
+            round(extents[0]) - left,
+            round(extents[1]) - left,
+            round(extents[2]) - top,
+            round(extents[3]) - top,
         )
 
+    def start_baselines(self, baseline_indices, light_count):
+        """Start accumulating the frames of every baseline window of an acquisition
+
+        Args:
+            baseline_indices (list of tuples): The global index of the first frame of
+                                               each baseline and the index following
+                                               its last frame
+            light_count (int): The number of lights used
+        """
+        accumulators = []
+        for start_index, stop_index in baseline_indices:
+            accumulator = BaselineAccumulator()
+            accumulator.start(
+                light_count, self.frame_shape(), int(start_index), int(stop_index)
+            )
+            accumulators.append(accumulator)
+        self.baseline_accumulators = accumulators
+
     def delete_frames(self):
-        """Read all frames in the buffer"""
+        """Read all frames in the buffer and keep the framegrabber index of the next one
+
+        The framegrabber keeps counting frames from one experiment to the next, so
+        the index of the first frame of the acquisition is kept in first_frame_index.
+        """
         self.cam.read_multiple_images()
+        self.first_frame_index = self.cam.get_frames_status().acquired
+
+    def read_frames(self):
+        """Read the frames available in the framegrabber and log their index and arrival time
+
+        Returns:
+            list of array: The frames read
+        """
+        frames, frame_info = self.cam.read_multiple_images(return_info=True)
+        self.frame_log.append([info[0] for info in frame_info], time.time())
+        return frames
+
+    def check_frame_count(self):
+        """Compare the number of frames read to the number of frames triggered by the DAQ"""
+        sample = int((time.time() - self.daq.start_time) * self.daq.sample_rate)
+        expected = self.expected_frames[min(sample, len(self.expected_frames) - 1)]
+        self.frames_behind = int(expected) - self.frames_read
+        self.max_frames_behind = max(self.max_frames_behind, self.frames_behind)
 
     def loop(self, task):
         """While camera is running, add each acquired frame to a frames list
@@ -128,44 +359,346 @@ class Camera(Instrument):
             task (Task): The nidaqmx task used to track if acquisition is finished
         """
         self.task = task
+        self.expected_frames = frames_acquired_from_camera_signal(
+            self.daq.camera_signal
+        )
+        dropped_frames = 0
         while task.is_task_done() is False and self.daq.stop_signal is False:
+            new_frames, queued = [], False
             try:
                 self.cam.wait_for_frame(timeout=0.1)
-                new_frames = self.cam.read_multiple_images()
-                self.frames += new_frames
+                new_frames = self.read_frames()
                 self.video_running = True
-                if self.adding_frames:
-                    self.baseline_data += new_frames
-                    self.frames_read_list.append(self.frames_read)
-                if self.baseline_completed:
-                    self.baseline_frames += new_frames
-                    self.baseline_read_list.append(self.frames_read)
+                # Accumulated before being queued, so the baseline is complete as soon
+                # as its last frame is in the queue
+                for accumulator in self.baseline_accumulators:
+                    accumulator.add(new_frames, self.frames_read)
+                queued = self.queue.put(new_frames, timeout=0.1)
+                while not queued and not self.daq.stop_signal:
+                    queued = self.queue.put(new_frames, timeout=0.1)
+                self.latest_frames.update(new_frames, self.frames_read)
                 self.frames_read += len(new_frames)
+                self.check_frame_count()
+                if self.frame_log.dropped_frames > dropped_frames:
+                    dropped_frames = self.frame_log.dropped_frames
+                    logging.warning(
+                        f"{dropped_frames} frames dropped by the framegrabber"
+                    )
             except Exception as err:
-                pass
-        self.frames += self.cam.read_multiple_images()
+                if not queued and len(new_frames) > 0:
+                    self.lose_frames(len(new_frames), err)
+            else:
+                if not queued:
+                    self.lose_frames(
+                        len(new_frames),
+                        "the acquisition stopped while the queue was full",
+                    )
+        new_frames, queued = [], False
+        try:
+            new_frames = self.read_frames()
+            for accumulator in self.baseline_accumulators:
+                accumulator.add(new_frames, self.frames_read)
+            queued = self.queue.put(new_frames, timeout=1)
+            self.frames_read += len(new_frames)
+            if not queued:
+                self.lose_frames(len(new_frames), "the queue stayed full")
+        except Exception as err:
+            if not queued and len(new_frames) > 0:
+                self.lose_frames(len(new_frames), err)
+            else:
+                logging.warning(f"The last frames could not be read: {err}")
         self.video_running = False
+        if self.queue.stalls > 0:
+            logging.warning(
+                f"Saving fell behind {self.queue.stalls} times "
+                f"({self.queue.stall_time:.2f} s), up to "
+                f"{self.queue.high_water_mark} frames were waiting in memory"
+            )
+        if self.queue.frames_spilled > 0:
+            logging.warning(
+                f"Saving fell behind, {self.queue.frames_spilled} frames were spilled "
+                f"to disk, up to {self.queue.spill_high_water_mark} at once"
+            )
 
-    def save(self, directory, extents):
-        """Save the acquired frames (reduced if necessary) to a 3D NPY file
+    def lose_frames(self, count, reason):
+        """Count and log frames read from the framegrabber that could not be queued
+
+        Args:
+            count (int): The number of frames lost
+            reason: The error or the reason for which the frames were not queued
+        """
+        self.frames_lost += count
+        logging.warning(
+            f"{count} frames could not be queued ({reason}), "
+            f"{self.frames_lost} frames lost in total"
+        )
+
+    def packs_frames(self, binning=1):
+        """Return True if the saved frames are packed in 12 bits
+
+        Pixels binned by the framegrabber or in software are sums of 12-bit pixels,
+        which do not fit in 12 bits, so they are always saved unpacked.
+
+        Args:
+            binning (int): The software binning factor of the frames. Defaults to 1.
+
+        Returns:
+            bool: True if the frames are packed
+        """
+        return (
+            config.get("Pack 12-bit Frames", False)
+            and config["Binning"] == 1
+            and binning == 1
+        )
+
+    def open_writer(self, path, append=False, binning=1):
+        """Open the recording file and the thread writing the frames to it
+
+        Args:
+            path (str): The path of the recording file
+            append (bool): If True, add frames at the end of an existing recording
+            binning (int): The software binning factor of the frames. Defaults to 1.
+
+        Returns:
+            FrameWriter: The writer of the recording
+        """
+        return FrameWriter(
+            RecordingWriter(
+                path,
+                dtype=np.uint16 if binning**2 * 4095 <= 65535 else np.uint32,
+                preallocated_frames=self.chunk_size,
+                append=append,
+                packed=self.packs_frames(binning),
+                compression=(
+                    config["Compression"].lower()
+                    if config.get("Compression", "None") != "None"
+                    else None
+                ),
+                compression_filter=config.get("Compression Filter", "Shuffle"),
+                compression_level=config.get("Compression Level", 1),
+                manifest=self.manifest,
+            ),
+            self.write_batch_size,
+            config.get("Write Queue Depth", 2),
+        )
+
+    def open_manifest(self, directory, extents=None, append=False):
+        """Write the manifest of the recordings before their first frame
+
+        Args:
+            directory (str): The folder in which the recording files are saved
+            extents (tuple): The positions of the corners used to resize the frames
+            append (bool): If True, keep the manifest of the recordings appended to
+        """
+        path = os.path.join(directory, MANIFEST_FILE)
+        if append and self.manifest is not None and self.manifest.path == path:
+            return
+        light_count = max(len(self.daq.lights), 1)
+        self.manifest = RecordingManifest(
+            path,
+            {
+                "Lights": self.daq.return_lights(),
+                "Light Phase": self.queue.frames_released % light_count,
+                "Framerate": self.daq.framerate,
+                "Exposure": self.daq.exposure,
+                "ROI": list(extents) if extents else None,
+                "Acquisition Window": list(self.window) if self.window else None,
+                "Software Binning": config.get("Software Binning", 1),
+            },
+            append,
+        )
+
+    def open_writers(self, directory, append=False):
+        """Open the writers of the full resolution and software binned recordings
+
+        The binned frames replace the full resolution frames in the recording file,
+        unless both are kept, in which case they are saved in a second file.
+
+        Args:
+            directory (str): The folder in which to save the recording files
+            append (bool): If True, add frames at the end of existing recordings
+
+        Returns:
+            list of tuple: The (writer, binning factor) of each recording
+        """
+        binning = config.get("Software Binning", 1)
+        writers = []
+        if binning == 1 or config.get("Keep Full Resolution", False):
+            writers.append(
+                (self.open_writer(os.path.join(directory, RECORDING_FILE), append), 1)
+            )
+        if binning > 1:
+            path = os.path.join(
+                directory, BINNED_RECORDING_FILE if writers else RECORDING_FILE
+            )
+            writers.append((self.open_writer(path, append, binning), binning))
+        return writers
+
+    def live_save(self, directory=None, extents=None):
+        """Hand the frames to the recording writers while they are acquired
 
         Args:
-            directory (str): The location in which to save the NPY file
+            directory (str): The folder in which to save the recording files
+                             Equal to None if frames are discarded once acquired
             extents (tuple): The positions of the corners used to resize the frames
                              Equal to None if original size is kept
         """
+        self.saving_finished.clear()
+        self.saving_error = None
+        self.recording_statistics, self.writer_statistics = {}, []
+        self.frames_handed = self.writers_start = self.queue.frames_released
+        writers = []
         try:
-            if extents:
-                self.frames = shrink_array(self.frames, extents)
-            if self.is_saving:
-                while self.is_saving:
-                    pass
-            np.save(
-                os.path.join(directory, "data", f"{self.file_index}.npy"), self.frames
+            while True:
+                ready = self.queue.wait(
+                    lambda: self.queue.pending(self.frames_handed)
+                    >= self.write_batch_size
+                    or self.queue.closed,
+                    timeout=0.5,
+                )
+                # Frames written in the meantime are released even without new frames
+                self.release_saved(writers)
+                if not ready:
+                    continue
+                if self.queue.pending(self.frames_handed) == 0:
+                    break
+                if directory is not None and not writers:
+                    # The acquisition has started, its lights and framerate are known
+                    self.open_manifest(directory, extents)
+                    writers = self.open_writers(directory)
+                self.save_chunk(writers, extents)
+        except Exception as err:
+            self.saving_error = err
+            logging.error(
+                f"Saving stopped, the frames left are saved after the acquisition: {err}"
+            )
+        finally:
+            try:
+                self.close_writers(writers)
+                self.release_saved(writers)
+            finally:
+                self.saving_finished.set()
+
+    def close_writers(self, writers):
+        """Close the recording writers, logging the errors instead of raising them
+
+        The statistics of every recording written during the acquisition are
+        combined in recording_statistics.
+
+        Args:
+            writers (list of tuple): The (writer, binning factor) of each recording
+        """
+        for writer, binning in writers:
+            try:
+                writer.close()
+            except Exception as err:
+                self.saving_error = self.saving_error or err
+                logging.error(
+                    f"The recording {writer.recording.path} could not be written: {err}"
+                )
+            try:
+                self.writer_statistics.append(writer.recording.statistics())
+            except Exception as err:
+                pass
+        if self.writer_statistics:
+            self.recording_statistics = combine_statistics(self.writer_statistics)
+
+    def save_chunk(self, writers, extents):
+        """Copy the oldest frames not handed yet to the recording writers
+
+        The frames stay in the queue until the writers have written them to disk (see
+        release_saved), so the frames of a failed write are saved after the
+        acquisition.
+
+        Args:
+            writers (list of tuple): The (writer, binning factor) of each recording
+                                     Empty if frames are discarded
+            extents (tuple): The positions of the corners used to resize the frames
+                             Equal to None if original size is kept
+        """
+        frames = self.queue.get(self.write_batch_size, self.frames_handed)
+        count = len(frames)
+        # The ROI is copied straight from the queue to the write batch
+        frames = crop_frames(frames, self.window_extents(extents))
+        for writer, binning in writers:
+            writer.write(frames if binning == 1 else bin_frames(frames, binning))
+        self.frames_handed += count
+        self.release_saved(writers)
+
+    def release_saved(self, writers):
+        """Release the frames of the queue which every writer has written to disk
+
+        Args:
+            writers (list of tuple): The (writer, binning factor) of each recording
+                                     Empty if frames are discarded
+        """
+        if writers:
+            saved = self.writers_start + min(
+                writer.frames_written for writer, binning in writers
             )
+        else:
+            saved = self.frames_handed
+        if saved > self.queue.frames_released:
+            self.queue.release(saved - self.queue.frames_released)
+
+    def save_timing(self, directory):
+        """Save the index and arrival time of each frame and a report of the acquisition timing
+
+        Args:
+            directory (str): The directory in which to save the files
+        """
+        try:
+            records = self.frame_log.get()
+            np.save(os.path.join(directory, "frame_info.npy"), records)
+            report = frame_timing_report(
+                records["frame_index"],
+                records["timestamp"],
+                self.expected_frames[-1],
+                self.daq.framerate,
+            )
+            report["Max Frames Behind"] = self.max_frames_behind
+            report["Lost Frames"] = self.frames_lost
+            report["Saving Stalls"] = self.queue.stalls
+            report["Saving Stall Time (s)"] = self.queue.stall_time
+            report["Queue High-Water Mark"] = self.queue.high_water_mark
+            report["Spilled Frames"] = self.queue.frames_spilled
+            report["Spill High-Water Mark"] = self.queue.spill_high_water_mark
+            report.update(self.recording_statistics)
+            with open(os.path.join(directory, "timing.json"), "w") as file:
+                json.dump(report, file)
         except Exception as err:
             pass
 
+    def save(self, directory, extents):
+        """Write the frames not yet saved (reduced if necessary) to the recording file
+
+        Args:
+            directory (str): The location in which to save the recording file
+            extents (tuple): The positions of the corners used to resize the frames
+                             Equal to None if original size is kept
+        """
+        try:
+            while not self.saving_finished.wait(timeout=1):
+                if self.saving_error is not None:
+                    break
+            data_directory = os.path.join(directory, "data")
+            if self.queue.pending() > 0:
+                os.makedirs(data_directory, exist_ok=True)
+                self.open_manifest(data_directory, extents, append=True)
+                # Start again from the first frame not written to disk
+                self.frames_handed = self.writers_start = self.queue.frames_released
+                writers = self.open_writers(data_directory, append=True)
+                try:
+                    while self.queue.pending(self.frames_handed) > 0:
+                        self.save_chunk(writers, extents)
+                finally:
+                    self.close_writers(writers)
+                    self.release_saved(writers)
+            if self.manifest is not None and self.saving_error is None:
+                self.manifest.complete()
+        except Exception as err:
+            logging.error(f"The frames could not be saved: {err}")
+
 
 class DAQ:
     def __init__(self, name, lights, stimuli, camera, framerate, exposure):
@@ -183,8 +716,16 @@ class DAQ:
         self.trigger_activated = False
         self.trigger_port = None
         self.framerate, self.exposure = framerate, exposure
-        self.stop_signal = False
+        self.sample_rate = config.get("Sample Rate", 3000)
+        self.stop_event = threading.Event()
+        self.signals_ready = threading.Event()
         self.lights, self.stimuli, self.camera = lights, stimuli, camera
+        if config["Widefield Computer"]:
+            self.task_type = nidaqmx.Task
+        else:
+            self.task_type = SimulatedTask
+        if camera is not None and config.get("Camera Backend") == "Simulated":
+            connect_camera(f"{self.name}/{self.camera.port}", self.camera.cam)
         self.tasks, self.light_signals, self.stim_signal, self.camera_signal = (
             [],
             [],
@@ -200,42 +741,46 @@ class DAQ:
             Instrument(ports["blue"], "blue"),
         ]
 
-        if config["Widefield Computer"]:
-            with nidaqmx.Task(new_task_name="lights") as l_task:
-                with nidaqmx.Task(new_task_name="a_stimuli") as s_task:
-                    for light in self.lights:
-                        l_task.do_channels.add_do_chan(f"{self.name}/{light.port}")
-                    l_task.do_channels.add_do_chan(f"{self.name}/{self.camera.port}")
-                    for stimulus in self.stimuli:
-                        if "ao0" in stimulus.port or "ao1" in stimulus.port:
-                            s_task.ao_channels.add_ao_voltage_chan(
-                                f"{self.name}/{stimulus.port}"
-                            )
-                        else:
-                            l_task.do_channels.add_do_chan(
-                                f"{self.name}/{stimulus.port}"
-                            )
-                    self.sample([s_task, l_task], [False, False])
-                    s_task.write([[0, 0], [0, 0]])
-                    l_task.write(
-                        [
-                            [False, False],
-                            [False, False],
-                            [False, False],
-                            [False, False],
-                            [False, False],
-                            [False, False],
-                        ]
-                    )
-                    self.start([s_task, l_task])
-
-        else:
-            time.sleep(2)
-            self.stop_signal = True
-            pass
+        with self.task_type(new_task_name="lights") as l_task:
+            with self.task_type(new_task_name="a_stimuli") as s_task:
+                for light in self.lights:
+                    l_task.do_channels.add_do_chan(f"{self.name}/{light.port}")
+                l_task.do_channels.add_do_chan(f"{self.name}/{self.camera.port}")
+                for stimulus in self.stimuli:
+                    if "ao0" in stimulus.port or "ao1" in stimulus.port:
+                        s_task.ao_channels.add_ao_voltage_chan(
+                            f"{self.name}/{stimulus.port}"
+                        )
+                    else:
+                        l_task.do_channels.add_do_chan(f"{self.name}/{stimulus.port}")
+                self.sample([s_task, l_task], [False, False])
+                s_task.write([[0, 0], [0, 0]])
+                l_task.write(
+                    [
+                        [False, False],
+                        [False, False],
+                        [False, False],
+                        [False, False],
+                        [False, False],
+                        [False, False],
+                    ]
+                )
+                self.start([s_task, l_task])
 
         self.lights = []
 
+    @property
+    def stop_signal(self):
+        """bool: Whether the acquisition is stopped, backed by the stop_event Event"""
+        return self.stop_event.is_set()
+
+    @stop_signal.setter
+    def stop_signal(self, value):
+        if value:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
+
     def launch(self, name, time_values, stim_values):
         """Generate stimulation, light and camera signal and write them to the DAQ
 
@@ -254,9 +799,19 @@ class DAQ:
             self.generate_camera_wave()
             if config["Extend Signal"]:
                 self.extend_light_wave()
-        
+        self.signals_ready.set()
+
     def run(self):
-        self.write_waveforms()
+        """Write the waveforms to the DAQ and close the camera frame queue once done
+
+        The queue is closed even if the DAQ fails, so that the threads waiting for
+        frames end.
+        """
+        try:
+            self.write_waveforms()
+        finally:
+            if self.camera is not None and self.camera.queue is not None:
+                self.camera.queue.close()
 
     def set_trigger(self, port):
         """Set the trigger port and activate it"""
@@ -284,7 +839,7 @@ class DAQ:
                     self.time_values,
                     self.framerate / len(self.lights),
                     self.framerate * self.exposure / len(self.lights),
-                    int(potential_light_index * 3000 / (self.framerate)),
+                    int(potential_light_index * self.sample_rate / (self.framerate)),
                 )
                 signal[-1] = False
                 self.light_signals.append(signal)
@@ -313,86 +868,64 @@ class DAQ:
     def write_waveforms(self):
         """Write lights, stimuli and camera signal to the DAQ"""
 
-        if config["Widefield Computer"]:
-            with nidaqmx.Task(new_task_name="lights") as l_task:
-                self.control_task = l_task
-                with nidaqmx.Task(new_task_name="a_stimuli") as s_task:
-                    null_lights = [[False, False]]
-                    self.tasks = [l_task, s_task]
-                    for light in self.lights:
-                        l_task.do_channels.add_do_chan(f"{self.name}/{light.port}")
-                        null_lights.append([False, False])
-                    if len(self.lights) > 0:
-                        l_task.do_channels.add_do_chan(
-                            f"{self.name}/{self.camera.port}"
-                        )
-                    for stimulus in self.stimuli:
-                        if "ao0" in stimulus.port or "ao1" in stimulus.port:
-                            s_task.ao_channels.add_ao_voltage_chan(
-                                f"{self.name}/{stimulus.port}"
-                            )
-                        else:
-                            l_task.do_channels.add_do_chan(
-                                f"{self.name}/{stimulus.port}"
-                            )
-                            null_lights.append([False, False])
-                    self.camera.initialize(self)
-                    self.sample([s_task, l_task], self.stim_signal[0])
-                    if len(self.lights) > 0:
-                        self.write(
-                            [s_task, l_task], [self.stim_signal, self.allz_signals]
+        with self.task_type(new_task_name="lights") as l_task:
+            self.control_task = l_task
+            with self.task_type(new_task_name="a_stimuli") as s_task:
+                null_lights = [[False, False]]
+                self.tasks = [l_task, s_task]
+                for light in self.lights:
+                    l_task.do_channels.add_do_chan(f"{self.name}/{light.port}")
+                    null_lights.append([False, False])
+                if len(self.lights) > 0:
+                    l_task.do_channels.add_do_chan(f"{self.name}/{self.camera.port}")
+                for stimulus in self.stimuli:
+                    if "ao0" in stimulus.port or "ao1" in stimulus.port:
+                        s_task.ao_channels.add_ao_voltage_chan(
+                            f"{self.name}/{stimulus.port}"
                         )
-                        self.camera.delete_frames()
-                        if self.trigger_activated:
-                            with nidaqmx.Task(new_task_name="trigger") as t_task:
-                                t_task.di_channels.add_di_chan(
-                                    (f"{self.name}/{self.trigger_port}")
-                                )
-                                while True:
-                                    time.sleep(0.001)
-                                    if t_task.read():
-                                        break
-                        self.start_time = time.time()
-                        self.start([s_task, l_task])
-                        self.camera.loop(l_task)
-                        self.stop([s_task, l_task])
-                        s_task.write([[0, 0], [0, 0]])
-                        l_task.write(null_lights)
-                        self.start([s_task, l_task])
                     else:
-                        self.write(
-                            [s_task, l_task], [self.stim_signal, self.d_stim_signal]
-                        )
-                        self.camera.delete_frames()
-                        if self.trigger_activated:
-                            with nidaqmx.Task(new_task_name="trigger") as t_task:
-                                t_task.di_channels.add_di_chan(
-                                    (f"{self.name}/{self.trigger_port}")
-                                )
-                                while True:
-                                    time.sleep(0.001)
-                                    if t_task.read():
-                                        break
-                        self.start_time = time.time()
-                        self.start([s_task, l_task])
-                        while (
-                            s_task.is_task_done() is False and self.stop_signal is False
-                        ):
-                            time.sleep(0.01)
-                            pass
-                        self.stop([s_task, l_task])
-                        s_task.write([[0, 0], [0, 0]])
-                        l_task.write([False, False])
-                        self.start([s_task, l_task])
+                        l_task.do_channels.add_do_chan(f"{self.name}/{stimulus.port}")
+                        null_lights.append([False, False])
+                self.camera.initialize(self)
+                self.sample([s_task, l_task], self.stim_signal[0])
+                if len(self.lights) > 0:
+                    self.write([s_task, l_task], [self.stim_signal, self.allz_signals])
+                    self.camera.delete_frames()
+                    if self.trigger_activated:
+                        self.wait_for_trigger()
+                    self.start_time = time.time()
+                    self.start([s_task, l_task])
+                    self.camera.loop(l_task)
+                    self.stop([s_task, l_task])
+                    s_task.write([[0, 0], [0, 0]])
+                    l_task.write(null_lights)
+                    self.start([s_task, l_task])
+                else:
+                    self.write([s_task, l_task], [self.stim_signal, self.d_stim_signal])
+                    self.camera.delete_frames()
+                    if self.trigger_activated:
+                        self.wait_for_trigger()
+                    s_task.register_done_event(self.task_done)
+                    self.start_time = time.time()
+                    self.start([s_task, l_task])
+                    self.stop_event.wait()
+                    self.stop([s_task, l_task])
+                    s_task.write([[0, 0], [0, 0]])
+                    l_task.write([False, False])
+                    self.start([s_task, l_task])
 
-        else:
-            self.start_time = time.time()
-            while (
-                time.time() - self.start_time < len(self.stim_signal[0]) / 3000
-                and not self.stop_signal
-            ):
-                time.sleep(0.01)
-                pass
+    def wait_for_trigger(self):
+        """Wait until the trigger port is high or the DAQ is stopped"""
+        with self.task_type(new_task_name="trigger") as t_task:
+            t_task.di_channels.add_di_chan(f"{self.name}/{self.trigger_port}")
+            while not self.stop_event.wait(timeout=0.001):
+                if t_task.read():
+                    break
+
+    def task_done(self, task_handle, status, callback_data):
+        """Stop the acquisition when the nidaqmx task is done (nidaqmx done event callback)"""
+        self.stop_signal = True
+        return 0
 
     def return_lights(self):
         """Return the lights used in the experiment
@@ -406,7 +939,7 @@ class DAQ:
         return lights
 
     def save(self, directory):
-        """Save the light and stimulation data for each frame as a NPY file
+        """Save the light and stimulation data for each frame as NPY files
 
         Args:
             directory (str): The directory in which to save the NPY file
@@ -417,10 +950,27 @@ class DAQ:
             np.save(f"{directory}/light_signal", reduced_stack)
         except Exception as err:
             pass
-        np.save(f"{directory}/stim_signal", self.stim_signal)
+        if config.get("Save Stimulation Signal", True):
+            np.save(f"{directory}/stim_signal", self.stim_signal)
+        try:
+            records = self.camera.frame_log.get()
+            np.save(
+                f"{directory}/frame_metadata",
+                frame_metadata(
+                    self.light_signals,
+                    self.camera_signal,
+                    list(self.stim_signal) + [self.d_stim_signal],
+                    records["frame_index"],
+                    records["timestamp"],
+                    self.camera.first_frame_index,
+                ),
+            )
+        except Exception as err:
+            pass
 
     def reset_daq(self):
         """Reset the DAQ parameters"""
+        self.signals_ready.clear()
         self.light_signals, self.stim_signal, self.camera_signal, self.time_values = (
             [],
             [],
@@ -444,7 +994,7 @@ class DAQ:
             tasks (list): A list of nidaqmx tasks
         """
         for task in tasks:
-            task.wait_until_done(timeout=1.5 * len(self.time_values) / 3000)
+            task.wait_until_done(timeout=1.5 * len(self.time_values) / self.sample_rate)
 
     def sample(self, tasks, signal):
         """Set the sampling rate for a list of nidaqmx tasks
@@ -454,7 +1004,7 @@ class DAQ:
         """
         for task in tasks:
             task.timing.cfg_samp_clk_timing(
-                3000,
+                self.sample_rate,
                 sample_mode=AcquisitionType.FINITE,
                 samps_per_chan=len(signal),
             )
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.recording import MAGIC, HEADER_SIZE, DATA_OFFSET, RECORDING_FILE, read_header
+
+MANIFEST_FILE = "manifest.json"
+
+
+def write_json_atomically(path, dictionary):
+    """Write a JSON file so that readers always find either its old or its new content
+
+    Args:
+        path (str): The path of the file
+        dictionary (dict): The content of the file
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(dictionary, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+class RecordingManifest:
+    def __init__(self, path, metadata=None, append=False):
+        """A description of the recordings of an acquisition, updated after every write
+
+        The manifest is written before the first frame and rewritten atomically each
+        time frames are appended to a recording file, so a valid recording can be
+        recovered from it if the acquisition is interrupted.
+
+        Args:
+            path (str): The path of the manifest file
+            metadata (dict): The description of the acquisition (lights, framerate...)
+            append (bool): If True, keep the content of an existing manifest
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        if append and os.path.exists(path):
+            with open(path, "r") as file:
+                self.manifest = json.load(file)
+            self.manifest["Complete"] = False
+        else:
+            self.manifest = {
+                "Started": time.time(),
+                "Updated": time.time(),
+                "Complete": False,
+                **(metadata or {}),
+                "Files": {},
+            }
+        self.write()
+
+    def write(self):
+        """Write the manifest file"""
+        self.manifest["Updated"] = time.time()
+        write_json_atomically(self.path, self.manifest)
+
+    def add_chunk(self, recording, first_frame, frame_count, offset, size):
+        """Record frames appended to a recording file
+
+        Args:
+            recording (RecordingWriter): The writer of the recording file
+            first_frame (int): The index of the first frame appended
+            frame_count (int): The number of frames appended
+            offset (int): The position of the frames in the file in bytes
+            size (int): The size of the frames in bytes
+        """
+        with self.lock:
+            file = self.manifest["Files"].setdefault(
+                os.path.basename(recording.path), {"Chunks": []}
+            )
+            file["Dtype"] = recording.header["Dtype"]
+            file["Shape"] = recording.header["Shape"]
+            file["Encoding"] = recording.header.get("Encoding", "Raw")
+            file["Frames"] = first_frame + frame_count
+            file["Index Entries"] = recording.header["Index Entries"]
+            file["Chunks"].append(
+                [first_frame, frame_count, offset, size, round(time.time(), 6)]
+            )
+            self.write()
+
+    def complete(self):
+        """Mark the acquisition as complete"""
+        with self.lock:
+            self.manifest["Complete"] = True
+            self.write()
+
+
+def recover_recording(directory):
+    """Rebuild valid recording files from the manifest of an interrupted acquisition
+
+    The header and index of each recording file are cut back to the last chunk of
+    frames recorded in the manifest, so only the manifest and the headers are read.
+
+    Args:
+        directory (str): The data folder holding the manifest and recording files
+
+    Returns:
+        dict: The number of frames recovered in each recording file
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), "r") as file:
+        manifest = json.load(file)
+    recovered = {}
+    for name, description in manifest["Files"].items():
+        path = os.path.join(directory, name)
+        header = read_header(path)
+        if not description["Chunks"]:
+            continue
+        first_frame, frame_count, offset, size = description["Chunks"][-1][:4]
+        entries = description["Index Entries"]
+        header["Shape"] = description["Shape"]
+        header["Frames"] = first_frame + frame_count
+        header["Index Entries"] = entries
+        header["Data Size"] = offset + size - DATA_OFFSET
+        index = np.fromfile(path, "<i8", entries * 4, offset=HEADER_SIZE).reshape(-1, 4)
+        # The last range may have been extended by frames written after the manifest
+        index[-1, 1] = header["Frames"] - index[-1, 0]
+        index[-1, 3] = offset + size - index[-1, 2]
+        with open(path, "r+b") as file:
+            file.seek(HEADER_SIZE)
+            file.write(index.astype("<i8").tobytes())
+            file.seek(0)
+            file.write((MAGIC + json.dumps(header).encode()).ljust(HEADER_SIZE, b" "))
+            file.truncate(DATA_OFFSET + header["Data Size"])
+        recovered[name] = header["Frames"]
+    manifest["Recovered"] = time.time()
+    write_json_atomically(os.path.join(directory, MANIFEST_FILE), manifest)
+    metadata_path = os.path.join(os.path.dirname(directory), "metadata.json")
+    if not os.path.exists(metadata_path) and RECORDING_FILE in manifest["Files"]:
+        write_json_atomically(
+            metadata_path,
+            {
+                "Lights": manifest.get("Lights", []),
+                "Framerate": manifest.get("Framerate"),
+                "Exposition": manifest.get("Exposure"),
+                "Dimensions": manifest["Files"][RECORDING_FILE]["Shape"][::-1],
+                "Software Binning": manifest.get("Software Binning", 1),
+                "Light Phase": manifest.get("Light Phase", 0),
+                "Recovered": True,
+            },
+        )
+    return recovered
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recover the recordings of an interrupted acquisition"
+    )
+    parser.add_argument("directory", help="The data folder of the experiment")
+    args = parser.parse_args()
+    for name, frames in recover_recording(args.directory).items():
+        print(f"{name}: {frames} frames recovered")
+
+
+if __name__ == "__main__":
+    main()
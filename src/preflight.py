@@ -0,0 +1,169 @@
+import os
+import time
+import shutil
+import numpy as np
+
+
+def estimate_recording(
+    duration,
+    framerate,
+    frame_shape,
+    software_binning=1,
+    keep_full_resolution=False,
+    packed=False,
+):
+    """Estimate the data rate and size of the recordings of an experiment
+
+    Compression is not taken into account, the estimate is the worst case.
+
+    Args:
+        duration (float): The duration of the protocol in seconds
+        framerate (float): The acquisition framerate (all lights together)
+        frame_shape (tuple): The (height, width) of the saved frames
+        software_binning (int): The software binning factor. Defaults to 1.
+        keep_full_resolution (bool): If True, the full resolution frames are saved
+                                     next to the binned frames. Defaults to False.
+        packed (bool): If True, frames are packed in 12 bits. Defaults to False.
+
+    Returns:
+        dict: The number of frames, the framerate, the size of each frame in bytes,
+              the data rate in bytes per second and the total size in bytes
+    """
+    height, width = frame_shape
+    frame_bytes = 0
+    if software_binning == 1 or keep_full_resolution:
+        frame_bytes += height * -(-width * 3 // 2) if packed else height * width * 2
+    if software_binning > 1:
+        itemsize = 2 if software_binning**2 * 4095 <= 65535 else 4
+        frame_bytes += (
+            (height // software_binning) * (width // software_binning) * itemsize
+        )
+    frame_count = int(np.ceil(duration * framerate))
+    return {
+        "Frames": frame_count,
+        "Framerate": framerate,
+        "Frame Size": frame_bytes,
+        "Data Rate": frame_bytes * framerate,
+        "Total Size": frame_bytes * frame_count,
+    }
+
+
+def probe_write_bandwidth(directory, size=32e6, block_size=4e6):
+    """Measure the speed at which data is written to disk in a folder
+
+    Args:
+        directory (str): The folder in which to write a temporary file
+        size (float): The number of bytes written. Defaults to 32 MB.
+        block_size (float): The number of bytes written at once. Defaults to 4 MB.
+
+    Returns:
+        float: The write bandwidth in bytes per second
+    """
+    block = np.random.default_rng(0).integers(
+        0, 4096, int(block_size) // 2, dtype=np.uint16
+    )
+    path = os.path.join(directory, ".preflight_probe")
+    try:
+        start_time = time.perf_counter()
+        with open(path, "wb") as file:
+            for _ in range(max(int(size // block_size), 1)):
+                file.write(block)
+            file.flush()
+            os.fsync(file.fileno())
+        elapsed_time = time.perf_counter() - start_time
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return max(int(size // block_size), 1) * block.nbytes / elapsed_time
+
+
+def preflight(
+    directory,
+    estimate,
+    margin=1.5,
+    probe_size=32e6,
+    buffer_frames=None,
+    batch_frames=1,
+    max_frames=None,
+):
+    """Check that the recordings of an experiment fit on disk and can be written in time
+
+    When the number of frames kept in memory is given, the seconds of disk stall
+    they cover at the framerate are compared with the time the disk takes to write
+    a batch of frames at the measured bandwidth.
+
+    Args:
+        directory (str): The folder in which the recordings are saved
+        estimate (dict): The estimate of the recordings (see estimate_recording)
+        margin (float): The factor by which the bandwidth, free space and memory
+                        should exceed the needs to avoid a warning. Defaults to 1.5.
+        probe_size (float): The number of bytes written to measure the bandwidth.
+                            Defaults to 32 MB.
+        buffer_frames (int): The number of frames kept in memory within the RAM
+                             budget. Defaults to None (not checked).
+        batch_frames (int): The number of frames written to disk at once.
+                            Defaults to 1.
+        max_frames (int): The number of frames a recording file can hold.
+                          Defaults to None (no limit).
+
+    Returns:
+        dict: The needs, the free space and bandwidth of the disk, the errors
+              preventing the experiment and the warnings
+    """
+    report = {
+        "Data Rate (MB/s)": estimate["Data Rate"] / 1e6,
+        "Total Size (GB)": estimate["Total Size"] / 1e9,
+        "Errors": [],
+        "Warnings": [],
+    }
+    if max_frames is not None and estimate["Frames"] > max_frames:
+        report["Errors"].append(
+            f"The protocol acquires {estimate['Frames']} frames but a compressed "
+            f"recording holds at most {max_frames} frames"
+        )
+    existing = directory
+    while not os.path.isdir(existing) and os.path.dirname(existing) != existing:
+        existing = os.path.dirname(existing)
+    try:
+        free_space = shutil.disk_usage(existing).free
+        bandwidth = probe_write_bandwidth(existing, probe_size)
+    except OSError as err:
+        report["Errors"].append(f"The folder {directory} cannot be written: {err}")
+        return report
+    report["Free Space (GB)"] = free_space / 1e9
+    report["Write Bandwidth (MB/s)"] = bandwidth / 1e6
+    if estimate["Total Size"] > free_space:
+        report["Errors"].append(
+            f"The recordings need {estimate['Total Size'] / 1e9:.1f} GB but only "
+            f"{free_space / 1e9:.1f} GB are free"
+        )
+    elif estimate["Total Size"] * margin > free_space:
+        report["Warnings"].append(
+            f"The recordings will fill the disk ({estimate['Total Size'] / 1e9:.1f} "
+            f"GB of {free_space / 1e9:.1f} GB free)"
+        )
+    if estimate["Data Rate"] > bandwidth:
+        report["Errors"].append(
+            f"Frames are acquired at {estimate['Data Rate'] / 1e6:.0f} MB/s but the "
+            f"disk only writes {bandwidth / 1e6:.0f} MB/s"
+        )
+    elif estimate["Data Rate"] * margin > bandwidth:
+        report["Warnings"].append(
+            f"The disk writes {bandwidth / 1e6:.0f} MB/s, barely more than the "
+            f"{estimate['Data Rate'] / 1e6:.0f} MB/s at which frames are acquired"
+        )
+    if buffer_frames is not None and estimate["Framerate"] > 0:
+        stall_time = buffer_frames / estimate["Framerate"]
+        batch_time = batch_frames * estimate["Frame Size"] / bandwidth
+        report["RAM Buffer (s)"] = stall_time
+        report["Batch Write Time (s)"] = batch_time
+        if batch_time * margin > stall_time:
+            report["Warnings"].append(
+                f"The RAM budget holds {buffer_frames} frames ({stall_time:.1f} s at "
+                f"{estimate['Framerate']:g} fps) but the disk takes {batch_time:.1f} s "
+                f"to write a batch of {batch_frames} frames, frames will be spilled "
+                f"to disk"
+            )
+    return report
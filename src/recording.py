@@ -0,0 +1,839 @@
+import os
+import json
+import lzma
+import queue
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+RECORDING_FILE = "recording.raw"
+BINNED_RECORDING_FILE = "binned.raw"
+CHUNK_INDEX_FILE = "index.json"
+MAGIC = b"WFRAW01\n"
+HEADER_SIZE = 4096
+INDEX_CAPACITY = 65536
+DATA_OFFSET = HEADER_SIZE + INDEX_CAPACITY * 4 * 8
+PACKED_12_BIT = "Packed 12-bit"
+COMPRESSED = "Compressed"
+
+
+def pack_12bit(frames):
+    """Pack 12-bit pixels two by two in three bytes along the rows of frames
+
+    Args:
+        frames (array): The frames (any shape), with values below 4096
+
+    Returns:
+        array: The uint8 packed rows, ceil(1.5 * width) bytes each
+
+    Raises:
+        ValueError: If a pixel does not fit in 12 bits
+    """
+    frames = np.asarray(frames, dtype=np.uint16)
+    if frames.size > 0 and frames.max() > 4095:
+        raise ValueError("The frames have values above 12 bits")
+    width = frames.shape[-1]
+    if width % 2 == 1:
+        frames = np.concatenate(
+            (frames, np.zeros((*frames.shape[:-1], 1), dtype=np.uint16)), axis=-1
+        )
+    first, second = frames[..., 0::2], frames[..., 1::2]
+    packed = np.empty((*frames.shape[:-1], frames.shape[-1] // 2 * 3), dtype=np.uint8)
+    packed[..., 0::3] = first & 0xFF
+    packed[..., 1::3] = (first >> 8) | ((second & 0xF) << 4)
+    packed[..., 2::3] = second >> 4
+    return packed[..., : (3 * width + 1) // 2]
+
+
+def unpack_12bit(packed, width=None):
+    """Unpack rows of 12-bit pixels stored two by two in three bytes
+
+    Args:
+        packed (array): The uint8 packed rows
+        width (int): The number of pixels per row. Defaults to floor(2 * bytes / 3).
+
+    Returns:
+        array: The uint16 frames
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    if width is None:
+        width = packed.shape[-1] * 2 // 3
+    if packed.shape[-1] % 3 != 0:
+        packed = np.concatenate(
+            (packed, np.zeros((*packed.shape[:-1], 1), dtype=np.uint8)), axis=-1
+        )
+    low, middle, high = (packed[..., i::3].astype(np.uint16) for i in range(3))
+    frames = np.empty((*packed.shape[:-1], packed.shape[-1] // 3 * 2), dtype=np.uint16)
+    frames[..., 0::2] = low | ((middle & 0xF) << 8)
+    frames[..., 1::2] = (middle >> 4) | (high << 4)
+    return frames[..., :width]
+
+
+class SelectedFrames:
+    def __init__(self, frames, indices):
+        """Frames selected from lazy frames, read only when they are accessed
+
+        Args:
+            frames (array): The lazy frames (PackedFrames or IndexedFrames) to select from
+            indices (array): The indices of the selected frames
+        """
+        self.frames = frames
+        self.indices = np.asarray(indices)
+        self.shape = (len(self.indices), *frames.shape[1:])
+        self.dtype = frames.dtype
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self.frames[(self.indices[key[0]], *key[1:])]
+
+    def __array__(self, dtype=None, copy=None):
+        frames = self[:]
+        return frames if dtype is None else frames.astype(dtype)
+
+
+def select_frames(frames, key):
+    """Return a lazy selection of the frames if the key only strides over the frames
+
+    Args:
+        frames (array): The lazy frames (PackedFrames or IndexedFrames)
+        key (tuple): The key used to access the frames
+
+    Returns:
+        SelectedFrames: The selected frames, None if the key must be read right away
+    """
+    if not isinstance(key[0], slice) or key[0].step in (None, 1):
+        return None
+    if any(not isinstance(part, slice) or part != slice(None) for part in key[1:]):
+        return None
+    return SelectedFrames(frames, np.arange(frames.shape[0])[key[0]])
+
+
+class PackedFrames:
+    def __init__(self, packed, width):
+        """Frames stored as packed 12-bit rows, unpacked when they are accessed
+
+        Args:
+            packed (array): The (frame, height, bytes) packed frames, usually memory-mapped
+            width (int): The width of the frames in pixels
+        """
+        self.packed = packed
+        self.shape = (*packed.shape[:-1], width)
+        self.dtype = np.dtype(np.uint16)
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        selected = select_frames(self, key)
+        if selected is not None:
+            return selected
+        packed = self.packed[key[0]]
+        frames = unpack_12bit(packed, self.shape[2])
+        if packed.ndim == 3:
+            return frames[(slice(None), *key[1:])]
+        return frames[key[1:]]
+
+    def __array__(self, dtype=None, copy=None):
+        frames = unpack_12bit(self.packed, self.shape[2])
+        return frames if dtype is None else frames.astype(dtype)
+
+
+def compress_frames(frames, codec="zlib", level=1, frame_filter="Shuffle"):
+    """Losslessly compress frames after filtering them to make them more compressible
+
+    Args:
+        frames (array): The frames to compress
+        codec (str): "zlib" or "lzma". Defaults to "zlib".
+        level (int): The compression level (zlib) or preset (lzma). Defaults to 1.
+        frame_filter (str): "Delta" stores the difference between neighbouring pixels,
+                            "Shuffle" groups the low and high bytes of the pixels and
+                            "None" keeps the pixels. Defaults to "Shuffle".
+
+    Returns:
+        bytes: The compressed frames
+    """
+    frames = np.ascontiguousarray(frames)
+    if frame_filter == "Delta":
+        filtered = frames.copy()
+        filtered[..., 1:] -= frames[..., :-1]
+        data = filtered.tobytes()
+    elif frame_filter == "Shuffle":
+        data = frames.view(np.uint8).reshape(-1, frames.itemsize).T.tobytes()
+    else:
+        data = frames.tobytes()
+    if codec == "lzma":
+        return lzma.compress(data, preset=level)
+    return zlib.compress(data, level)
+
+
+def decompress_frames(data, shape, dtype, codec="zlib", frame_filter="Shuffle"):
+    """Decompress frames compressed by compress_frames
+
+    Args:
+        data (bytes): The compressed frames
+        shape (tuple): The shape of the frames
+        dtype (type): The data type of the frames
+        codec (str): "zlib" or "lzma". Defaults to "zlib".
+        frame_filter (str): The filter used for the compression. Defaults to "Shuffle".
+
+    Returns:
+        array: The frames
+    """
+    data = lzma.decompress(data) if codec == "lzma" else zlib.decompress(data)
+    dtype = np.dtype(dtype)
+    if frame_filter == "Shuffle":
+        data = np.frombuffer(data, np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+    frames = np.frombuffer(data, dtype).reshape(shape)
+    if frame_filter == "Delta":
+        return np.cumsum(frames, axis=-1, dtype=dtype)
+    return frames.copy()
+
+
+class IndexedFrames(ABC):
+    """Frames stored by chunks, read (in parallel) only when they are accessed
+
+    Subclasses set shape, dtype and the first frame of each chunk (starts), and
+    implement read_chunk.
+    """
+
+    ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    @abstractmethod
+    def read_chunk(self, position):
+        """Return the frames of a chunk
+
+        Args:
+            position (int): The position of the chunk in the index
+
+        Returns:
+            array: The frames of the chunk
+        """
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        selected = select_frames(self, key)
+        if selected is not None:
+            return selected
+        indices = np.arange(self.shape[0])[key[0]]
+        frame_indices = np.atleast_1d(indices)
+        chunk_positions = np.searchsorted(self.starts, frame_indices, side="right") - 1
+        needed = np.unique(chunk_positions)
+        with ThreadPoolExecutor() as pool:
+            chunks = dict(zip(needed, pool.map(self.read_chunk, needed)))
+        frames = np.empty((len(frame_indices), *self.shape[1:]), dtype=self.dtype)
+        for position, chunk in chunks.items():
+            selected = chunk_positions == position
+            frames[selected] = chunk[frame_indices[selected] - self.starts[position]]
+        if np.ndim(indices) == 0:
+            return frames[0][key[1:]]
+        return frames[(slice(None), *key[1:])]
+
+    def __array__(self, dtype=None, copy=None):
+        frames = self[:]
+        return frames if dtype is None else frames.astype(dtype)
+
+
+class CompressedFrames(IndexedFrames):
+    def __init__(self, path, header, index):
+        """Frames stored as compressed chunks, decompressed in parallel when accessed
+
+        Args:
+            path (str): The path of the recording file
+            header (dict): The header of the recording
+            index (array): The (first frame, frame count, byte offset, byte size) of each chunk
+        """
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        self.header = header
+        self.index = index
+        self.starts = index[:, 0]
+        self.shape = (header["Frames"], *header["Shape"])
+        self.dtype = np.dtype(header["Dtype"])
+
+    def read_chunk(self, position):
+        """Decompress a chunk of frames
+
+        Args:
+            position (int): The position of the chunk in the index
+
+        Returns:
+            array: The frames of the chunk
+        """
+        first_frame, frame_count, offset, size = self.index[position]
+        return decompress_frames(
+            self.data[offset : offset + size].tobytes(),
+            (frame_count, *self.shape[1:]),
+            self.dtype,
+            self.header["Compression"]["Codec"],
+            self.header["Compression"]["Filter"],
+        )
+
+
+class ChunkedFrames(IndexedFrames):
+    def __init__(self, directory, index):
+        """The numbered NPY chunks of an older acquisition, memory-mapped when accessed
+
+        Args:
+            directory (str): The data folder holding the chunks
+            index (dict): The index of the chunks (see index_chunks)
+        """
+        self.directory = directory
+        self.chunks = index["Chunks"]
+        self.starts = np.array([chunk["First Frame"] for chunk in self.chunks])
+        shape = self.chunks[0]["Shape"] if self.chunks else [0, 0]
+        self.shape = (index["Frames"], *shape)
+        self.dtype = np.dtype(self.chunks[0]["Dtype"] if self.chunks else np.uint16)
+
+    def read_chunk(self, position):
+        """Memory-map a chunk of frames
+
+        Args:
+            position (int): The position of the chunk in the index
+
+        Returns:
+            array: The frames of the chunk
+        """
+        chunk = self.chunks[position]
+        return np.memmap(
+            os.path.join(self.directory, chunk["File"]),
+            dtype=chunk["Dtype"],
+            mode="r",
+            offset=chunk["Offset"],
+            shape=(chunk["Frames"], *chunk["Shape"]),
+            order="F" if chunk.get("Fortran Order") else "C",
+        )
+
+
+def index_chunks(directory):
+    """Return the index of the numbered NPY chunks of an older acquisition
+
+    The index maps the global frame ranges to the chunk files and the position of
+    their frames. It is saved in the data folder (as index.json) the first time,
+    after reading the header of each chunk, and read back in a single read
+    afterwards as long as the name, size and modification time of every chunk
+    still match.
+
+    Args:
+        directory (str): The data folder holding the chunks
+
+    Returns:
+        dict: The number of frames and the file, first frame, frame count, data
+              offset, frame shape, data type, file size and modification time
+              of each chunk
+    """
+    files = sorted(
+        (file for file in os.listdir(directory) if file.endswith(".npy")),
+        key=natural_key,
+    )
+    files = [(name, os.stat(os.path.join(directory, name))) for name in files]
+    path = os.path.join(directory, CHUNK_INDEX_FILE)
+    try:
+        with open(path, "r") as file:
+            index = json.load(file)
+        if [
+            (chunk["File"], chunk["Size"], chunk["Modified"])
+            for chunk in index["Chunks"]
+        ] == [(name, stat.st_size, stat.st_mtime_ns) for name, stat in files]:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    chunks, first_frame = [], 0
+    for name, stat in files:
+        with open(os.path.join(directory, name), "rb") as file:
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            chunk = {
+                "File": name,
+                "First Frame": first_frame,
+                "Frames": shape[0],
+                "Offset": file.tell(),
+                "Shape": list(shape[1:]),
+                "Dtype": dtype.str,
+                "Size": stat.st_size,
+                "Modified": stat.st_mtime_ns,
+            }
+        if fortran_order:
+            chunk["Fortran Order"] = True
+        chunks.append(chunk)
+        first_frame += shape[0]
+    index = {"Frames": first_frame, "Chunks": chunks}
+    try:
+        with open(path, "w") as file:
+            json.dump(index, file)
+    except OSError:
+        pass
+    return index
+
+
+class RecordingWriter:
+    def __init__(
+        self,
+        path,
+        shape=None,
+        dtype=np.uint16,
+        preallocated_frames=1200,
+        append=False,
+        packed=False,
+        compression=None,
+        compression_filter="Shuffle",
+        compression_level=1,
+        compression_chunk=16,
+        manifest=None,
+    ):
+        """An append-only raw frame file with a header and a frame range index
+
+        The file starts with a header (JSON padded to a fixed size) holding the dtype,
+        the frame shape, the encoding and the number of frames, followed by a table of
+        the frame ranges appended (first frame, frame count, byte offset, byte size)
+        and the frames, raw, packed in 12 bits or compressed by chunks of frames in a
+        thread pool. The file is grown by preallocated blocks and truncated when closed.
+
+        Args:
+            path (str): The path of the recording file
+            shape (tuple): The (height, width) of the frames. Defaults to the frames appended.
+            dtype (type): The data type of the frames. Defaults to uint16.
+            preallocated_frames (int): The number of frames allocated at once. Defaults to 1200.
+            append (bool): If True, add frames at the end of an existing recording.
+                           Defaults to False (an existing recording is overwritten).
+            packed (bool): If True, store 12-bit frames packed in 1.5 bytes per pixel.
+                           Defaults to False. Ignored when appending.
+            compression (str): "zlib" or "lzma" to compress the frames, which takes
+                               precedence over packing. Defaults to None.
+            compression_filter (str): "Shuffle", "Delta" or "None". Defaults to "Shuffle".
+            compression_level (int): The level of the codec. Defaults to 1.
+            compression_chunk (int): The number of frames compressed together.
+                                     Defaults to 16.
+            manifest (RecordingManifest): Updated after each append. Defaults to None.
+        """
+        self.path = path
+        self.preallocated_frames = preallocated_frames
+        self.manifest = manifest
+        self.pool = None
+        self.raw_size, self.stored_size, self.encoding_time = 0, 0, 0
+        if append and os.path.exists(path):
+            self.header = read_header(path)
+            self.index = read_index(path)
+            self.file = open(path, "r+b")
+        else:
+            self.header = {
+                "Dtype": np.dtype(dtype).name,
+                "Shape": list(shape) if shape is not None else None,
+                "Encoding": PACKED_12_BIT if packed else "Raw",
+                "Frames": 0,
+                "Index Entries": 0,
+                "Data Size": 0,
+            }
+            if compression is not None:
+                self.header["Encoding"] = COMPRESSED
+                self.header["Compression"] = {
+                    "Codec": compression,
+                    "Filter": compression_filter,
+                    "Level": compression_level,
+                    "Chunk Frames": compression_chunk,
+                }
+            self.index = np.zeros((0, 4), dtype=np.int64)
+            self.file = open(path, "w+b")
+            self.write_header()
+        self.allocated_size = os.path.getsize(path)
+
+    @property
+    def frame_count(self):
+        """Return the number of frames in the recording"""
+        return self.header["Frames"]
+
+    def write_header(self):
+        """Write the header at the start of the file"""
+        header = MAGIC + json.dumps(self.header).encode()
+        if len(header) > HEADER_SIZE:
+            raise ValueError("The recording header is too large")
+        self.file.seek(0)
+        self.file.write(header.ljust(HEADER_SIZE, b" "))
+
+    def append(self, frames):
+        """Write frames at the end of the recording
+
+        Args:
+            frames (array): The (frame, height, width) frames to append
+        """
+        frames = np.ascontiguousarray(frames, dtype=self.header["Dtype"])
+        if len(frames) == 0:
+            return
+        if self.header["Shape"] is None:
+            self.header["Shape"] = list(frames.shape[1:])
+        elif list(frames.shape[1:]) != self.header["Shape"]:
+            raise ValueError("The frames do not have the shape of the recording")
+        first_frame, data_size = self.header["Frames"], self.header["Data Size"]
+        start_time = time.perf_counter()
+        if self.header.get("Encoding") == COMPRESSED:
+            chunk_frames = self.header["Compression"]["Chunk Frames"]
+            chunks = [
+                frames[start : start + chunk_frames]
+                for start in range(0, len(frames), chunk_frames)
+            ]
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor()
+            compressed = list(
+                self.pool.map(
+                    lambda chunk: compress_frames(
+                        chunk,
+                        self.header["Compression"]["Codec"],
+                        self.header["Compression"]["Level"],
+                        self.header["Compression"]["Filter"],
+                    ),
+                    chunks,
+                )
+            )
+            self.encoding_time += time.perf_counter() - start_time
+            for chunk, data in zip(chunks, compressed):
+                self.write_data(len(chunk), data)
+        else:
+            if self.header.get("Encoding") == PACKED_12_BIT:
+                data = pack_12bit(frames)
+            else:
+                data = frames
+            self.encoding_time += time.perf_counter() - start_time
+            self.write_data(len(frames), data.tobytes())
+        self.raw_size += frames.nbytes
+        self.file.flush()
+        self.write_header()
+        self.file.flush()
+        if self.manifest is not None:
+            self.manifest.add_chunk(
+                self,
+                first_frame,
+                len(frames),
+                DATA_OFFSET + data_size,
+                self.header["Data Size"] - data_size,
+            )
+
+    def write_data(self, frame_count, data):
+        """Write encoded frames at the end of the data and index them
+
+        Args:
+            frame_count (int): The number of frames
+            data (bytes): The encoded frames
+        """
+        offset = DATA_OFFSET + self.header["Data Size"]
+        end = offset + len(data)
+        if end > self.allocated_size:
+            self.allocated_size = (
+                end + self.preallocated_frames * len(data) // frame_count
+            )
+            self.file.truncate(self.allocated_size)
+        self.file.seek(offset)
+        self.file.write(data)
+        self.add_index_entry(self.header["Frames"], frame_count, offset, len(data))
+        self.header["Frames"] += frame_count
+        self.header["Data Size"] += len(data)
+        self.stored_size += len(data)
+
+    def statistics(self):
+        """Return the size of the frames written and the speed of their encoding
+
+        Returns:
+            dict: The encoding, raw and stored sizes, compression ratio, encoding time
+                  and, for encoded frames, the encoding throughput
+        """
+        return combine_statistics(
+            [
+                {
+                    "Encoding": self.header.get("Encoding", "Raw"),
+                    "Raw Size (MB)": self.raw_size / 1e6,
+                    "Stored Size (MB)": self.stored_size / 1e6,
+                    "Encoding Time (s)": self.encoding_time,
+                }
+            ]
+        )
+
+    def add_index_entry(self, first_frame, frame_count, offset, size):
+        """Record the position of a range of frames, merged with the previous one if contiguous
+
+        Args:
+            first_frame (int): The index of the first frame
+            frame_count (int): The number of frames
+            offset (int): The position of the frames in the file in bytes
+            size (int): The size of the frames in bytes
+        """
+        if len(self.index) > 0:
+            last = self.index[-1]
+            if (
+                self.header.get("Encoding") != COMPRESSED
+                and last[0] + last[1] == first_frame
+                and last[2] + last[3] == offset
+                and last[3] // last[1] == size // frame_count
+            ):
+                last[1] += frame_count
+                last[3] += size
+                self.write_index_entry(len(self.index) - 1)
+                return
+        if len(self.index) >= INDEX_CAPACITY:
+            raise ValueError("The recording index is full")
+        self.index = np.vstack((self.index, [[first_frame, frame_count, offset, size]]))
+        self.header["Index Entries"] = len(self.index)
+        self.write_index_entry(len(self.index) - 1)
+
+    def write_index_entry(self, position):
+        """Write an entry of the index table to the file
+
+        Args:
+            position (int): The position of the entry in the index
+        """
+        self.file.seek(HEADER_SIZE + position * 4 * 8)
+        self.file.write(self.index[position].astype("<i8").tobytes())
+
+    def close(self):
+        """Remove the unused preallocated space and close the file"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if not self.file.closed:
+            self.file.truncate(DATA_OFFSET + self.header["Data Size"])
+            self.file.close()
+
+
+def max_compressed_frames(batch_frames, compression_chunk=16):
+    """Return the number of frames a compressed recording can index
+
+    Each batch appended is compressed by chunks with one index entry each, and
+    the index holds INDEX_CAPACITY entries.
+
+    Args:
+        batch_frames (int): The number of frames appended at once
+        compression_chunk (int): The number of frames compressed together.
+                                 Defaults to 16.
+
+    Returns:
+        int: The number of frames after which the index is full
+    """
+    entries_per_batch = -(-batch_frames // compression_chunk)
+    return INDEX_CAPACITY // entries_per_batch * batch_frames
+
+
+def combine_statistics(statistics):
+    """Combine the statistics of several recordings into those of all their frames
+
+    Args:
+        statistics (list of dict): The statistics of each recording (see
+                                   RecordingWriter.statistics)
+
+    Returns:
+        dict: The encodings, the total raw and stored sizes, the compression ratio,
+              the encoding time and, if frames were encoded, the encoding throughput
+              of the encoded frames
+    """
+    encodings = []
+    for recording in statistics:
+        if recording["Encoding"] not in encodings:
+            encodings.append(recording["Encoding"])
+    raw_size = sum(recording["Raw Size (MB)"] for recording in statistics)
+    stored_size = sum(recording["Stored Size (MB)"] for recording in statistics)
+    combined = {
+        "Encoding": ", ".join(encodings),
+        "Raw Size (MB)": raw_size,
+        "Stored Size (MB)": stored_size,
+        "Compression Ratio": raw_size / max(stored_size, 1e-6),
+        "Encoding Time (s)": sum(
+            recording["Encoding Time (s)"] for recording in statistics
+        ),
+    }
+    # Raw frames are only copied, the time spent is not an encoding throughput
+    encoded = [recording for recording in statistics if recording["Encoding"] != "Raw"]
+    if encoded:
+        combined["Encoding Throughput (MB/s)"] = sum(
+            recording["Raw Size (MB)"] for recording in encoded
+        ) / max(sum(recording["Encoding Time (s)"] for recording in encoded), 1e-9)
+    return combined
+
+
+def read_header(path):
+    """Read the header of a recording file
+
+    Args:
+        path (str): The path of the recording file
+
+    Returns:
+        dict: The header
+    """
+    with open(path, "rb") as file:
+        header = file.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ValueError(f"{path} is not a recording file")
+    return json.loads(header[len(MAGIC) :].decode().strip())
+
+
+def read_index(path):
+    """Read the frame range index of a recording file
+
+    Args:
+        path (str): The path of the recording file
+
+    Returns:
+        array: One (first frame, frame count, byte offset, byte size) row per range
+    """
+    entries = read_header(path)["Index Entries"]
+    return np.fromfile(path, "<i8", entries * 4, offset=HEADER_SIZE).reshape(-1, 4)
+
+
+def natural_key(file_name):
+    """Return a key sorting file names by their number (2.npy before 10.npy)"""
+    name = os.path.splitext(file_name)[0]
+    return (0, int(name), "") if name.isdigit() else (1, 0, name)
+
+
+def open_recording(path):
+    """Open the frames of an acquisition without loading them in memory when possible
+
+    Args:
+        path (str): A recording file, or a data folder holding a recording file or
+                    the numbered NPY chunks of older acquisitions. The index of the
+                    chunks is written to the folder (index.json) if it is missing
+                    or out of date (see index_chunks).
+
+    Returns:
+        array: The (frame, height, width) frames, memory-mapped for a recording file
+               (PackedFrames or CompressedFrames decoding the frames accessed if
+               they are packed or compressed, ChunkedFrames for NPY chunks)
+    """
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, RECORDING_FILE)):
+            return open_recording(os.path.join(path, RECORDING_FILE))
+        return ChunkedFrames(path, index_chunks(path))
+    header = read_header(path)
+    if header["Frames"] == 0:
+        return np.zeros((0, *(header["Shape"] or (0, 0))), dtype=header["Dtype"])
+    if header.get("Encoding") == COMPRESSED:
+        return CompressedFrames(path, header, read_index(path))
+    if header.get("Encoding") == PACKED_12_BIT:
+        height, width = header["Shape"]
+        packed = np.memmap(
+            path,
+            dtype=np.uint8,
+            mode="r",
+            offset=DATA_OFFSET,
+            shape=(header["Frames"], height, (3 * width + 1) // 2),
+        )
+        return PackedFrames(packed, width)
+    return np.memmap(
+        path,
+        dtype=header["Dtype"],
+        mode="r",
+        offset=DATA_OFFSET,
+        shape=(header["Frames"], *header["Shape"]),
+    )
+
+
+class FrameWriter:
+    def __init__(self, recording, batch_size=120, depth=2):
+        """Write frames to a recording from a dedicated thread
+
+        Frames are copied in preallocated batches which are written by the thread once
+        full, so the caller only waits for the disk when every batch is waiting to be
+        written. With a depth of 2, a batch is filled while the other is written.
+
+        Args:
+            recording (RecordingWriter): The recording in which to write the frames
+            batch_size (int): The number of frames written at once. Defaults to 120.
+            depth (int): The number of batches that can wait to be written. Defaults to 2.
+        """
+        self.recording = recording
+        self.batch_size = batch_size
+        self.depth = depth
+        self.batches = None
+        self.free_batches = queue.Queue()
+        self.full_batches = queue.Queue()
+        self.batch_index, self.batch_count = None, 0
+        self.frames_written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, frames):
+        """Copy frames in the current batch, handing it to the thread once full
+
+        Args:
+            frames (array): The (frame, height, width) frames to write
+
+        Raises:
+            Exception: The error raised by the last failed write, if any
+        """
+        self.check_error()
+        position = 0
+        while position < len(frames):
+            if self.batch_index is None:
+                if self.batches is None:
+                    self.batches = np.empty(
+                        (self.depth, self.batch_size, *np.shape(frames)[1:]),
+                        dtype=self.recording.header["Dtype"],
+                    )
+                    for index in range(self.depth):
+                        self.free_batches.put(index)
+                self.batch_index = self.free_batches.get()
+            count = min(self.batch_size - self.batch_count, len(frames) - position)
+            self.batches[
+                self.batch_index, self.batch_count : self.batch_count + count
+            ] = frames[position : position + count]
+            self.batch_count += count
+            position += count
+            if self.batch_count == self.batch_size:
+                self.submit()
+
+    def submit(self):
+        """Hand the current batch to the thread"""
+        if self.batch_index is not None:
+            self.full_batches.put((self.batch_index, self.batch_count))
+            self.batch_index, self.batch_count = None, 0
+
+    def run(self):
+        """Write the batches handed to the thread until the writer is closed"""
+        while True:
+            batch = self.full_batches.get()
+            try:
+                if batch is None:
+                    break
+                index, count = batch
+                if self.error is None:
+                    self.recording.append(self.batches[index, :count])
+                    self.frames_written += count
+            except Exception as err:
+                self.error = err
+            finally:
+                if batch is not None:
+                    self.free_batches.put(index)
+                self.full_batches.task_done()
+
+    def check_error(self):
+        """Raise the error of the last failed write, if any"""
+        if self.error is not None:
+            raise self.error
+
+    def flush(self):
+        """Write the current partial batch and wait until every frame is on disk"""
+        self.submit()
+        self.full_batches.join()
+        self.check_error()
+
+    def close(self):
+        """Write the remaining frames, stop the thread and close the recording"""
+        try:
+            self.flush()
+        finally:
+            self.full_batches.put(None)
+            self.thread.join()
+            self.recording.close()
@@ -0,0 +1,387 @@
+import time
+import threading
+from collections import namedtuple
+import numpy as np
+
+FrameInfo = namedtuple("FrameInfo", ["frame_index"])
+FramesStatus = namedtuple("FramesStatus", ["acquired", "unread", "skipped", "size"])
+
+camera_lines = {}
+
+
+class AcquisitionType:
+    """Stand-in for nidaqmx.constants.AcquisitionType"""
+
+    FINITE = "finite"
+    CONTINUOUS = "continuous"
+
+
+class SimulatedTimeoutError(TimeoutError):
+    """Raised when no frame is acquired by the simulated camera before the timeout"""
+
+
+class SimulatedCamera:
+    def __init__(self, name="img0", framerate=30, size=1024, bank_size=16):
+        """A stand-in for pylablib's IMAQCamera producing synthetic 12-bit frames
+
+        Frames are acquired at a fixed framerate once the acquisition is started and
+        are kept in a framegrabber buffer of limited size, like on the real device.
+
+        Args:
+            name (str): The name of the camera interface
+            framerate (float): The acquisition framerate. Defaults to 30.
+            size (int): The width and height of the sensor in pixels. Defaults to 1024.
+            bank_size (int): The number of distinct frames generated. Defaults to 16.
+        """
+        self.name = name
+        self.framerate = framerate
+        self.size = size
+        self.bank_size = bank_size
+        self.attributes = {
+            "IMG_ATTR_ACQWINDOW_LEFT": 0,
+            "IMG_ATTR_ACQWINDOW_TOP": 0,
+            "IMG_ATTR_ACQWINDOW_WIDTH": size,
+            "IMG_ATTR_ACQWINDOW_HEIGHT": size,
+        }
+        self.buffer_frames = 100
+        self.running = False
+        self.start_time = None
+        self.frames_acquired = 0
+        self.frame_times = None
+        self.next_index = 0
+        self.bank = None
+
+    def set_framerate(self, framerate):
+        """Set the framerate at which frames are acquired
+
+        Args:
+            framerate (float): The acquisition framerate
+        """
+        self.framerate = framerate
+
+    def set_grabber_attribute_value(self, name, value, kind="auto"):
+        """Set a framegrabber attribute (only the acquisition window is simulated)
+
+        Args:
+            name (str): The name of the attribute
+            value (int): The value of the attribute
+            kind (str): Unused, kept for compatibility with IMAQCamera
+        """
+        self.attributes[name] = int(value)
+        self.bank = None
+
+    def get_grabber_attribute_value(self, name):
+        """Return the value of a framegrabber attribute"""
+        return self.attributes[name]
+
+    def get_data_dimensions(self):
+        """Return the (height, width) of the acquired frames"""
+        return (
+            self.attributes["IMG_ATTR_ACQWINDOW_HEIGHT"],
+            self.attributes["IMG_ATTR_ACQWINDOW_WIDTH"],
+        )
+
+    def generate_bank(self):
+        """Generate the synthetic frames: a vignetted brain-like image with shot noise"""
+        height, width = self.get_data_dimensions()
+        top = self.attributes["IMG_ATTR_ACQWINDOW_TOP"]
+        left = self.attributes["IMG_ATTR_ACQWINDOW_LEFT"]
+        rows, columns = np.mgrid[top : top + height, left : left + width]
+        radius = np.hypot(rows - self.size / 2, columns - self.size / 2) / self.size
+        image = 600 + 2400 * np.exp(-(radius**2) / 0.08)
+        generator = np.random.default_rng(0)
+        self.bank = np.clip(
+            generator.normal(image, np.sqrt(image), (self.bank_size, height, width)),
+            0,
+            4095,
+        ).astype(np.uint16)
+
+    def setup_acquisition(self, nframes=100):
+        """Set the number of frames kept in the framegrabber buffer
+
+        Args:
+            nframes (int): The size of the framegrabber buffer. Defaults to 100.
+        """
+        self.buffer_frames = nframes
+
+    def start_acquisition(self):
+        """Start acquiring frames"""
+        if self.bank is None:
+            self.generate_bank()
+        self.running = True
+        self.start_time = time.perf_counter()
+        self.frames_acquired = 0
+        self.next_index = 0
+
+    def stop_acquisition(self):
+        """Stop acquiring frames"""
+        self.frames_acquired = self.acquired_count()
+        self.running = False
+
+    def clear_acquisition(self):
+        """Stop the acquisition and empty the framegrabber buffer"""
+        self.stop_acquisition()
+        self.next_index = self.frames_acquired
+
+    def trigger(self, frame_times):
+        """Acquire a frame at each of the given times instead of free running
+
+        Args:
+            frame_times (array): The times (from time.perf_counter) of the exposure ends
+        """
+        self.frames_acquired = self.acquired_count()
+        self.frame_times = np.asarray(frame_times, dtype=float)
+
+    def acquired_count(self):
+        """Return the number of frames acquired since the acquisition started"""
+        if not self.running:
+            return self.frames_acquired
+        if self.frame_times is not None:
+            return self.frames_acquired + int(
+                np.searchsorted(self.frame_times, time.perf_counter(), side="right")
+            )
+        return int((time.perf_counter() - self.start_time) * self.framerate)
+
+    def frame_time(self, index):
+        """Return the time at which a frame is acquired
+
+        Args:
+            index (int): The index of the frame
+
+        Returns:
+            float: The acquisition time, None if the frame is never acquired
+        """
+        if self.frame_times is not None:
+            offset = index - self.frames_acquired
+            if offset >= len(self.frame_times):
+                return None
+            return self.frame_times[offset]
+        return self.start_time + (index + 1) / self.framerate
+
+    def wait_for_frame(self, since="lastread", nframes=1, timeout=20.0):
+        """Wait until new frames are acquired
+
+        Args:
+            since (str): Unused, frames are always counted since the last read
+            nframes (int): The number of new frames to wait for. Defaults to 1.
+            timeout (float): The maximum waiting time in seconds. Defaults to 20.
+
+        Raises:
+            SimulatedTimeoutError: If the frames are not acquired before the timeout
+        """
+        target = self.next_index + nframes
+        if self.acquired_count() >= target:
+            return
+        frame_time = self.frame_time(target - 1) if self.running else None
+        if frame_time is None or frame_time - time.perf_counter() > timeout:
+            time.sleep(timeout)
+            raise SimulatedTimeoutError("No frame acquired before the timeout")
+        time.sleep(max(frame_time - time.perf_counter(), 0))
+
+    def get_frames_status(self):
+        """Return the number of frames acquired, not read yet and skipped since the
+        acquisition started, and the size of the framegrabber buffer
+
+        Returns:
+            FramesStatus: The (acquired, unread, skipped, size) status
+        """
+        acquired = self.acquired_count()
+        unread = min(acquired - self.next_index, self.buffer_frames)
+        return FramesStatus(
+            acquired, unread, acquired - self.next_index - unread, self.buffer_frames
+        )
+
+    def read_multiple_images(
+        self, rng=None, peek=False, missing_frame="skip", return_info=False
+    ):
+        """Read the frames acquired since the last read that are still in the buffer
+
+        Args:
+            rng (tuple): Unused, every available frame is read
+            peek (bool): If True, the frames stay available for the next read
+            missing_frame (str): Unused, overwritten frames are always skipped
+            return_info (bool): If True, also return the info of each frame
+
+        Returns:
+            list of array: The frames read (and a list of FrameInfo if return_info)
+        """
+        acquired = self.acquired_count()
+        first_index = max(self.next_index, acquired - self.buffer_frames)
+        indices = range(first_index, acquired)
+        frames = [self.bank[index % self.bank_size].copy() for index in indices]
+        if not peek:
+            self.next_index = acquired
+        if return_info:
+            return frames, [FrameInfo(index) for index in indices]
+        return frames
+
+
+def connect_camera(line, camera):
+    """Trigger a simulated camera with the signal written on a simulated DAQ line
+
+    Args:
+        line (str): The physical name of the line (e.g. "dev1/port0/line4")
+        camera (SimulatedCamera): The camera triggered by the line
+    """
+    camera_lines[line] = camera
+
+
+class SimulatedChannels:
+    def __init__(self, task):
+        """The channel collections of a simulated task (do_channels, ao_channels, ...)
+
+        Args:
+            task (SimulatedTask): The task to which channels are added
+        """
+        self.task = task
+
+    def add_do_chan(self, lines, **kwargs):
+        """Add a digital output channel"""
+        self.task.channels.append(lines)
+
+    def add_di_chan(self, lines, **kwargs):
+        """Add a digital input channel"""
+        self.task.channels.append(lines)
+
+    def add_ao_voltage_chan(self, physical_channel, **kwargs):
+        """Add an analog output channel"""
+        self.task.channels.append(physical_channel)
+
+
+class SimulatedTiming:
+    def __init__(self, task):
+        """The timing settings of a simulated task
+
+        Args:
+            task (SimulatedTask): The task to configure
+        """
+        self.task = task
+
+    def cfg_samp_clk_timing(
+        self, rate, source="", active_edge=None, sample_mode=None, samps_per_chan=1000
+    ):
+        """Configure the sample clock of the task
+
+        Args:
+            rate (float): The sampling rate in samples per second
+            sample_mode (str): Unused, generation is always finite
+            samps_per_chan (int): The number of samples to generate per channel
+        """
+        self.task.rate = rate
+        self.task.samples = samps_per_chan
+
+
+class SimulatedTask:
+    def __init__(self, new_task_name=""):
+        """A stand-in for nidaqmx.Task which generates the written samples in real time
+
+        The sample clock advances with the wall clock once the task is started. When
+        one of the channels is connected to a simulated camera, the camera acquires a
+        frame at the falling edge of each pulse of the signal written on that channel.
+        The line idles low, so a pulse already high on the first sample is an exposure.
+
+        Args:
+            new_task_name (str): The name of the task
+        """
+        self.name = new_task_name
+        self.channels = []
+        self.do_channels = SimulatedChannels(self)
+        self.di_channels = SimulatedChannels(self)
+        self.ao_channels = SimulatedChannels(self)
+        self.timing = SimulatedTiming(self)
+        self.rate, self.samples = None, 1
+        self.data = np.zeros((0, 0))
+        self.start_time = None
+        self.done_callbacks = []
+        self.done_timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data, auto_start=False):
+        """Write samples to the task buffer
+
+        Args:
+            data (array): The samples, one row per channel when there are many channels
+
+        Returns:
+            int: The number of samples written per channel
+        """
+        data = np.asarray(data)
+        self.data = data.reshape(1, -1) if len(self.channels) == 1 else data
+        return self.data.shape[-1]
+
+    def read(self):
+        """Read the digital input channels (a simulated trigger is always high)"""
+        return True
+
+    def register_done_event(self, callback_method):
+        """Call a function each time the generation is done
+
+        Args:
+            callback_method (function): Called with (task_handle, status, callback_data)
+        """
+        self.done_callbacks.append(callback_method)
+
+    def duration(self):
+        """Return the duration of the generation in seconds"""
+        if self.rate is None:
+            return 0
+        return min(self.samples, self.data.shape[-1]) / self.rate
+
+    def start(self):
+        """Start generating the samples and trigger the connected cameras"""
+        self.start_time = time.perf_counter()
+        for index, line in enumerate(self.channels):
+            if line in camera_lines and index < len(self.data) and self.rate:
+                # Like frames_acquired_from_camera_signal, the line idles low and
+                # each falling edge ends an exposure
+                signal = (np.asarray(self.data[index]) > 0).astype(np.int8)
+                falling_edges = np.where(np.diff(signal, prepend=0) < 0)[0]
+                camera_lines[line].trigger(self.start_time + falling_edges / self.rate)
+        if self.done_callbacks:
+            self.done_timer = threading.Timer(self.duration(), self.done)
+            self.done_timer.start()
+
+    def done(self):
+        """Call the functions registered for the done event"""
+        for callback in self.done_callbacks:
+            callback(id(self), 0, None)
+
+    def is_task_done(self):
+        """Return True if every sample was generated"""
+        if self.start_time is None:
+            return True
+        return time.perf_counter() - self.start_time >= self.duration()
+
+    def wait_until_done(self, timeout=10.0):
+        """Wait until every sample was generated
+
+        Args:
+            timeout (float): The maximum waiting time in seconds. Defaults to 10.
+
+        Raises:
+            TimeoutError: If the generation is not done before the timeout
+        """
+        remaining = self.start_time + self.duration() - time.perf_counter()
+        if remaining > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("The task is not done before the timeout")
+        time.sleep(max(remaining, 0))
+
+    def stop(self):
+        """Stop the generation, the connected cameras stop being triggered"""
+        if self.done_timer is not None:
+            self.done_timer.cancel()
+            self.done_timer = None
+        for line in self.channels:
+            if line in camera_lines:
+                camera_lines[line].trigger([])
+        self.start_time = None
+
+    def close(self):
+        """Stop the task and release its resources"""
+        self.stop()
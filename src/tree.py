@@ -1,16 +1,23 @@
 import os
 import random
 import numpy as np
-from src.waveforms import digital_square, make_signal
+from src.waveforms import compile_protocol
 from PyQt5.QtWidgets import QTreeWidget, QTreeWidgetItem
 from PyQt5.QtGui import QBrush, QColor, QIcon
 from src.blocks import Block, Stimulation
 
 
 class Tree(QTreeWidget):
-    def __init__(self):
-        """Initialize the tree widget"""
+    def __init__(self, sample_rate=3000):
+        """Initialize the tree widget
+
+        Args:
+            sample_rate (float): The DAQ sampling rate of the compiled signals.
+                                 Defaults to 3000.
+        """
         super().__init__()
+        self.sample_rate = sample_rate
+        self.seed = None
         self.x_values = []
         self.stim1_values = []
         self.stim2_values = []
@@ -141,140 +148,35 @@ class Tree(QTreeWidget):
         tree_item.setText(18, str(dictionary["canal1"]))
         tree_item.setText(19, str(dictionary["canal2"]))
         tree_item.setText(30, str(dictionary["canal3"]))
+        tree_item.setText(17, str(dictionary.get("baseline", False)))
 
     def graph(self, item=None, current=False):
         """
         Generate the x and y values for an item in the tree
 
+        The signals are compiled from the blocks of the item with compile_protocol,
+        as they are regenerated from the metadata of an experiment.
+
         Args:
             item (QTreeWidgetItem): The item to graph. Defaults to current item.
         """
         try:
-            if item == self.invisibleRootItem() or current:
-                self.elapsed_time = 0
-                self.baseline_values = []
-                self.x_values = []
-                self.stim1_values = []
-                self.stim2_values = []
-                self.stim3_values = np.empty(0, dtype=bool)
-            if item.childCount() > 0:
-                if item == self.invisibleRootItem():
-                    jitter, block_delay, iterations = 0, 0, 1
-                else:
-                    jitter = float(item.text(3))
-                    iterations = int(item.text(1))
-                    block_delay = float(item.text(2))
-                for i in range(iterations):
-                    for index in range(item.childCount()):
-                        child = item.child(index)
-                        self.graph(child)
-                    delay = block_delay + random.random() * jitter
-                    time_values = np.linspace(
-                        self.elapsed_time,
-                        self.elapsed_time + delay,
-                        int(round(delay * 3000)),
-                    )
-                    data = np.zeros(len(time_values))
-                    ddata = np.full(len(time_values), False)
-                    self.elapsed_time += delay
-                    self.x_values = np.concatenate((self.x_values, time_values))
-                    self.stim1_values = np.concatenate((self.stim1_values, data))
-                    self.stim2_values = np.concatenate((self.stim2_values, data))
-                    self.stim3_values = np.concatenate((self.stim3_values, ddata))
-            else:
-                duration = float(item.text(6))
-                # PROBLEMATIC
-                time_values = np.linspace(0, duration, int(round(duration * 3000)))
-                if item.text(18) == "True":
-                    (
-                        sign_type,
-                        pulses,
-                        jitter,
-                        width,
-                        frequency,
-                        duty,
-                        heigth,
-                    ) = self.get_attributes(item, canal=1)
-                    data = make_signal(
-                        time_values,
-                        sign_type,
-                        width,
-                        pulses,
-                        jitter,
-                        frequency,
-                        duty,
-                        heigth,
-                    )
-                    self.stim1_values = np.concatenate((self.stim1_values, data))
-                else:
-                    self.stim1_values = np.concatenate(
-                        (self.stim1_values, np.zeros(len(time_values)))
-                    )
-
-                if item.text(19) == "True":
-                    (
-                        sign_type2,
-                        pulses2,
-                        jitter2,
-                        width2,
-                        frequency2,
-                        duty2,
-                        heigth2,
-                    ) = self.get_attributes(item, canal=2)
-                    data2 = make_signal(
-                        time_values,
-                        sign_type2,
-                        width2,
-                        pulses2,
-                        jitter2,
-                        frequency2,
-                        duty2,
-                        heigth2,
-                    )
-                    self.stim2_values = np.concatenate((self.stim2_values, data2))
-                else:
-                    self.stim2_values = np.concatenate(
-                        (self.stim2_values, np.zeros(len(time_values)))
-                    )
-
-                if item.text(30) == "True":
-                    (
-                        sign_type3,
-                        pulses3,
-                        jitter3,
-                        width3,
-                        frequency3,
-                        duty3,
-                        heigth3,
-                    ) = self.get_attributes(item, canal=3)
-
-                    data3 = digital_square(time_values, frequency3, duty3)
-                    self.stim3_values = np.concatenate((self.stim3_values, data3))
-                else:
-                    self.stim3_values = np.concatenate(
-                        (self.stim3_values, np.full(len(time_values), False))
-                    )
-
-                if (
-                    item.text(18) == "False"
-                    and item.text(19) == "False"
-                    and item.text(30) == "False"
-                    and item.text(17) == "True"
-                ):
-                    baseline_start_index = len(self.x_values)
-                    baseline_stop_index = len(self.x_values) + len(time_values)
-                    self.baseline_values.append(
-                        [baseline_start_index, baseline_stop_index]
-                    )
-                time_values += self.elapsed_time
-                self.x_values = np.concatenate((self.x_values, time_values))
-                self.elapsed_time += duration
+            (
+                self.x_values,
+                (self.stim1_values, self.stim2_values, self.stim3_values),
+                self.baseline_values,
+            ) = compile_protocol(
+                self.create_blocks(item).to_json(),
+                self.sample_rate,
+                self.seed,
+                return_baselines=True,
+            )
         except Exception as err:
             self.x_values = []
             self.stim1_values = []
             self.stim2_values = []
             self.stim3_values = np.empty(0, dtype=bool)
-            self.elapsed_time = 0
+            self.baseline_values = []
 
     def create_blocks(self, item=None):
         """Recursively create blocks from tree items
@@ -297,11 +199,12 @@ class Tree(QTreeWidget):
                 return Block(
                     item.text(0),
                     children,
-                    delay=int(item.text(2)),
+                    delay=float(item.text(2)),
                     iterations=int(item.text(1)),
+                    jitter=float(item.text(3)),
                 )
             else:
-                duration = int(item.text(6))
+                duration = float(item.text(6))
                 if item.text(18) == "True":
                     canal1 = True
                     (
@@ -374,6 +277,7 @@ class Tree(QTreeWidget):
                     "type": "Stimulation",
                     "name": item.text(0),
                     "duration": duration,
+                    "baseline": item.text(17) == "True",
                     "canal1": canal1,
                     "canal2": canal2,
                     "canal3": canal3,
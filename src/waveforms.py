@@ -1,3 +1,5 @@
+import random
+from collections import OrderedDict
 import numpy as np
 from scipy.signal import square
 
@@ -42,29 +44,38 @@ def digital_square(time, frequency, duty, delay=0):
     return np.concatenate((np.full(delay, False), pulses))[:-delay]
 
 
-def random_square(time, pulses, width, jitter):
+def random_square(time, pulses, width, jitter, seed=None):
     """Generate a random square signal
 
     Args:
-        time (array of float): The array of time values
+        time (array of float): The sorted array of time values
         pulses (int): The number of pulses to generate
         width (float): The width of each individual pulse
         jitter (float): The random delay between each individual pulse
+        seed (int): The seed of the random delays. Defaults to None (the global
+                    numpy random state is used).
 
     Returns:
         array of float: The generated signal
     """
-    pulse_signal = np.zeros(len(time))
+    random_state = np.random if seed is None else np.random.RandomState(seed)
     buffer = (float(width) + jitter, float(time[-1] - width - jitter))
     uniform_distribution = np.linspace(*buffer, pulses)
-    random_numbers = np.around(np.random.uniform(-jitter, jitter, pulses), 3)
+    random_numbers = np.around(random_state.uniform(-jitter, jitter, pulses), 3)
     randomized_distribution = uniform_distribution + random_numbers
-    for value in randomized_distribution:
-        pulse_signal[(time > value - width / 2) & (time < value + width / 2)] = 5
-    return pulse_signal
+    # Samples strictly inside each pulse, found by bisection of the time values
+    starts = np.searchsorted(time, randomized_distribution - width / 2, side="right")
+    stops = np.searchsorted(time, randomized_distribution + width / 2, side="left")
+    stops = np.maximum(starts, stops)
+    edges = np.zeros(len(time) + 1, dtype=np.int64)
+    np.add.at(edges, starts, 1)
+    np.add.at(edges, stops, -1)
+    return np.where(np.cumsum(edges[:-1]) > 0, 5.0, 0.0)
 
 
-def make_signal(time, pulse_type, width, pulses, jitter, frequency, duty, heigth):
+def make_signal(
+    time, pulse_type, width, pulses, jitter, frequency, duty, heigth, seed=None
+):
     """ " Generate a signal based on the given pulse type
 
     Args:
@@ -75,6 +86,7 @@ def make_signal(time, pulse_type, width, pulses, jitter, frequency, duty, heigth
         jitter (float): The random delay between each individual pulse
         frequency (float): The frequency of the signal
         duty (float): The duty cycle of the signal
+        seed (int): The seed of the random pulses. Defaults to None.
 
     Returns:
         array of float: The generated signal
@@ -82,4 +94,228 @@ def make_signal(time, pulse_type, width, pulses, jitter, frequency, duty, heigth
     if pulse_type == "square":
         return square_signal(time, frequency, duty, heigth)
     if pulse_type == "random-square":
-        return random_square(time, pulses, width, jitter)
+        return random_square(time, pulses, width, jitter, seed)
+
+
+class SignalCache:
+    def __init__(self, max_bytes=256e6):
+        """A cache of compiled signals, evicting the least recently used ones
+
+        Args:
+            max_bytes (float): The maximum size of the cached signals in bytes.
+                               Defaults to 256 MB.
+        """
+        self.max_bytes = max_bytes
+        self.signals = OrderedDict()
+        self.size = 0
+        self.hits, self.misses = 0, 0
+
+    def get(self, key, compute):
+        """Return a cached signal, computing and caching it if it is missing
+
+        Args:
+            key (tuple): The parameters of the signal
+            compute (function): Returns the signal
+
+        Returns:
+            array: The signal, read-only
+        """
+        if key in self.signals:
+            self.hits += 1
+            self.signals.move_to_end(key)
+            return self.signals[key]
+        self.misses += 1
+        signal = compute()
+        if signal is None:
+            return None
+        signal = np.asarray(signal)
+        signal.setflags(write=False)
+        if signal.nbytes <= self.max_bytes:
+            self.signals[key] = signal
+            self.size += signal.nbytes
+            while self.size > self.max_bytes:
+                self.size -= self.signals.popitem(last=False)[1].nbytes
+        return signal
+
+    def clear(self):
+        """Forget every cached signal"""
+        self.signals.clear()
+        self.size = 0
+
+
+signal_cache = SignalCache()
+
+
+def compile_signal(
+    duration,
+    sample_rate,
+    pulse_type,
+    width,
+    pulses,
+    jitter,
+    frequency,
+    duty,
+    heigth,
+    seed=None,
+    cache=signal_cache,
+):
+    """Return the analog signal of a stimulation, compiled once for each set of parameters
+
+    Random pulses are never cached: without a seed they are drawn again each time,
+    and each seed of an experiment is only used once.
+
+    Args:
+        duration (float): The duration of the stimulation in seconds
+        sample_rate (float): The number of samples per second
+        pulse_type (str): The type of pulse to generate
+        width (float): The width of each individual pulse
+        pulses (int): The number of pulses to generate
+        jitter (float): The random delay between each individual pulse
+        frequency (float): The frequency of the signal
+        duty (float): The duty cycle of the signal
+        heigth (float): The amplitude of the signal
+        seed (int): The seed of the random pulses. Defaults to None.
+        cache (SignalCache): The cache of the signals. Defaults to signal_cache.
+
+    Returns:
+        array of float: The signal, read-only if it is cached
+    """
+
+    def compute():
+        time_values = np.linspace(0, duration, int(round(duration * sample_rate)))
+        return make_signal(
+            time_values,
+            pulse_type,
+            width,
+            pulses,
+            jitter,
+            frequency,
+            duty,
+            heigth,
+            seed,
+        )
+
+    if pulse_type == "random-square":
+        return compute()
+    key = ("analog", duration, sample_rate, pulse_type, frequency, duty, heigth)
+    return cache.get(key, compute)
+
+
+def compile_digital_signal(duration, sample_rate, frequency, duty, cache=signal_cache):
+    """Return the digital signal of a stimulation, compiled once for each set of parameters
+
+    Args:
+        duration (float): The duration of the stimulation in seconds
+        sample_rate (float): The number of samples per second
+        frequency (float): The frequency of the signal
+        duty (float): The duty cycle of the signal
+        cache (SignalCache): The cache of the signals. Defaults to signal_cache.
+
+    Returns:
+        array of bool: The read-only signal
+    """
+    return cache.get(
+        ("digital", duration, sample_rate, frequency, duty),
+        lambda: digital_square(
+            np.linspace(0, duration, int(round(duration * sample_rate))),
+            frequency,
+            duty,
+        ),
+    )
+
+
+def compile_protocol(protocol, sample_rate=3000, seed=None, return_baselines=False):
+    """Compile the signals of a protocol, from the tree or the metadata of an experiment
+
+    The tree compiles its signals with this function, so the signals sent during an
+    experiment are regenerated exactly from its seed.
+
+    Args:
+        protocol (dict): The JSON representation of the root block (or of any block
+                         or stimulation)
+        sample_rate (float): The number of samples per second. Defaults to 3000.
+        seed (int): The seed of the experiment. Defaults to None (not reproducible).
+        return_baselines (bool): Also return the [start, stop] sample indices of the
+                                 baseline stimulations (without channels).
+                                 Defaults to False.
+
+    Returns:
+        tuple: The time values and the list of the three stimulation signals (and
+               the baseline indices if return_baselines is True)
+    """
+    rng = random.Random(seed)
+    elapsed_time, sample_count, baselines = 0, 0, []
+    time_chunks, stim1_chunks, stim2_chunks, stim3_chunks = [], [], [], []
+
+    def pulse_seed(pulse_type):
+        if pulse_type != "random-square" or seed is None:
+            return None
+        return rng.getrandbits(32)
+
+    def compile_item(item):
+        nonlocal elapsed_time, sample_count
+        if item["type"] == "Block":
+            for _ in range(int(item["iterations"])):
+                for child in item["data"]:
+                    compile_item(child)
+                delay = float(item["delay"]) + rng.random() * float(item["jitter"])
+                length = int(round(delay * sample_rate))
+                time_chunks.append(
+                    np.linspace(elapsed_time, elapsed_time + delay, length)
+                )
+                stim1_chunks.append(np.zeros(length))
+                stim2_chunks.append(np.zeros(length))
+                stim3_chunks.append(np.full(length, False))
+                elapsed_time += delay
+                sample_count += length
+            return
+        duration = float(item["duration"])
+        time_values = np.linspace(0, duration, int(round(duration * sample_rate)))
+        for canal, suffix, chunks in (
+            ("canal1", "", stim1_chunks),
+            ("canal2", "2", stim2_chunks),
+        ):
+            if item[canal]:
+                pulse_type = item["type" + (suffix or "1")]
+                chunks.append(
+                    compile_signal(
+                        duration,
+                        sample_rate,
+                        pulse_type,
+                        item["width" + suffix],
+                        item["pulses" + suffix],
+                        item["jitter" + suffix],
+                        item["freq" + suffix],
+                        item["duty" + suffix],
+                        item["heigth" + suffix],
+                        pulse_seed(pulse_type),
+                    )
+                )
+            else:
+                chunks.append(np.zeros(len(time_values)))
+        if item["canal3"]:
+            stim3_chunks.append(
+                compile_digital_signal(
+                    duration, sample_rate, item["freq3"], item["duty3"]
+                )
+            )
+        else:
+            stim3_chunks.append(np.full(len(time_values), False))
+        if item.get("baseline") and not (
+            item["canal1"] or item["canal2"] or item["canal3"]
+        ):
+            baselines.append([sample_count, sample_count + len(time_values)])
+        time_chunks.append(time_values + elapsed_time)
+        elapsed_time += duration
+        sample_count += len(time_values)
+
+    compile_item(protocol)
+    time_values = np.concatenate([np.empty(0)] + time_chunks)
+    signals = [
+        np.concatenate([np.empty(0)] + stim1_chunks),
+        np.concatenate([np.empty(0)] + stim2_chunks),
+        np.concatenate([np.empty(0, dtype=bool)] + stim3_chunks),
+    ]
+    if return_baselines:
+        return time_values, signals, baselines
+    return time_values, signals
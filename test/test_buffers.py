@@ -0,0 +1,203 @@
+import unittest
+import sys
+import os
+from threading import Thread, Event
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.buffers import (
+    FrameBuffer,
+    FrameQueue,
+    FrameLog,
+    BaselineAccumulator,
+    LatestFrames,
+)
+import numpy as np
+
+
+class TestFrameBuffer(unittest.TestCase):
+    def test_get_returns_view(self):
+        """Test that contiguous frames are returned without copy"""
+        buffer = FrameBuffer(4, 2, 3)
+        buffer.write([np.full((2, 3), i) for i in range(3)])
+        frames = buffer.get(0, 3)
+        self.assertTrue(np.shares_memory(frames, buffer.frames))
+        np.testing.assert_array_equal([0, 1, 2], frames[:, 0, 0])
+
+    def test_get_wraps_around(self):
+        """Test that frames are read in order after the buffer wraps around"""
+        buffer = FrameBuffer(4, 2, 3)
+        buffer.write([np.full((2, 3), i) for i in range(6)])
+        np.testing.assert_array_equal([3, 4, 5], buffer.get(3, 6)[:, 0, 0])
+        with self.assertRaises(IndexError):
+            buffer.get(1, 3)
+
+    def test_latest(self):
+        """Test that the last frame of each light channel is found"""
+        buffer = FrameBuffer(4, 2, 3)
+        self.assertIsNone(buffer.latest())
+        buffer.write([np.full((2, 3), i) for i in range(7)])
+        self.assertEqual(6, buffer.latest(0, 3)[0, 0])
+        self.assertEqual(4, buffer.latest(1, 3)[0, 0])
+        self.assertEqual(5, buffer.latest(2, 3)[0, 0])
+
+
+class TestFrameQueue(unittest.TestCase):
+    def test_every_frame_is_received_once(self):
+        """Test that frames are received in order without loss when the queue is full"""
+        queue = FrameQueue(FrameBuffer(4, 2, 3))
+        received = []
+
+        def consume():
+            while len(received) < 10:
+                frames = queue.get(3)
+                received.extend(frames[:, 0, 0].tolist())
+                queue.release(len(frames))
+
+        consumer = Thread(target=consume)
+        consumer.start()
+        for i in range(5):
+            frames = [np.full((2, 3), 2 * i), np.full((2, 3), 2 * i + 1)]
+            self.assertTrue(queue.put(frames))
+        consumer.join(timeout=5)
+        self.assertEqual(list(range(10)), received)
+        self.assertLessEqual(queue.high_water_mark, 4)
+
+    def test_frames_are_read_ahead_of_their_release(self):
+        """Test that frames can be read past those not released yet"""
+        queue = FrameQueue(FrameBuffer(8, 1, 1))
+        queue.put([np.full((1, 1), i) for i in range(6)])
+        np.testing.assert_array_equal([2, 3], queue.get(2, 2)[:, 0, 0])
+        self.assertEqual(4, queue.pending(2))
+        self.assertEqual(6, queue.pending())
+        queue.release(3)
+        with self.assertRaises(ValueError):
+            queue.get(2, 2)
+
+    def test_put_times_out_when_full(self):
+        """Test that the producer gives up when the queue stays full"""
+        queue = FrameQueue(FrameBuffer(2, 2, 3))
+        self.assertTrue(queue.put([np.zeros((2, 3))] * 2))
+        self.assertFalse(queue.put([np.zeros((2, 3))], timeout=0.01))
+        self.assertEqual(1, queue.stalls)
+        self.assertEqual(2, queue.pending())
+
+    def test_spilled_frames_are_received_in_order(self):
+        """Test that frames spilled to disk when the buffer is full keep their order"""
+        queue = FrameQueue(FrameBuffer(4, 2, 3), spill=True)
+        received = []
+        for i in range(3):
+            self.assertTrue(
+                queue.put([np.full((2, 3), 2 * i), np.full((2, 3), 2 * i + 1)])
+            )
+        self.assertTrue(queue.spilling())
+        self.assertEqual(5, queue.latest(1, 2)[0, 0])
+        while queue.pending() > 0:
+            frames = queue.get(3)
+            received.extend(frames[:, 0, 0].tolist())
+            queue.release(len(frames))
+            if len(received) == 4:
+                queue.put([np.full((2, 3), 6)])
+        self.assertEqual(list(range(7)), received)
+        self.assertEqual(3, queue.frames_spilled)
+        self.assertFalse(queue.spilling())
+        self.assertTrue(queue.put([np.full((2, 3), 7)]))
+        self.assertEqual(3, queue.frames_spilled)
+        np.testing.assert_array_equal([7], queue.get(4)[:, 0, 0])
+        queue.remove_scratch_file()
+
+    def test_spilling_does_not_block_consumer(self):
+        """Test that the consumer can release frames while frames are written to disk"""
+        queue = FrameQueue(FrameBuffer(2, 2, 3), spill=True)
+        queue.put([np.zeros((2, 3))] * 3)
+        writing, resume = Event(), Event()
+        write = queue.scratch_writer.write
+
+        def slow_write(data):
+            writing.set()
+            resume.wait(5)
+            return write(data)
+
+        queue.scratch_writer.write = slow_write
+        producer = Thread(target=queue.put, args=([np.ones((2, 3))],))
+        producer.start()
+        self.assertTrue(writing.wait(5))
+        self.assertEqual(2, len(queue.get(2)))
+        queue.release(2)
+        self.assertEqual(1, queue.pending())
+        resume.set()
+        producer.join(timeout=5)
+        np.testing.assert_array_equal([0, 1], queue.get(2)[:, 0, 0])
+        queue.remove_scratch_file()
+
+    def test_close_wakes_consumer(self):
+        """Test that a consumer waiting for frames is woken up when the queue closes"""
+        queue = FrameQueue(FrameBuffer(4, 2, 3))
+        consumer = Thread(target=queue.wait, args=(lambda: queue.closed,))
+        consumer.start()
+        queue.close()
+        consumer.join(timeout=5)
+        self.assertFalse(consumer.is_alive())
+
+
+class TestFrameLog(unittest.TestCase):
+    def test_append_counts_dropped_frames(self):
+        """Test that gaps and repeats in the framegrabber indices are counted"""
+        log = FrameLog(capacity=2)
+        log.append([0, 1, 2], 1.0)
+        log.append([4, 4, 5], 2.0)
+        self.assertEqual(6, log.count)
+        self.assertEqual(1, log.dropped_frames)
+        self.assertEqual(1, log.duplicated_frames)
+        np.testing.assert_array_equal([1, 1, 1, 2, 2, 2], log.get()["timestamp"])
+
+
+class TestBaselineAccumulator(unittest.TestCase):
+    def test_statistics_match_baseline_frames(self):
+        """Test that the running statistics of each light match those of the window frames"""
+        frames = np.random.default_rng(0).integers(0, 4096, (20, 2, 3), dtype=np.uint16)
+        accumulator = BaselineAccumulator()
+        accumulator.start(3, (2, 3), 4, 17)
+        accumulator.add(list(frames[:4]), 0)
+        self.assertIsNone(accumulator.sum)
+        for first_index in range(0, 20, 6):
+            accumulator.add(list(frames[first_index : first_index + 6]), first_index)
+        for light_index in range(3):
+            window = frames[4:17][(light_index - 4) % 3 :: 3].astype(float)
+            np.testing.assert_allclose(
+                window.mean(axis=0), accumulator.mean()[light_index]
+            )
+            np.testing.assert_allclose(
+                window.var(axis=0), accumulator.variance()[light_index]
+            )
+            np.testing.assert_array_equal(
+                window.min(axis=0), accumulator.minimum[light_index]
+            )
+            np.testing.assert_array_equal(
+                window.max(axis=0), accumulator.maximum[light_index]
+            )
+
+    def test_released_window_is_not_allocated_again(self):
+        """Test that a window read and released frees its statistics for good"""
+        frames = np.ones((6, 2, 3), dtype=np.uint16)
+        accumulator = BaselineAccumulator()
+        accumulator.start(2, (2, 3), 0, 6)
+        accumulator.add(list(frames[:3]), 0)
+        accumulator.release()
+        self.assertIsNone(accumulator.sum)
+        accumulator.add(list(frames[3:]), 3)
+        self.assertIsNone(accumulator.sum)
+
+
+class TestLatestFrames(unittest.TestCase):
+    def test_update_keeps_last_frame_of_each_light(self):
+        """Test that each light channel holds its most recent frame"""
+        latest = LatestFrames()
+        latest.reset(3, (2, 3))
+        self.assertIsNone(latest.get(0))
+        latest.update([np.full((2, 3), i) for i in range(4)], 0)
+        latest.update([np.full((2, 3), i) for i in range(4, 6)], 4)
+        self.assertEqual([3, 4, 5], [latest.get(i)[0, 0] for i in range(3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
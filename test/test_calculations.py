@@ -35,6 +35,78 @@ class TestData(unittest.TestCase):
         )
         pass
 
+    def test_acquisition_window_encloses_roi(self):
+        """Test that the acquisition window is aligned and encloses the ROI"""
+        self.assertEqual(
+            (100, 16, 50, 32),
+            calc.acquisition_window((20.4, 45.6, 99.6, 150.2), 512),
+        )
+        self.assertEqual(
+            (0, 0, 512, 512), calc.acquisition_window((-5, 600, -5, 600), 512)
+        )
+
+    def test_crop_frames_without_copy(self):
+        """Test that arrays are cropped as views and lists only when accessed"""
+        frames = np.arange(4 * 5 * 6).reshape(4, 5, 6)
+        cropped = calc.crop_frames(frames, (1.2, 4.4, 0.6, 3))
+        self.assertTrue(np.shares_memory(cropped, frames))
+        np.testing.assert_array_equal(frames[:, 1:3, 1:4], cropped)
+        lazy = calc.crop_frames(list(frames), (1.2, 4.4, 0.6, 3))
+        self.assertEqual((4, 2, 3), lazy.shape)
+        np.testing.assert_array_equal(frames[1:3, 1:3, 1:4], lazy[1:3])
+        np.testing.assert_array_equal(frames[2, 1:3, 1:4], lazy[2])
+
+    def test_bin_frames_sums_blocks(self):
+        """Test that software binning sums square blocks of pixels without overflow"""
+        frames = np.full((2, 9, 8), 4095, dtype=np.uint16)
+        frames[1, 0, 1] = 0
+        binned = calc.bin_frames(frames, 4)
+        self.assertEqual((2, 2, 2), binned.shape)
+        self.assertEqual(np.uint32, binned.dtype)
+        np.testing.assert_array_equal([16 * 4095, 15 * 4095], binned[:, 0, 0])
+
+    def test_frame_metadata_follows_exposures(self):
+        """Test that each frame gets the light, sample and stimuli of its exposure"""
+        camera = np.array([0, 1, 1, 0, 1, 1, 0, 1, 1, 0, 0])
+        lights = np.array(
+            [[0, 1, 1, 0, 0, 0, 0, 1, 1, 0, 0], [0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0]]
+        )
+        stimuli = [np.arange(11), np.zeros(11), camera * (np.arange(11) > 5)]
+        records = calc.frame_metadata(
+            lights, camera, stimuli, [0, 2, 3], [1.0, 2.0, 3.0]
+        )
+        np.testing.assert_array_equal([0, 1, 2], records["frame"])
+        np.testing.assert_array_equal([0, 0, -1], records["light"])
+        np.testing.assert_array_equal([1, 7, -1], records["sample"])
+        np.testing.assert_array_equal([1.5, 7.5, 0], records["stim1"])
+        np.testing.assert_array_equal([0, 1, 0], records["stim3"])
+        np.testing.assert_array_equal([1.0, 2.0, 3.0], records["timestamp"])
+
+    def test_frame_metadata_keeps_exposures_when_first_frame_is_dropped(self):
+        """Test that frames keep their exposure when the first frame was dropped"""
+        camera = np.array([1, 0, 1, 1, 0, 1, 1, 0, 1, 1, 0])
+        lights = np.array(
+            [[1, 0, 1, 1, 0, 0, 0, 0, 1, 1, 0], [0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0]]
+        )
+        stimuli = [np.arange(11), np.zeros(11), np.zeros(11)]
+        records = calc.frame_metadata(lights, camera, stimuli, [1, 2], [1.0, 2.0])
+        np.testing.assert_array_equal([1, 2], records["frame_index"])
+        np.testing.assert_array_equal([2, 5], records["sample"])
+        np.testing.assert_array_equal([0, 1], records["light"])
+        np.testing.assert_array_equal([2.5, 5.5], records["stim1"])
+
+    def test_frame_metadata_counts_an_exposure_on_the_first_sample(self):
+        """Test that a camera signal high on the first sample starts the first exposure"""
+        camera = np.array([1, 1, 0, 1, 1, 0, 1, 1, 0])
+        lights = np.array([[1, 1, 0, 0, 0, 0, 1, 1, 0], [0, 0, 0, 1, 1, 0, 0, 0, 0]])
+        stimuli = [np.zeros(9)] * 3
+        records = calc.frame_metadata(lights, camera, stimuli, [0, 1, 2], [0.0] * 3)
+        np.testing.assert_array_equal([0, 3, 6], records["sample"])
+        np.testing.assert_array_equal([0, 1, 0], records["light"])
+        np.testing.assert_array_equal(
+            [0, 0, 1, 1, 1, 2, 2, 2, 3], calc.frames_acquired_from_camera_signal(camera)
+        )
+
     def test_map_activation(self):
         """Test that the activation is correctly mapped to the baseline"""
         frames = [np.array([[1, 2, 3], [4, 5, 6]]), np.array([[7, 8, 9], [10, 11, 12]])]
@@ -44,6 +116,16 @@ class TestData(unittest.TestCase):
             calc.map_activation(frames, baseline),
         )
 
+    def test_frame_timing_report(self):
+        """Test that dropped, duplicated and missing frames are counted"""
+        frame_indices = np.array([0, 1, 2, 5, 5, 6])
+        timestamps = np.array([0, 0, 0.1, 0.2, 0.3, 0.3])
+        report = calc.frame_timing_report(frame_indices, timestamps, 8, 30)
+        self.assertEqual(2, report["Missing Frames"])
+        self.assertEqual(2, report["Dropped Frames"])
+        self.assertEqual(1, report["Duplicated Frames"])
+        self.assertAlmostEqual(100, report["Read Interval (ms)"]["Max"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,336 @@
+import unittest
+import sys
+import os
+import time
+import tempfile
+from threading import Thread
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src import controls
+from src.controls import Camera, DAQ, Instrument
+from src.calculations import frame_metadata
+from src.simulation import FrameInfo, SimulatedTask, connect_camera
+from src.buffers import BaselineAccumulator, FrameBuffer, FrameQueue, LatestFrames
+from src.recording import FrameWriter
+import numpy as np
+
+
+class StubCamera:
+    def __init__(self, batches):
+        """A framegrabber returning the given batches of frames, one per read"""
+        self.batches = list(batches)
+        self.index = 0
+
+    def get_data_dimensions(self):
+        return (4, 4)
+
+    def wait_for_frame(self, timeout=0.1):
+        pass
+
+    def read_multiple_images(self, return_info=False):
+        frames = self.batches.pop(0) if self.batches else []
+        info = [FrameInfo(self.index + i) for i in range(len(frames))]
+        self.index += len(frames)
+        return (frames, info) if return_info else frames
+
+
+class FullQueue:
+    def __init__(self, daq):
+        """A queue that never has room, the acquisition is stopped on the first put"""
+        self.daq = daq
+        self.stalls, self.frames_spilled = 0, 0
+
+    def put(self, frames, timeout=None):
+        self.daq.stop_signal = True
+        return False
+
+
+class FailingRecording:
+    def __init__(self, path):
+        """A recording whose writes fail as if the disk was full"""
+        self.path = path
+        self.header = {"Dtype": "uint16"}
+
+    def append(self, frames):
+        raise OSError("No space left on device")
+
+    def close(self):
+        pass
+
+    def statistics(self):
+        return {
+            "Encoding": "Raw",
+            "Raw Size (MB)": 0,
+            "Stored Size (MB)": 0,
+            "Encoding Time (s)": 0,
+        }
+
+
+class FlakyRecording(FailingRecording):
+    def __init__(self, path, frames, fail_on=None):
+        """A recording keeping its frames in a list, failing on one of its appends"""
+        super().__init__(path)
+        self.frames, self.fail_on, self.appends = frames, fail_on, 0
+
+    def append(self, frames):
+        self.appends += 1
+        if self.appends == self.fail_on:
+            raise OSError("No space left on device")
+        self.frames.extend(frame[0, 0] for frame in frames)
+
+
+def make_camera():
+    """Return a camera using the simulated backend"""
+    backend = controls.config.get("Camera Backend")
+    controls.config["Camera Backend"] = "Simulated"
+    try:
+        return Camera(controls.config["Ports"]["camera"], "test")
+    finally:
+        controls.config["Camera Backend"] = backend
+
+
+class TestCameraLoop(unittest.TestCase):
+    def test_frames_not_queued_are_counted(self):
+        """Test that frames dropped because the queue stayed full are counted"""
+        camera = make_camera()
+        camera.daq = SimpleNamespace(
+            stop_signal=False,
+            camera_signal=np.zeros(10),
+            start_time=time.time(),
+            sample_rate=3000,
+        )
+        camera.cam = StubCamera([[np.zeros((4, 4))] * 3, [np.zeros((4, 4))] * 2])
+        camera.queue = FullQueue(camera.daq)
+        camera.latest_frames.reset(1, (4, 4))
+        camera.loop(SimpleNamespace(is_task_done=lambda: False))
+        self.assertEqual(5, camera.frames_lost)
+        self.assertEqual(5, camera.frames_read)
+
+    def test_every_baseline_window_is_accumulated(self):
+        """Test that the baseline windows started beforehand get all of their frames"""
+        camera = make_camera()
+        camera.daq = SimpleNamespace(
+            stop_signal=False,
+            camera_signal=np.zeros(10),
+            start_time=time.time(),
+            sample_rate=3000,
+        )
+        camera.cam = StubCamera(
+            [
+                [np.full((4, 4), i, dtype=np.uint16) for i in range(j, j + 4)]
+                for j in range(0, 12, 4)
+            ]
+        )
+        camera.queue = FrameQueue(FrameBuffer(16, 4, 4))
+        camera.latest_frames.reset(2, (4, 4))
+        camera.start_baselines([(0, 4), (6, 10)], 2)
+        done = iter([False, False, False, True])
+        camera.loop(SimpleNamespace(is_task_done=lambda: next(done)))
+        first, second = camera.baseline_accumulators
+        np.testing.assert_array_equal([2, 2], first.counts)
+        np.testing.assert_array_equal([2, 2], second.counts)
+        np.testing.assert_array_equal([7, 8], second.mean()[:, 0, 0])
+
+
+class TestDAQ(unittest.TestCase):
+    def test_light_delays_follow_the_sample_rate(self):
+        """Test that each light is delayed by one frame at any configured rate"""
+        for sample_rate in [1000, 3000]:
+            with mock.patch.dict(
+                controls.config,
+                {"Sample Rate": sample_rate, "Widefield Computer": False},
+            ):
+                daq = DAQ(
+                    "dev1",
+                    [Instrument("port0", "red"), Instrument("port1", "green")],
+                    [],
+                    None,
+                    10,
+                    0.05,
+                )
+            daq.time_values = np.linspace(0, 1, sample_rate, endpoint=False)
+            daq.generate_light_wave()
+            first, second = daq.light_signals
+            self.assertEqual(sample_rate, daq.sample_rate)
+            self.assertEqual(0, np.argmax(first))
+            self.assertEqual(sample_rate // 10, np.argmax(second))
+
+    def test_frame_queue_is_closed_when_the_daq_fails(self):
+        """Test that a DAQ error still ends the threads waiting for frames"""
+        with mock.patch.dict(controls.config, {"Widefield Computer": False}):
+            daq = DAQ("dev1", [], [], None, 10, 0.05)
+        daq.camera = SimpleNamespace(queue=FrameQueue(FrameBuffer(4, 4, 4)))
+
+        def write_waveforms():
+            raise RuntimeError("The task could not start")
+
+        daq.write_waveforms = write_waveforms
+        with self.assertRaises(RuntimeError):
+            daq.run()
+        self.assertTrue(daq.camera.queue.closed)
+
+    def test_every_run_labels_its_frames_from_its_own_start(self):
+        """Test that the framegrabber index kept counting from a previous run is not
+        taken for an exposure of the current run"""
+        camera = make_camera()
+        camera.cam.trigger([])
+        connect_camera("dev1/port0/line4", camera.cam)
+        lights = np.array(
+            [
+                np.tile([0, 1, 1, 0, 0, 0, 0, 0], 5),
+                np.tile([0, 0, 0, 0, 0, 1, 1, 0], 5),
+            ],
+            dtype=bool,
+        )
+        signal = lights.any(axis=0)
+        for run in range(2):
+            camera.frame_log.reset()
+            camera.delete_frames()
+            with SimulatedTask(new_task_name="lights") as task:
+                task.do_channels.add_do_chan("dev1/port0/line0")
+                task.do_channels.add_do_chan("dev1/port0/line4")
+                task.timing.cfg_samp_clk_timing(1000, samps_per_chan=len(signal))
+                task.write([signal, signal])
+                task.start()
+                task.wait_until_done()
+            camera.read_frames()
+            records = camera.frame_log.get()
+            metadata = frame_metadata(
+                lights,
+                signal,
+                np.zeros((3, len(signal))),
+                records["frame_index"],
+                records["timestamp"],
+                camera.first_frame_index,
+            )
+            np.testing.assert_array_equal(np.arange(10) % 2, metadata["light"])
+            np.testing.assert_array_equal(np.arange(1, 40, 4), metadata["sample"])
+
+    def test_frame_lights_agree_with_the_light_channels(self):
+        """Test that the light of each frame in the metadata is the light channel
+        used for the preview and the baselines"""
+        with mock.patch.dict(
+            controls.config, {"Sample Rate": 1000, "Widefield Computer": False}
+        ):
+            daq = DAQ(
+                "dev1",
+                [Instrument("port0", "red"), Instrument("port1", "green")],
+                [],
+                None,
+                10,
+                0.05,
+            )
+        daq.time_values = np.linspace(0, 1, 1000, endpoint=False)
+        daq.d_stim_signal = np.zeros(1000, dtype=bool)
+        daq.generate_light_wave()
+        daq.generate_camera_wave()
+        self.assertTrue(daq.camera_signal[0])
+        camera = make_camera()
+        camera.cam.trigger([])
+        connect_camera("dev1/port0/line4", camera.cam)
+        camera.delete_frames()
+        with SimulatedTask(new_task_name="lights") as task:
+            task.do_channels.add_do_chan("dev1/port0/line4")
+            task.timing.cfg_samp_clk_timing(1000, samps_per_chan=1000)
+            task.write([daq.camera_signal])
+            task.start()
+            task.wait_until_done()
+        camera.read_frames()
+        records = camera.frame_log.get()
+        metadata = frame_metadata(
+            daq.light_signals,
+            daq.camera_signal,
+            np.zeros((3, 1000)),
+            records["frame_index"],
+            records["timestamp"],
+            camera.first_frame_index,
+        )
+        self.assertEqual(10, len(metadata))
+        frames = [
+            np.full((2, 2), light, dtype=np.uint16) for light in metadata["light"]
+        ]
+        latest_frames, accumulator = LatestFrames(), BaselineAccumulator()
+        latest_frames.reset(2, (2, 2))
+        latest_frames.update(frames, 0)
+        accumulator.start(2, (2, 2), 0, len(frames))
+        accumulator.add(frames, 0)
+        for light in range(2):
+            np.testing.assert_array_equal(light, latest_frames.get(light))
+            np.testing.assert_array_equal(light, accumulator.mean()[light])
+
+
+class TestCameraSaving(unittest.TestCase):
+    def test_failed_writer_does_not_block_saving(self):
+        """Test that a failing writer ends the live saving and the final save"""
+        camera = make_camera()
+        camera.daq = SimpleNamespace(
+            lights=[], return_lights=lambda: [], framerate=10, exposure=0.01
+        )
+        camera.queue = FrameQueue(FrameBuffer(16, 4, 4))
+        camera.write_batch_size = 2
+        camera.open_writers = lambda directory, append=False: [
+            (FrameWriter(FailingRecording(directory), batch_size=2), 1)
+        ]
+        camera.queue.put([np.zeros((4, 4), dtype=np.uint16)] * 8)
+        camera.queue.close()
+        with tempfile.TemporaryDirectory() as directory:
+            saver = Thread(target=camera.live_save, args=(directory,))
+            saver.start()
+            saver.join(timeout=5)
+            self.assertFalse(saver.is_alive())
+            self.assertTrue(camera.saving_finished.is_set())
+            self.assertIsInstance(camera.saving_error, OSError)
+            final_save = Thread(target=camera.save, args=(directory, None))
+            final_save.start()
+            final_save.join(timeout=5)
+            self.assertFalse(final_save.is_alive())
+            self.assertFalse(camera.manifest.manifest["Complete"])
+
+    def test_frames_of_a_failed_write_are_saved_once(self):
+        """Test that the frames a failed writer did not write are saved afterwards"""
+        camera = make_camera()
+        camera.daq = SimpleNamespace(
+            lights=[], return_lights=lambda: [], framerate=10, exposure=0.01
+        )
+        camera.queue = FrameQueue(FrameBuffer(16, 4, 4))
+        camera.write_batch_size = 2
+        saved = []
+        camera.open_writers = lambda directory, append=False: [
+            (
+                FrameWriter(
+                    FlakyRecording(directory, saved, None if append else 2),
+                    batch_size=2,
+                ),
+                1,
+            )
+        ]
+        camera.queue.put([np.full((4, 4), i, dtype=np.uint16) for i in range(8)])
+        camera.queue.close()
+        with tempfile.TemporaryDirectory() as directory:
+            camera.live_save(directory)
+            self.assertIsInstance(camera.saving_error, OSError)
+            self.assertEqual(2, camera.queue.frames_released)
+            camera.save(directory, None)
+        self.assertEqual(list(range(8)), saved)
+        self.assertEqual(0, camera.queue.pending())
+
+    def test_binned_frames_are_not_packed(self):
+        """Test that 12-bit packing is turned off when pixels are binned"""
+        camera = make_camera()
+        saved = dict(controls.config)
+        try:
+            controls.config["Pack 12-bit Frames"] = True
+            controls.config["Binning"] = 1
+            self.assertTrue(camera.packs_frames())
+            self.assertFalse(camera.packs_frames(2))
+            controls.config["Binning"] = 2
+            self.assertFalse(camera.packs_frames())
+        finally:
+            controls.config.clear()
+            controls.config.update(saved)
+
+
+if __name__ == "__main__":
+    unittest.main()
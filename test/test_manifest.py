@@ -0,0 +1,46 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.manifest import RecordingManifest, recover_recording, MANIFEST_FILE
+from src.recording import RecordingWriter, open_recording, RECORDING_FILE
+import numpy as np
+
+
+class TestManifest(unittest.TestCase):
+    def test_interrupted_recording_is_recovered(self):
+        """Test that a recording is cut back to the frames listed in the manifest"""
+        frames = np.random.default_rng(0).integers(0, 4096, (9, 4, 5), dtype=np.uint16)
+        with tempfile.TemporaryDirectory() as experiment:
+            directory = os.path.join(experiment, "data")
+            os.mkdir(directory)
+            manifest = RecordingManifest(
+                os.path.join(directory, MANIFEST_FILE), {"Lights": ["red", "green"]}
+            )
+            recording = RecordingWriter(
+                os.path.join(directory, RECORDING_FILE), manifest=manifest
+            )
+            recording.append(frames[:3])
+            recording.append(frames[3:6])
+            # Frames written after the last manifest update are not recovered
+            recording.manifest = None
+            recording.append(frames[6:])
+            recording.file.close()
+            with open(os.path.join(directory, MANIFEST_FILE)) as file:
+                chunks = json.load(file)["Files"][RECORDING_FILE]["Chunks"]
+            self.assertEqual([[0, 3], [3, 3]], [chunk[:2] for chunk in chunks])
+            self.assertEqual({RECORDING_FILE: 6}, recover_recording(directory))
+            opened = open_recording(directory)
+            np.testing.assert_array_equal(frames[:6], opened)
+            del opened
+            with open(os.path.join(experiment, "metadata.json")) as file:
+                metadata = json.load(file)
+            self.assertEqual(["red", "green"], metadata["Lights"])
+            self.assertEqual([5, 4], metadata["Dimensions"])
+
+
+if __name__ == "__main__":
+    unittest.main()
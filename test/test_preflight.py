@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.preflight import estimate_recording, preflight
+
+
+class TestPreflight(unittest.TestCase):
+    def test_estimate_recording(self):
+        """Test that the size of the full resolution and binned frames is counted"""
+        estimate = estimate_recording(10, 50, (512, 512))
+        self.assertEqual(500, estimate["Frames"])
+        self.assertEqual(512 * 512 * 2 * 50, estimate["Data Rate"])
+        binned = estimate_recording(10, 50, (512, 512), 2, keep_full_resolution=True)
+        self.assertEqual(512 * 512 * 2 * 5 // 4, binned["Frame Size"])
+        packed = estimate_recording(10, 50, (512, 512), packed=True)
+        self.assertEqual(512 * 768, packed["Frame Size"])
+
+    def test_preflight_refuses_recordings_larger_than_the_disk(self):
+        """Test that an experiment which cannot fit on disk is refused"""
+        with tempfile.TemporaryDirectory() as directory:
+            target = os.path.join(directory, "experiment")
+            small = preflight(target, estimate_recording(1, 1, (4, 4)), probe_size=1e6)
+            self.assertEqual([], small["Errors"])
+            self.assertGreater(small["Write Bandwidth (MB/s)"], 0)
+            self.assertFalse(os.listdir(directory))
+            huge = preflight(
+                target, estimate_recording(1e9, 1e3, (1024, 1024)), probe_size=1e6
+            )
+            self.assertEqual(2, len(huge["Errors"]))
+
+    def test_preflight_refuses_more_frames_than_a_recording_holds(self):
+        """Test that a protocol overflowing the recording index is refused"""
+        estimate = estimate_recording(10, 100, (4, 4))
+        with tempfile.TemporaryDirectory() as directory:
+            fits = preflight(directory, estimate, probe_size=1e6, max_frames=1000)
+            overflows = preflight(directory, estimate, probe_size=1e6, max_frames=999)
+        self.assertEqual([], fits["Errors"])
+        self.assertEqual(1, len(overflows["Errors"]))
+
+    def test_preflight_compares_the_ram_budget_with_the_disk(self):
+        """Test that a RAM budget covering less than a batch write is reported"""
+        estimate = estimate_recording(10, 100, (1024, 1024))
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch("src.preflight.probe_write_bandwidth", return_value=1e9):
+                covered = preflight(
+                    directory, estimate, buffer_frames=200, batch_frames=120
+                )
+                short = preflight(
+                    directory, estimate, buffer_frames=2, batch_frames=120
+                )
+        self.assertEqual(2, covered["RAM Buffer (s)"])
+        self.assertAlmostEqual(
+            120 * 1024 * 1024 * 2 / 1e9, covered["Batch Write Time (s)"]
+        )
+        self.assertEqual([], covered["Warnings"])
+        self.assertEqual(1, len(short["Warnings"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
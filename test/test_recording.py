@@ -0,0 +1,227 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.recording import (
+    RecordingWriter,
+    FrameWriter,
+    pack_12bit,
+    unpack_12bit,
+    compress_frames,
+    decompress_frames,
+    open_recording,
+    read_header,
+    read_index,
+    RECORDING_FILE,
+    CHUNK_INDEX_FILE,
+    index_chunks,
+    combine_statistics,
+    max_compressed_frames,
+)
+from src.calculations import separate_images
+import numpy as np
+
+
+class TestRecording(unittest.TestCase):
+    def test_appended_frames_are_memory_mapped(self):
+        """Test that frames appended in several batches are read back in order"""
+        frames = np.arange(5 * 2 * 3, dtype=np.uint16).reshape(5, 2, 3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, RECORDING_FILE)
+            recording = RecordingWriter(path, preallocated_frames=2)
+            recording.append(frames[:2])
+            recording.append(frames[2:4])
+            recording.close()
+            recording = RecordingWriter(path, append=True)
+            recording.append(frames[4:])
+            recording.close()
+            opened = open_recording(directory)
+            self.assertIsInstance(opened, np.memmap)
+            np.testing.assert_array_equal(frames, opened)
+            self.assertEqual(5, read_header(path)["Frames"])
+            np.testing.assert_array_equal(
+                [[0, 5, read_index(path)[0, 2], frames.nbytes]], read_index(path)
+            )
+            del opened
+
+    def test_writer_writes_every_frame_in_order(self):
+        """Test that frames written in batches by the writer thread are all on disk"""
+        frames = np.arange(11 * 2 * 3, dtype=np.uint16).reshape(11, 2, 3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, RECORDING_FILE)
+            writer = FrameWriter(RecordingWriter(path), batch_size=4, depth=2)
+            for start in range(0, 11, 3):
+                writer.write(frames[start : start + 3])
+            writer.flush()
+            self.assertEqual(11, writer.frames_written)
+            writer.close()
+            np.testing.assert_array_equal(frames, np.array(open_recording(path)))
+
+    def test_writer_raises_write_errors(self):
+        """Test that an error in the writer thread is raised to the caller"""
+        with tempfile.TemporaryDirectory() as directory:
+            recording = RecordingWriter(os.path.join(directory, RECORDING_FILE))
+            writer = FrameWriter(recording, batch_size=2)
+            recording.file.close()
+            writer.write(np.zeros((3, 2, 3), dtype=np.uint16))
+            with self.assertRaises(ValueError):
+                writer.close()
+
+    def test_pack_12bit_round_trip(self):
+        """Test that 12-bit rows of any width are packed in 1.5 bytes per pixel"""
+        for width in [1, 2, 5, 8]:
+            frames = np.random.default_rng(width).integers(
+                0, 4096, (2, 3, width), dtype=np.uint16
+            )
+            packed = pack_12bit(frames)
+            self.assertEqual((2, 3, int(np.ceil(1.5 * width))), packed.shape)
+            np.testing.assert_array_equal(frames, unpack_12bit(packed))
+        with self.assertRaises(ValueError):
+            pack_12bit(np.full((1, 2), 4096))
+
+    def test_packed_recording_is_unpacked(self):
+        """Test that frames of a packed recording are unpacked when accessed"""
+        frames = np.random.default_rng(0).integers(0, 4096, (6, 4, 5), dtype=np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, RECORDING_FILE)
+            recording = RecordingWriter(path, packed=True)
+            recording.append(frames)
+            recording.close()
+            self.assertEqual(6 * 4 * 8, read_header(path)["Data Size"])
+            opened = open_recording(path)
+            self.assertEqual(frames.shape, opened.shape)
+            np.testing.assert_array_equal(frames[4], opened[4])
+            np.testing.assert_array_equal(frames[1::2, :, 1:3], opened[1::2, :, 1:3])
+            np.testing.assert_array_equal(frames, np.asarray(opened))
+            del opened
+
+    def test_compression_round_trip(self):
+        """Test that every codec and filter restores the frames exactly"""
+        frames = np.random.default_rng(0).integers(0, 65536, (3, 4, 5), dtype=np.uint16)
+        for codec in ["zlib", "lzma"]:
+            for frame_filter in ["Shuffle", "Delta", "None"]:
+                data = compress_frames(frames, codec, 1, frame_filter)
+                np.testing.assert_array_equal(
+                    frames,
+                    decompress_frames(
+                        data, frames.shape, np.uint16, codec, frame_filter
+                    ),
+                )
+
+    def test_compressed_recording_is_decompressed(self):
+        """Test that frames of a compressed recording are decompressed when accessed"""
+        frames = np.random.default_rng(0).integers(0, 16, (10, 4, 5), dtype=np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, RECORDING_FILE)
+            recording = RecordingWriter(path, compression="zlib", compression_chunk=3)
+            recording.append(frames[:7])
+            recording.close()
+            recording = RecordingWriter(path, append=True)
+            recording.append(frames[7:])
+            recording.close()
+            self.assertEqual(4, read_header(path)["Index Entries"])
+            self.assertGreater(recording.statistics()["Compression Ratio"], 1)
+            opened = open_recording(path)
+            self.assertEqual(frames.shape, opened.shape)
+            np.testing.assert_array_equal(frames[4], opened[4])
+            np.testing.assert_array_equal(frames[2:9, 1:3], opened[2:9, 1:3])
+            np.testing.assert_array_equal(frames, np.asarray(opened))
+            del opened
+
+    def test_strided_frames_are_read_lazily(self):
+        """Test that selecting every n-th frame only reads the chunks accessed"""
+        frames = np.random.default_rng(0).integers(0, 16, (12, 4, 5), dtype=np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, RECORDING_FILE)
+            recording = RecordingWriter(path, compression="zlib", compression_chunk=2)
+            recording.append(frames)
+            recording.close()
+            opened = open_recording(path)
+            with mock.patch.object(
+                opened, "read_chunk", wraps=opened.read_chunk
+            ) as read_chunk:
+                separated = separate_images(["Red", "Green", "Blue"], opened)
+                self.assertEqual(0, read_chunk.call_count)
+                self.assertEqual((4, 4, 5), separated[1].shape)
+                np.testing.assert_array_equal(frames[4], separated[1][1])
+                self.assertEqual(1, read_chunk.call_count)
+            np.testing.assert_array_equal(frames[2::3], np.asarray(separated[2]))
+            del opened
+
+    def test_compressed_index_capacity_is_known(self):
+        """Test that a compressed recording fills its index after the frames announced"""
+        frames = np.zeros((5, 2, 2), dtype=np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, RECORDING_FILE)
+            recording = RecordingWriter(path, compression="zlib", compression_chunk=2)
+            with mock.patch("src.recording.INDEX_CAPACITY", 7):
+                max_frames = max_compressed_frames(5, compression_chunk=2)
+                for _ in range(max_frames // 5):
+                    recording.append(frames)
+                with self.assertRaises(ValueError):
+                    recording.append(frames)
+            recording.close()
+            self.assertEqual(10, max_frames)
+
+    def test_statistics_of_recordings_are_combined(self):
+        """Test that sizes add up and only encoded frames count in the throughput"""
+        frames = np.random.default_rng(0).integers(0, 16, (6, 4, 6), dtype=np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            raw = RecordingWriter(os.path.join(directory, "raw.raw"))
+            compressed = RecordingWriter(
+                os.path.join(directory, "compressed.raw"), compression="zlib"
+            )
+            for recording in [raw, compressed]:
+                recording.append(frames)
+                recording.close()
+            self.assertNotIn("Encoding Throughput (MB/s)", raw.statistics())
+            combined = combine_statistics([raw.statistics(), compressed.statistics()])
+            self.assertEqual("Raw, Compressed", combined["Encoding"])
+            self.assertAlmostEqual(2 * frames.nbytes / 1e6, combined["Raw Size (MB)"])
+            self.assertEqual(
+                compressed.statistics()["Encoding Throughput (MB/s)"],
+                combined["Encoding Throughput (MB/s)"],
+            )
+
+    def test_chunked_folders_are_read_in_order(self):
+        """Test that the NPY chunks of older acquisitions are concatenated by number"""
+        with tempfile.TemporaryDirectory() as directory:
+            for index in range(11):
+                np.save(
+                    os.path.join(directory, f"{index}.npy"),
+                    np.full((1, 2, 3), index, dtype=np.uint16),
+                )
+            np.testing.assert_array_equal(
+                list(range(11)), open_recording(directory)[:, 0, 0]
+            )
+
+    def test_chunk_index_maps_frames_to_chunks(self):
+        """Test that the chunk index is saved and used to seek any frame"""
+        frames = np.arange(7 * 2 * 3, dtype=np.uint16).reshape(7, 2, 3)
+        with tempfile.TemporaryDirectory() as directory:
+            for index, (start, stop) in enumerate([(0, 3), (3, 5), (5, 7)]):
+                np.save(os.path.join(directory, f"{index}.npy"), frames[start:stop])
+            index = index_chunks(directory)
+            self.assertTrue(os.path.exists(os.path.join(directory, CHUNK_INDEX_FILE)))
+            self.assertEqual(
+                [0, 3, 5], [chunk["First Frame"] for chunk in index["Chunks"]]
+            )
+            opened = open_recording(directory)
+            self.assertEqual(frames.shape, opened.shape)
+            np.testing.assert_array_equal(frames[4], opened[4])
+            np.testing.assert_array_equal(frames[2:6, 1], opened[2:6, 1])
+            np.save(os.path.join(directory, "3.npy"), frames[:1])
+            self.assertEqual(8, index_chunks(directory)["Frames"])
+            np.save(os.path.join(directory, "1.npy"), frames[3:4])
+            index = index_chunks(directory)
+            self.assertEqual(7, index["Frames"])
+            self.assertEqual(
+                [0, 3, 4, 6], [chunk["First Frame"] for chunk in index["Chunks"]]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.simulation import (
+    SimulatedCamera,
+    SimulatedTask,
+    SimulatedTimeoutError,
+    connect_camera,
+)
+from src.calculations import frames_acquired_from_camera_signal
+import numpy as np
+
+
+class TestSimulatedCamera(unittest.TestCase):
+    def test_frames_match_window(self):
+        """Test that frames are 12-bit and have the size of the acquisition window"""
+        camera = SimulatedCamera(framerate=1000, size=64)
+        camera.set_grabber_attribute_value("IMG_ATTR_ACQWINDOW_HEIGHT", 32)
+        camera.setup_acquisition()
+        camera.start_acquisition()
+        camera.wait_for_frame(timeout=1)
+        frames = camera.read_multiple_images()
+        self.assertGreater(len(frames), 0)
+        self.assertEqual((32, 64), frames[0].shape)
+        self.assertEqual(np.uint16, frames[0].dtype)
+        self.assertLessEqual(frames[0].max(), 4095)
+
+    def test_buffer_overflow_skips_frames(self):
+        """Test that frames not read before the buffer is full are lost"""
+        camera = SimulatedCamera(framerate=1000, size=8)
+        camera.setup_acquisition(nframes=10)
+        camera.start_acquisition()
+        time.sleep(0.05)
+        frames, frame_info = camera.read_multiple_images(return_info=True)
+        self.assertEqual(10, len(frames))
+        self.assertGreater(frame_info[0].frame_index, 0)
+
+    def test_wait_times_out_when_stopped(self):
+        """Test that waiting for a frame raises a timeout when acquisition is stopped"""
+        camera = SimulatedCamera(size=8)
+        with self.assertRaises(SimulatedTimeoutError):
+            camera.wait_for_frame(timeout=0.01)
+
+
+class TestSimulatedTask(unittest.TestCase):
+    def test_pulses_trigger_camera(self):
+        """Test that the camera acquires one frame per pulse counted in its line"""
+        # The line idles low, so the first pulse of the second signal is an exposure
+        # even though it is already high on the first sample
+        for pattern, frames in [
+            ([False, True, True, False], 5),
+            ([True, True, False, False], 5),
+        ]:
+            camera = SimulatedCamera(size=8)
+            connect_camera("dev1/port0/line4", camera)
+            camera.start_acquisition()
+            signal = np.tile(pattern, 5)
+            with SimulatedTask(new_task_name="lights") as task:
+                task.do_channels.add_do_chan("dev1/port0/line0")
+                task.do_channels.add_do_chan("dev1/port0/line4")
+                task.timing.cfg_samp_clk_timing(1000, samps_per_chan=len(signal))
+                task.write([signal, signal])
+                task.start()
+                task.wait_until_done()
+                self.assertTrue(task.is_task_done())
+                self.assertEqual(frames, camera.acquired_count())
+                self.assertEqual(
+                    frames_acquired_from_camera_signal(signal)[-1],
+                    camera.acquired_count(),
+                )
+            self.assertEqual(frames, len(camera.read_multiple_images()))
+
+    def test_done_event_is_called(self):
+        """Test that the registered callback is called once the samples are generated"""
+        calls = []
+        task = SimulatedTask()
+        task.ao_channels.add_ao_voltage_chan("dev1/ao0")
+        task.timing.cfg_samp_clk_timing(1000, samps_per_chan=10)
+        task.write(np.zeros(10))
+        task.register_done_event(lambda *args: calls.append(args) or 0)
+        task.start()
+        time.sleep(0.1)
+        task.close()
+        self.assertEqual(1, len(calls))
+
+
+if __name__ == "__main__":
+    unittest.main()
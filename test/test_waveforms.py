@@ -0,0 +1,188 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.waveforms import (
+    random_square,
+    make_signal,
+    SignalCache,
+    compile_signal,
+    compile_digital_signal,
+    compile_protocol,
+)
+import numpy as np
+
+
+def reference_random_square(time, pulses, width, jitter):
+    """The pulse by pulse implementation random_square has to reproduce"""
+    pulse_signal = np.zeros(len(time))
+    buffer = (float(width) + jitter, float(time[-1] - width - jitter))
+    uniform_distribution = np.linspace(*buffer, pulses)
+    random_numbers = np.around(np.random.uniform(-jitter, jitter, pulses), 3)
+    randomized_distribution = uniform_distribution + random_numbers
+    for value in randomized_distribution:
+        pulse_signal[(time > value - width / 2) & (time < value + width / 2)] = 5
+    return pulse_signal
+
+
+class TestWaveforms(unittest.TestCase):
+    def test_random_square_matches_reference(self):
+        """Test that the pulses are the same as those of the reference for a seed"""
+        for start, pulses, width, jitter in [
+            (0, 20, 0.2, 0.5),
+            (3.7, 50, 0.05, 0.01),
+            (0, 40, 1, 0.3),
+        ]:
+            time = np.linspace(start, start + 30, 90000)
+            for seed in range(3):
+                np.random.seed(seed)
+                expected = reference_random_square(time, pulses, width, jitter)
+                np.testing.assert_array_equal(
+                    expected, random_square(time, pulses, width, jitter, seed)
+                )
+
+    def test_random_square_uses_global_state_without_seed(self):
+        """Test that the global random state is used when no seed is given"""
+        time = np.linspace(0, 10, 30000)
+        np.random.seed(4)
+        expected = reference_random_square(time, 10, 0.3, 0.2)
+        np.random.seed(4)
+        np.testing.assert_array_equal(expected, random_square(time, 10, 0.3, 0.2))
+
+
+class TestSignalCache(unittest.TestCase):
+    def test_signals_are_compiled_once(self):
+        """Test that a signal is computed once for each set of parameters"""
+        cache = SignalCache()
+        first = compile_signal(2, 100, "square", 0, 0, 0, 5, 0.5, 3, cache=cache)
+        second = compile_signal(2, 100, "square", 0, 0, 0, 5, 0.5, 3, cache=cache)
+        self.assertIs(first, second)
+        self.assertFalse(first.flags.writeable)
+        np.testing.assert_array_equal(
+            make_signal(np.linspace(0, 2, 200), "square", 0, 0, 0, 5, 0.5, 3), first
+        )
+        compile_digital_signal(2, 100, 5, 0.5, cache=cache)
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_random_pulses_are_not_cached(self):
+        """Test that random pulses are drawn again, from their seed if it is given"""
+        cache = SignalCache()
+        parameters = (2, 100, "random-square", 0.1, 5, 0.2, 0, 0, 0)
+        compile_signal(*parameters, cache=cache)
+        seeded = compile_signal(*parameters, seed=1, cache=cache)
+        self.assertEqual(0, len(cache.signals))
+        np.testing.assert_array_equal(
+            seeded, compile_signal(*parameters, seed=1, cache=cache)
+        )
+        self.assertFalse(
+            np.array_equal(seeded, compile_signal(*parameters, seed=2, cache=cache))
+        )
+
+    def test_least_recently_used_signals_are_evicted(self):
+        """Test that the cache stays within its size by evicting the oldest signals"""
+        cache = SignalCache(max_bytes=2 * 100 * 8)
+        for frequency in [1, 2, 1, 3]:
+            compile_signal(1, 100, "square", 0, 0, 0, frequency, 0.5, 1, cache=cache)
+        self.assertEqual([1, 3], [key[4] for key in cache.signals])
+        self.assertEqual(2 * 100 * 8, cache.size)
+
+
+def stimulation(duration, canal1=False, type1="", canal3=False):
+    """Return the JSON representation of a stimulation on the first and third channels"""
+    return {
+        "type": "Stimulation",
+        "name": "stimulation",
+        "duration": duration,
+        "canal1": canal1,
+        "canal2": False,
+        "canal3": canal3,
+        "type1": type1,
+        "pulses": 5,
+        "jitter": 0.1,
+        "width": 0.2,
+        "freq": 2,
+        "duty": 0.5,
+        "heigth": 3,
+        **{f"{key}2": 0 for key in ["pulses", "jitter", "width", "freq", "duty"]},
+        "type2": "",
+        "heigth2": 0,
+        "type3": "square",
+        "pulses3": 0,
+        "jitter3": 0,
+        "width3": 0,
+        "freq3": 5,
+        "duty3": 0.5,
+        "heigth3": 5,
+    }
+
+
+class TestCompileProtocol(unittest.TestCase):
+    def setUp(self):
+        self.protocol = {
+            "type": "Block",
+            "name": "root",
+            "iterations": 1,
+            "delay": 0,
+            "jitter": 0,
+            "data": [
+                {
+                    "type": "Block",
+                    "name": "trials",
+                    "iterations": 3,
+                    "delay": 1,
+                    "jitter": 0.5,
+                    "data": [
+                        stimulation(2, True, "random-square", True),
+                        stimulation(1),
+                    ],
+                }
+            ],
+        }
+
+    def test_protocol_is_regenerated_from_its_seed(self):
+        """Test that the same seed gives the same delays and pulses"""
+        time_values, signals = compile_protocol(self.protocol, 100, seed=7)
+        same_time_values, same_signals = compile_protocol(self.protocol, 100, seed=7)
+        np.testing.assert_array_equal(time_values, same_time_values)
+        for signal, same_signal in zip(signals, same_signals):
+            np.testing.assert_array_equal(signal, same_signal)
+        other_time_values, _ = compile_protocol(self.protocol, 100, seed=8)
+        self.assertNotEqual(time_values[-1], other_time_values[-1])
+
+    def test_iterations_and_delays(self):
+        """Test that each iteration is followed by the block delay and its jitter"""
+        time_values, (stim1, stim2, stim3) = compile_protocol(self.protocol, 100, 7)
+        self.assertEqual(len(time_values), len(stim1))
+        self.assertEqual(len(time_values), len(stim2))
+        self.assertEqual(bool, stim3.dtype)
+        self.assertGreaterEqual(time_values[-1], 3 * (2 + 1 + 1))
+        self.assertLessEqual(time_values[-1], 3 * (2 + 1 + 1.5))
+        self.assertFalse(np.any(stim2))
+        self.assertEqual({0, 5}, set(np.unique(stim1)))
+
+    def test_baselines_are_located(self):
+        """Test that the samples of the baseline stimulations are returned"""
+        baseline = dict(stimulation(1), baseline=True)
+        protocol = dict(self.protocol, data=[baseline, *self.protocol["data"]])
+        time_values, signals, baselines = compile_protocol(
+            protocol, 100, 7, return_baselines=True
+        )
+        same_time_values, _ = compile_protocol(protocol, 100, 7)
+        np.testing.assert_array_equal(time_values, same_time_values)
+        self.assertEqual([[0, 100]], baselines)
+        self.assertFalse(np.any(signals[0][:100]))
+
+    def test_signals_follow_the_sample_rate(self):
+        """Test that the same protocol lasts as long at any sample rate"""
+        time_values, (_, _, stim3) = compile_protocol(self.protocol, 100, 7)
+        fast_time_values, (_, _, fast_stim3) = compile_protocol(self.protocol, 1000, 7)
+        self.assertEqual(time_values[-1], fast_time_values[-1])
+        self.assertEqual(10 * len(time_values), len(fast_time_values))
+        self.assertAlmostEqual(
+            np.sum(stim3) / 100, np.sum(fast_stim3) / 1000, delta=0.1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()